@@ -1,5 +1,8 @@
 import hashlib
 import json
+import sqlite3
+import threading
+from pathlib import Path
 from typing import Dict, Optional
 import time
 
@@ -57,5 +60,59 @@ class SimpleCache:
         """Get current cache size."""
         return len(self.cache)
 
+class CompletionCache:
+    """
+    Persistent cache of LLM completions keyed by hash(model, prompt, temperature, max_tokens).
+    Past max_entries the least recently used completions are evicted.
+    """
+    
+    def __init__(self, path: str, max_entries: int = 1000):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+        self.conn.commit()
+    
+    @staticmethod
+    def key(model: str, prompt, temperature: float, max_tokens: int) -> str:
+        """prompt is anything JSON-serializable: a message list or a normalized request."""
+        payload = json.dumps([model, prompt, temperature, max_tokens], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute("SELECT content FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return row[0]
+    
+    def put(self, key: str, content: str) -> None:
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO completions (key, content, last_used) VALUES (?, ?, ?)",
+                (key, content, time.time())
+            )
+            self.conn.execute(
+                "DELETE FROM completions WHERE key NOT IN "
+                "(SELECT key FROM completions ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self.conn.commit()
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+    
+    def close(self):
+        self.conn.close()
+
 # Global cache instance
 response_cache = SimpleCache(max_size=50, ttl_seconds=1800)  # 30 minutes TTL
@@ -0,0 +1,52 @@
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+
+# Whole queries that only point at a clause: "show me 4.2.1", "what does section 7.3 say?"
+CLAUSE_QUERY = re.compile(
+    r"^\s*(?:(?:please\s+)?(?:show|give|display|quote|read|print|open|get|find)(?:\s+me)?\s+"
+    r"|what\s+(?:does|do|is\s+in|is|'s\s+in)\s+|what's\s+in\s+)?"
+    r"(?:the\s+)?(?:(?P<kind>section|clause|sec\.?|§)\s*)?(?P<number>\d+(?:\.\d+)*)\.?"
+    r"(?:\s+(?:say|says|state|states|cover|covers|contain|contains))?\s*[?.!]*\s*$",
+    re.IGNORECASE
+)
+
+
+class ClauseIndex:
+    """Clause number -> verbatim clause text, heading path, pages and chunks, built at ingestion."""
+
+    def __init__(self, clauses: Optional[List[Dict]] = None):
+        self.by_number: Dict[str, List[Dict]] = defaultdict(list)
+        for clause in clauses or []:
+            self.by_number[clause["clause"]].append(clause)
+        # Clauses are stored in document order, so a parent's sub-clauses follow it
+        self.descendants: Dict[str, List[Dict]] = defaultdict(list)
+        for clause in clauses or []:
+            parts = clause["clause"].split(".")
+            for depth in range(1, len(parts)):
+                self.descendants[".".join(parts[:depth])].append(clause)
+
+    def __len__(self) -> int:
+        return sum(len(clauses) for clauses in self.by_number.values())
+
+    def match_query(self, query: str) -> Optional[str]:
+        """The clause number a query asks for verbatim, or None for any other question."""
+        match = CLAUSE_QUERY.match(query)
+        if not match:
+            return None
+        number = match.group("number")
+        # A bare "7" is too ambiguous without "section" or "clause" in front of it
+        if not match.group("kind") and "." not in number:
+            return None
+        return number if number in self.by_number else None
+
+    def lookup(self, number: str, doc_ids: Optional[List[str]] = None) -> List[Dict]:
+        """The clause followed by its sub-clauses, per document, in document order."""
+        clauses = self.by_number.get(number, []) + self.descendants.get(number, [])
+        if doc_ids:
+            clauses = [clause for clause in clauses if clause["doc_id"] in doc_ids]
+        doc_order = {}
+        for clause in clauses:
+            doc_order.setdefault(clause["doc_id"], len(doc_order))
+        return sorted(clauses, key=lambda clause: doc_order[clause["doc_id"]])
@@ -0,0 +1,110 @@
+import re
+from collections import Counter
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from .rate_limit import count_tokens
+from .sentences import sentence_spans
+
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Share of a sentence's score from embedding similarity when sentence embeddings exist
+EMBEDDING_WEIGHT = 0.5
+
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    spread = scores.max() - scores.min()
+    return (scores - scores.min()) / spread if spread > 0 else np.zeros_like(scores)
+
+
+class ContextCompressor:
+    """
+    Cuts the chunks chosen for an answer down to the sentences that bear on the
+    question. Sentences are scored by BM25 against the query, using the corpus
+    IDF, blended with cosine similarity to the query embedding when ingestion
+    stored sentence embeddings. The best fill the token budget and each chunk
+    keeps them in reading order; chunks left with none are dropped.
+    """
+
+    def __init__(self, idf: Dict[str, float], token_budget: int, sentence_index: Optional[Dict] = None):
+        self.idf = idf
+        self.token_budget = token_budget
+        # offsets/spans/token_counts per chunk row, and optionally embeddings in index space
+        self.sentence_index = sentence_index or {}
+
+    def _sentences(self, chunk: Mapping) -> Tuple[List[Tuple[int, int]], List[int], Optional[np.ndarray]]:
+        row = chunk.get("chunk_index")
+        offsets = self.sentence_index.get("offsets")
+        if offsets is not None and isinstance(row, int) and 0 <= row < len(offsets) - 1:
+            first, last = offsets[row], offsets[row + 1]
+            embeddings = self.sentence_index.get("embeddings")
+            return ([tuple(span) for span in self.sentence_index["spans"][first:last]],
+                    self.sentence_index["token_counts"][first:last].tolist(),
+                    embeddings[first:last] if embeddings is not None else None)
+        spans = sentence_spans(chunk["text"])
+        return spans, [count_tokens(chunk["text"][start:end]) for start, end in spans], None
+
+    def compress(self, query: str, chunks: List[Mapping],
+                 query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
+        candidates = []  # (chunk position, span, tokens)
+        vectors = []
+        for position, chunk in enumerate(chunks):
+            spans, token_counts, embeddings = self._sentences(chunk)
+            candidates.extend((position, span, tokens) for span, tokens in zip(spans, token_counts))
+            vectors.append(embeddings)
+
+        if sum(tokens for _, _, tokens in candidates) <= self.token_budget:
+            return list(chunks)
+
+        # BM25 over the candidate sentences as the documents, with corpus IDF
+        query_terms = set(re.findall(r'\b\w+\b', query.lower()))
+        sentence_terms = [
+            Counter(re.findall(r'\b\w+\b', chunks[position]["text"][start:end].lower()))
+            for position, (start, end), _ in candidates
+        ]
+        lengths = np.array([sum(terms.values()) for terms in sentence_terms], dtype=np.float32)
+        average_length = max(float(lengths.mean()), 1.0)
+        bm25 = np.array([
+            sum(
+                self.idf.get(term, 0.0) * terms[term] * (BM25_K1 + 1)
+                / (terms[term] + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+                for term in query_terms if term in terms
+            )
+            for terms, length in zip(sentence_terms, lengths)
+        ], dtype=np.float32)
+        scores = _min_max(bm25)
+
+        if query_embedding is not None and all(embeddings is not None for embeddings in vectors):
+            query_vector = np.asarray(query_embedding, dtype=np.float32).ravel()
+            similarity = np.concatenate(vectors).astype(np.float32) @ (query_vector / max(np.linalg.norm(query_vector), 1e-12))
+            scores = (1 - EMBEDDING_WEIGHT) * scores + EMBEDDING_WEIGHT * _min_max(similarity)
+
+        # Best sentences first until the budget is spent; the best one is kept regardless
+        selected = []
+        spent = 0
+        for candidate in np.argsort(-scores, kind="stable"):
+            tokens = candidates[candidate][2]
+            if not selected or spent + tokens <= self.token_budget:
+                selected.append(candidate)
+                spent += tokens
+
+        kept_spans: Dict[int, List[Tuple[int, int]]] = {}
+        for candidate in sorted(selected):
+            position, span, _ = candidates[candidate]
+            kept_spans.setdefault(position, []).append(span)
+
+        compressed = []
+        for position, spans in kept_spans.items():
+            text = chunks[position]["text"]
+            # Neighbouring sentences are quoted as one passage, gaps are marked
+            passages = []
+            for start, end in spans:
+                if passages and not text[passages[-1][1]:start].strip():
+                    passages[-1][1] = end
+                else:
+                    passages.append([start, end])
+            compressed.append(dict(chunks[position], text=" … ".join(text[start:end] for start, end in passages),
+                                   compressed=True))
+        return compressed
@@ -12,6 +12,71 @@ class Config:
     API_TOKEN = os.getenv("API_TOKEN")
     NOTION_API_KEY = os.getenv("NOTION_API_KEY")
     
+    # Hybrid retrieval: candidate pool per leg and how the two legs are fused.
+    # FUSION_METHOD is one of: rrf, weighted_rrf, minmax, zscore
+    BM25_TOP_K = int(os.getenv("BM25_TOP_K", "50"))
+    FAISS_TOP_K = int(os.getenv("FAISS_TOP_K", "30"))
+    FUSION_METHOD = os.getenv("FUSION_METHOD", "rrf")
+    FUSION_RRF_K = int(os.getenv("FUSION_RRF_K", "60"))
+    FUSION_BM25_WEIGHT = float(os.getenv("FUSION_BM25_WEIGHT", "1.0"))
+    FUSION_FAISS_WEIGHT = float(os.getenv("FUSION_FAISS_WEIGHT", "1.0"))
+    
+    # FAISS search-time overrides; unset means use the values in the index manifest
+    FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH")) if os.getenv("FAISS_EF_SEARCH") else None
+    FAISS_NPROBE = int(os.getenv("FAISS_NPROBE")) if os.getenv("FAISS_NPROBE") else None
+    # Quantized indexes fetch this many times the candidates for exact float rescoring
+    FAISS_RESCORE_FACTOR = int(os.getenv("FAISS_RESCORE_FACTOR", "4"))
+    # Filtered searches matching at most this many chunks are scored exactly instead of via FAISS
+    FILTER_EXACT_MAX_ROWS = int(os.getenv("FILTER_EXACT_MAX_ROWS", "2048"))
+    
+    # Course and checklist completions persist across restarts; 0 disables the cache
+    COMPLETION_CACHE_ENABLED = os.getenv("COMPLETION_CACHE_ENABLED", "1") != "0"
+    COMPLETION_CACHE_PATH = os.getenv("COMPLETION_CACHE_PATH", os.path.join(DATA_DIR, "completion_cache.sqlite"))
+    COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", "1000"))
+    
+    # Background generation jobs: worker threads, job table and how long finished jobs are kept
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(DATA_DIR, "jobs.sqlite"))
+    JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "168"))
+    
+    # /ask source routing: a trained model (falls back to keyword rules when absent), the
+    # probability of Notion helping above which it is searched, and the traffic log it learns from
+    ROUTER_MODEL_PATH = os.getenv("ROUTER_MODEL_PATH", os.path.join(INDEX_DIR, "query_router.npz"))
+    ROUTER_NOTION_THRESHOLD = float(os.getenv("ROUTER_NOTION_THRESHOLD", "0.5"))
+    ROUTER_LOG_ENABLED = os.getenv("ROUTER_LOG_ENABLED", "1") != "0"
+    ROUTER_LOG_PATH = os.getenv("ROUTER_LOG_PATH", os.path.join(DATA_DIR, "router_log.jsonl"))
+    # Share of logged queries that search both sources regardless of the route, to label training
+    # data; off by default, set it (e.g. 0.05) only while collecting data to retrain the router
+    ROUTER_EXPLORE_RATE = float(os.getenv("ROUTER_EXPLORE_RATE", "0"))
+    
+    # Start Notion search alongside retrieval when the query alone gives Notion at least
+    # NOTION_SPECULATE_THRESHOLD; 0 for ASK_RETRIEVAL_DEADLINE_MS means no deadline
+    NOTION_SPECULATIVE = os.getenv("NOTION_SPECULATIVE", "0") == "1"
+    NOTION_SPECULATE_THRESHOLD = float(os.getenv("NOTION_SPECULATE_THRESHOLD", "0.2"))
+    ASK_RETRIEVAL_DEADLINE_MS = int(os.getenv("ASK_RETRIEVAL_DEADLINE_MS", "0"))
+    
+    # /ask conversation sessions: how many are kept, idle time before one expires, and
+    # how many previous turns each remembers for follow-up questions; shared by workers through SQLite
+    SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(DATA_DIR, "sessions.sqlite"))
+    SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+    SESSION_TTL_MINUTES = float(os.getenv("SESSION_TTL_MINUTES", "30"))
+    SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "6"))
+    
+    # Cut /ask context down to the sentences that best match the question, within this many tokens
+    CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "0") == "1"
+    CONTEXT_COMPRESSION_TOKENS = int(os.getenv("CONTEXT_COMPRESSION_TOKENS", "800"))
+    
+    # Shared OpenAI budget every chat and embedding call is scheduled against
+    LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+    LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    
+    # Team-wide roadmap batches: completions in flight, OpenAI budget and where results are kept
+    TEAM_BATCH_CONCURRENCY = int(os.getenv("TEAM_BATCH_CONCURRENCY", "4"))
+    TEAM_BATCH_REQUESTS_PER_MINUTE = int(os.getenv("TEAM_BATCH_REQUESTS_PER_MINUTE", "60"))
+    TEAM_BATCH_TOKENS_PER_MINUTE = int(os.getenv("TEAM_BATCH_TOKENS_PER_MINUTE", "100000"))
+    PDP_OUTPUT_DIR = os.getenv("PDP_OUTPUT_DIR", os.path.join(DATA_DIR, "pdp"))
+    
     @classmethod
     def validate(cls):
         if not cls.OPENAI_API_KEY:
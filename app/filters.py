@@ -0,0 +1,101 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+class FilterIndex:
+    """
+    Inverted bitsets over chunk rows for scoping retrieval to part of the corpus.
+    Bitsets are packed little-endian, the layout faiss.IDSelectorBitmap reads.
+    """
+
+    def __init__(self, metadata: List[Dict]):
+        self.size = len(metadata)
+        doc_rows = defaultdict(list)
+        heading_rows = defaultdict(list)
+        source_rows = defaultdict(list)
+        self.page_start = np.zeros(self.size, dtype=np.int32)
+        self.page_end = np.zeros(self.size, dtype=np.int32)
+        # Document and top-level heading of each row, for neighbourhood selection
+        self.row_sections = []
+
+        for row, chunk in enumerate(metadata):
+            doc_rows[chunk.get("doc_id")].append(row)
+            headings = chunk.get("headings_path") or []
+            self.row_sections.append((chunk.get("doc_id"), headings[0].strip().lower() if headings else None))
+            for heading in set(chunk.get("headings_path", [])):
+                heading_rows[heading.strip().lower()].append(row)
+            # Notion pages are searched live, so everything indexed came from a PDF
+            source_rows[chunk.get("source", "pdf")].append(row)
+            pages = chunk.get("pages") or [chunk.get("page_start", 0), chunk.get("page_end", 0)]
+            self.page_start[row], self.page_end[row] = pages[0], pages[1]
+
+        self.doc_ids = {doc_id: self._bitset(rows) for doc_id, rows in doc_rows.items()}
+        self.headings = {heading: self._bitset(rows) for heading, rows in heading_rows.items()}
+        self.sources = {source: self._bitset(rows) for source, rows in source_rows.items()}
+
+    def _bitset(self, rows: Iterable[int]) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        mask[list(rows)] = True
+        return np.packbits(mask, bitorder="little")
+
+    def _union(self, bitsets: Iterable[Optional[np.ndarray]]) -> np.ndarray:
+        result = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        for bitset in bitsets:
+            if bitset is not None:
+                result |= bitset
+        return result
+
+    def select(self, doc_ids: Optional[List[str]] = None, sections: Optional[List[str]] = None,
+               page_from: Optional[int] = None, page_to: Optional[int] = None,
+               sources: Optional[List[str]] = None, near: Optional[List[int]] = None) -> Optional[np.ndarray]:
+        """
+        Bitset of chunks matching every given field, where a field matches any of
+        its values. A section matches any heading in the chunk's path that starts
+        with it, case-insensitively, so "SECTION 4" selects "SECTION 4 – ...".
+        Page bounds keep chunks overlapping the range. `near` keeps the given rows
+        and every chunk in the same document and top-level section as one of them.
+        Returns None when no filter is set or the filters keep every chunk, so
+        unrestricted searches skip the bitset path.
+        """
+        selected = []
+        if doc_ids:
+            selected.append(self._union(self.doc_ids.get(doc_id) for doc_id in doc_ids))
+        if sections:
+            prefixes = tuple(section.strip().lower() for section in sections)
+            selected.append(self._union(
+                bitset for heading, bitset in self.headings.items() if heading.startswith(prefixes)
+            ))
+        if sources:
+            selected.append(self._union(self.sources.get(source) for source in sources))
+        if page_from is not None or page_to is not None:
+            # Range predicates are a vectorized comparison rather than a bitset per page
+            mask = np.ones(self.size, dtype=bool)
+            if page_from is not None:
+                mask &= self.page_end >= page_from
+            if page_to is not None:
+                mask &= self.page_start <= page_to
+            selected.append(np.packbits(mask, bitorder="little"))
+        if near:
+            selected.append(self.neighbourhood(near))
+
+        if not selected:
+            return None
+        result = selected[0].copy()
+        for bitset in selected[1:]:
+            result &= bitset
+        if int(np.unpackbits(result, count=self.size, bitorder="little").sum()) == self.size:
+            return None
+        return result
+
+    def neighbourhood(self, rows: Iterable[int]) -> np.ndarray:
+        rows = [row for row in rows if 0 <= row < self.size]
+        result = self._bitset(rows)
+        for doc_id, section in {self.row_sections[row] for row in rows}:
+            if section is not None and doc_id in self.doc_ids:
+                result |= self.doc_ids[doc_id] & self.headings[section]
+        return result
+
+    def rows(self, bitset: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(np.unpackbits(bitset, count=self.size, bitorder="little")).astype(np.int64)
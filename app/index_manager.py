@@ -2,7 +2,7 @@ import json
 import pickle
 import subprocess
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Dict, Iterable, List, Optional
 
 import numpy as np
 import faiss
@@ -10,14 +10,36 @@ from rank_bm25 import BM25Okapi
 
 from .config import Config
 from .retrieval import RetrievalPipeline
+from .clauses import ClauseIndex
+from .router import HR_KEYWORDS, QueryRouter
+from .compression import ContextCompressor
+from .sessions import topic_phrases
+
+
+# Indexes built before the manifest existed are HNSW over raw L2 distances
+LEGACY_MANIFEST = {
+    "index_type": "hnsw",
+    "metric": "l2",
+    "normalized": False,
+    "build_params": {"hnsw_m": 32, "ef_construction": 200},
+    "search_params": {}
+}
 
 
 class IndexManager:
     def __init__(self):
         self.metadata: List[Dict] = []
+        self.chunk_rows: Dict[int, int] = {}
         self.bm25_index: Optional[BM25Okapi] = None
-        self.faiss_index: Optional[faiss.IndexHNSWFlat] = None
+        self.faiss_index: Optional[faiss.Index] = None
+        self.index_manifest: Dict = dict(LEGACY_MANIFEST)
         self.embeddings: Optional[np.ndarray] = None
+        self.projection: Optional[Dict] = None
+        self.clause_index = ClauseIndex()
+        # Subjects a follow-up may name for itself: HR keywords, heading and clause titles
+        self.topic_phrases: List[str] = topic_phrases([], HR_KEYWORDS)
+        self.query_router: Optional[QueryRouter] = None
+        self.context_compressor: Optional[ContextCompressor] = None
         self.retrieval_pipeline: Optional[RetrievalPipeline] = None
         self.indexes_loaded = False
     
@@ -29,26 +51,64 @@ class IndexManager:
             return False
         
         try:
+            self._load_manifest(index_path)
             self._load_metadata(index_path)
             self._load_bm25_index(index_path)
             self._load_faiss_index(index_path)
             self._load_embeddings(index_path)
+            self._load_projection(index_path)
+            self._load_clause_index(index_path)
+            self._load_topic_phrases()
+            self._load_query_router()
+            self._load_context_compressor(index_path)
             
             self.retrieval_pipeline = RetrievalPipeline(
-                self.metadata, self.bm25_index, self.faiss_index, self.embeddings
+                self.metadata, self.bm25_index, self.faiss_index, self.embeddings,
+                manifest=self.index_manifest, projection=self.projection
+            )
+            
+            search_params = self.index_manifest.get("search_params", {})
+            self.retrieval_pipeline.configure_search(
+                ef_search=Config.FAISS_EF_SEARCH or search_params.get("ef_search"),
+                nprobe=Config.FAISS_NPROBE or search_params.get("nprobe")
             )
             
             self.indexes_loaded = True
-            print(f"Loaded indexes with {len(self.metadata)} chunks")
+            print(f"Loaded indexes with {len(self.metadata)} chunks "
+                  f"(faiss={self.index_manifest['index_type']})")
             return True
             
         except Exception as e:
             print(f"Error loading indexes: {e}")
             return False
     
+    def _load_manifest(self, index_path: Path):
+        manifest_path = index_path / "index_manifest.json"
+        if manifest_path.exists():
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self.index_manifest = json.load(f)
+        else:
+            self.index_manifest = dict(LEGACY_MANIFEST)
+    
     def _load_metadata(self, index_path: Path):
         with open(index_path / "metadata.json", "r", encoding="utf-8") as f:
             self.metadata = json.load(f)
+
+        # Indexes built before normalized fields existed get them once at load
+        for chunk in self.metadata:
+            if "text_lower" not in chunk:
+                chunk["text_lower"] = chunk.get("text", "").lower()
+            if "headings_lower" not in chunk:
+                chunk["headings_lower"] = " ".join(chunk.get("headings_path", [])).lower()
+        
+        # chunk_index only equals the row for corpora renumbered at ingestion; older indexes have gaps
+        self.chunk_rows = {}
+        for row, chunk in enumerate(self.metadata):
+            self.chunk_rows.setdefault(chunk.get("chunk_index", row), row)
+    
+    def rows_for_chunks(self, chunk_indices: Iterable[int]) -> List[int]:
+        """Index rows holding the given chunk_index values, skipping ones no longer indexed."""
+        return [self.chunk_rows[index] for index in chunk_indices if index in self.chunk_rows]
     
     def _load_bm25_index(self, index_path: Path):
         with open(index_path / "bm25_index.pkl", "rb") as f:
@@ -58,13 +118,93 @@ class IndexManager:
         self.faiss_index = faiss.read_index(str(index_path / "faiss_index.index"))
     
     def _load_embeddings(self, index_path: Path):
-        self.embeddings = np.load(index_path / "embeddings.npy")
+        # Memory-mapped: only rows touched by rescoring are paged in
+        self.embeddings = np.load(index_path / "embeddings.npy", mmap_mode="r")
+    
+    def _load_projection(self, index_path: Path):
+        reduction = self.index_manifest.get("dimension_reduction") or {}
+        if reduction.get("method") == "pca":
+            with np.load(index_path / "pca.npz") as pca:
+                self.projection = {"mean": pca["mean"], "components": pca["components"]}
+        else:
+            self.projection = None
+    
+    def _load_clause_index(self, index_path: Path):
+        # Indexes built before clause extraction simply have no fast path
+        clause_path = index_path / "clause_index.json"
+        if clause_path.exists():
+            with open(clause_path, "r", encoding="utf-8") as f:
+                self.clause_index = ClauseIndex(json.load(f)["clauses"])
+        else:
+            self.clause_index = ClauseIndex()
+    
+    def _load_topic_phrases(self):
+        headings = {heading for chunk in self.metadata for heading in chunk.get("headings_path", [])}
+        headings.update(clause["title"] for clauses in self.clause_index.by_number.values()
+                        for clause in clauses if clause.get("title"))
+        self.topic_phrases = topic_phrases(headings, HR_KEYWORDS)
+    
+    def _load_query_router(self):
+        # Without a trained router /ask keeps the keyword rules
+        self.query_router = None
+        if not Path(Config.ROUTER_MODEL_PATH).exists():
+            return
+        try:
+            router = QueryRouter.load(Config.ROUTER_MODEL_PATH)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Query router not loaded: {e}")
+            return
+        if router.embedding_dim and router.embedding_dim != self.faiss_index.d:
+            print(f"Query router expects {router.embedding_dim}-dimension embeddings but the index has "
+                  f"{self.faiss_index.d}; retrain it")
+            return
+        self.query_router = router
+    
+    def _load_context_compressor(self, index_path: Path):
+        self.context_compressor = None
+        if not Config.CONTEXT_COMPRESSION:
+            return
+        sentence_index = None
+        sentence_path = index_path / "sentences.npz"
+        if sentence_path.exists():
+            with np.load(sentence_path) as sentences:
+                sentence_index = {name: sentences[name] for name in sentences.files}
+            # A sentence index from before a re-ingest would point into the wrong chunks
+            if len(sentence_index["offsets"]) != len(self.metadata) + 1:
+                print("Sentence index doesn't match the chunks; re-run ingestion to rebuild it")
+                sentence_index = None
+        if sentence_index is not None and "embeddings" in sentence_index:
+            sentence_index["embeddings"] = self._sentence_embeddings(sentence_index["embeddings"])
+            if sentence_index["embeddings"] is None:
+                del sentence_index["embeddings"]
+        self.context_compressor = ContextCompressor(self.bm25_index.idf, Config.CONTEXT_COMPRESSION_TOKENS,
+                                                    sentence_index)
+    
+    def _sentence_embeddings(self, embeddings: np.ndarray) -> Optional[np.ndarray]:
+        """Sentence embeddings in the index's space, after any dimension reduction since ingestion."""
+        dimension = self.faiss_index.d
+        if embeddings.shape[1] != dimension:
+            reduction = self.index_manifest.get("dimension_reduction") or {}
+            if reduction.get("method") == "pca" and self.projection is not None:
+                embeddings = (embeddings.astype(np.float32) - self.projection["mean"]) @ self.projection["components"].T
+            elif reduction.get("method") == "truncate" and embeddings.shape[1] > dimension:
+                embeddings = embeddings[:, :dimension]
+            else:
+                print(f"Sentence embeddings have {embeddings.shape[1]} dimensions but the index has {dimension}; "
+                      f"compression scores by BM25 only")
+                return None
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+            faiss.normalize_L2(embeddings)
+        return embeddings
     
     def run_ingestion(self, pdf_path: str) -> bool:
+        # A directory syncs the whole corpus; a single PDF is added or updated in it.
+        # Index settings and any dimension reduction carry over from the existing manifest
+        source_flag = "--pdf-dir" if Path(pdf_path).is_dir() else "--pdf"
         try:
             result = subprocess.run([
                 "python", "scripts/ingest.py",
-                "--pdf", pdf_path,
+                source_flag, pdf_path,
                 "--output-dir", Config.INDEX_DIR
             ], capture_output=True, text=True, check=True)
             
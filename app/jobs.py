@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional
+
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+class JobQueue:
+    """
+    In-process job runner for long generations. Jobs run on a bounded thread
+    pool and are recorded in SQLite, so clients poll for results instead of
+    holding a connection open, and unfinished jobs resume after a restart.
+    Several server processes can share one job table: a job is claimed with a
+    single conditional UPDATE, and a running job holds a lease its process
+    keeps renewing, so only jobs whose process died are run again.
+    """
+
+    def __init__(self, path: str, workers: int = 2, retention_seconds: float = 7 * 24 * 3600,
+                 lease_seconds: float = 60):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self._handlers: Dict[str, Callable[[Dict], Awaitable[Dict]]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, owner TEXT NOT NULL, "
+            "idempotency_key TEXT UNIQUE, status TEXT NOT NULL, payload TEXT NOT NULL, "
+            "result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+            "lease_expires REAL)"
+        )
+        # Job tables from before leases existed
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        if "lease_expires" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN lease_expires REAL")
+        self.conn.commit()
+
+    def register(self, kind: str, handler: Callable[[Dict], Awaitable[Dict]]):
+        """handler(payload) -> result; both must be JSON-serializable."""
+        self._handlers[kind] = handler
+
+    def start(self):
+        """Re-run queued jobs, and running ones whose process stopped renewing their lease."""
+        with self._lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'queued' WHERE status = 'running' "
+                "AND (lease_expires IS NULL OR lease_expires < ?)",
+                (time.time(),)
+            )
+            rows = self.conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+            self.conn.commit()
+        for row in rows:
+            self._executor.submit(self._run, row["id"])
+
+    def submit(self, kind: str, owner: str, payload: Dict, idempotency_key: Optional[str] = None,
+               reuse_finished: bool = True) -> Dict:
+        """
+        Queue a job, or return the existing one for the same owner, kind and
+        idempotency key. A queued or running duplicate is always reused; a
+        succeeded one only with reuse_finished, and a failed one is retried.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        key = None
+        if idempotency_key is not None:
+            key = hashlib.sha256(json.dumps([kind, owner, idempotency_key]).encode("utf-8")).hexdigest()
+        now = time.time()
+
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?",
+                (now - self.retention_seconds,)
+            )
+            existing = None
+            if key is not None:
+                existing = self.conn.execute("SELECT * FROM jobs WHERE idempotency_key = ?", (key,)).fetchone()
+
+            if existing is not None and (existing["status"] in ("queued", "running")
+                                         or (existing["status"] == "succeeded" and reuse_finished)):
+                self.conn.commit()
+                return self._to_dict(existing)
+
+            if existing is not None:
+                job_id = existing["id"]
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'queued', payload = ?, result = NULL, error = NULL, "
+                    "updated_at = ? WHERE id = ?",
+                    (json.dumps(payload), now, job_id)
+                )
+            else:
+                job_id = uuid.uuid4().hex
+                self.conn.execute(
+                    "INSERT INTO jobs (id, kind, owner, idempotency_key, status, payload, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                    (job_id, kind, owner, key, json.dumps(payload), now, now)
+                )
+            self.conn.commit()
+            job = self._to_dict(self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+        self._executor.submit(self._run, job_id)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.conn.close()
+
+    def _run(self, job_id: str):
+        # Claim and read in one transaction; another process may have claimed it first
+        with self._lock:
+            now = time.time()
+            claimed = self.conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ?, lease_expires = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (now, now + self.lease_seconds, job_id)
+            ).rowcount == 1
+            row = self.conn.execute("SELECT kind, payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            self.conn.commit()
+        if not claimed:
+            return
+
+        finished = threading.Event()
+        threading.Thread(target=self._renew_lease, args=(job_id, finished), daemon=True).start()
+        try:
+            # Each worker thread drives its own event loop, leaving the server's free
+            result = asyncio.run(self._handlers[row["kind"]](json.loads(row["payload"])))
+            update = ("succeeded", json.dumps(result), None)
+        except Exception as e:
+            update = ("failed", None, str(e))
+        finally:
+            finished.set()
+
+        with self._lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                update + (time.time(), job_id)
+            )
+            self.conn.commit()
+
+    def _renew_lease(self, job_id: str, finished: threading.Event):
+        while not finished.wait(self.lease_seconds / 3):
+            try:
+                with self._lock:
+                    self.conn.execute(
+                        "UPDATE jobs SET lease_expires = ? WHERE id = ? AND status = 'running'",
+                        (time.time() + self.lease_seconds, job_id)
+                    )
+                    self.conn.commit()
+            except sqlite3.Error:
+                # The queue was shut down under a running job
+                return
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        return {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "owner": row["owner"],
+            "status": row["status"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"]
+        }
@@ -1,17 +1,28 @@
 import os
 import json
 import time
+import asyncio
+import hashlib
+import random
+import sqlite3
+from typing import Dict, Optional
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
 from .config import Config
-from .models import QueryRequest, QueryResponse, IngestRequest, IngestResponse, HealthResponse, TokenValidationRequest, TokenValidationResponse, TeamMember, TeamResponse, UserTokenValidationRequest, UserTokenValidationResponse, CourseGenerationRequest, CourseGenerationResponse, ChecklistGenerationRequest, ChecklistGenerationResponse
+from .models import QueryRequest, QueryResponse, IngestRequest, IngestResponse, HealthResponse, TokenValidationRequest, TokenValidationResponse, TeamMember, TeamResponse, UserTokenValidationRequest, UserTokenValidationResponse, CourseGenerationRequest, CourseGenerationResponse, ChecklistGenerationRequest, ChecklistGenerationResponse, JobResponse, TeamCourseBatchRequest
 from .index_manager import IndexManager
 from .response_generator import ResponseGenerator
 from .notion_client import NotionClient
 from .auth import verify_token, validate_api_token
 from .logging_utils import log_query, log_ingestion_start, log_ingestion_end, log_error, hash_query
 from .cache import response_cache
+from .jobs import JobQueue, TERMINAL_STATUSES
+from .rate_limit import llm_scheduler
+from .router import RouterLog, keyword_route, route_features, speculate_notion
+from .sessions import SessionStore, is_follow_up, refers_back, rewrite_follow_up
+from .team_batch import TeamCourseBatch, course_payload, current_cycle, load_team
 
 
 async def verify_user_token(authorization: str = Header(None)) -> dict:
@@ -82,11 +93,49 @@ app = create_app()
 index_manager = IndexManager()
 response_generator = ResponseGenerator()
 notion_client = NotionClient()
+job_queue: Optional[JobQueue] = None
+router_log = RouterLog(Config.ROUTER_LOG_PATH) if Config.ROUTER_LOG_ENABLED else None
+try:
+    sessions = SessionStore(Config.SESSION_DB_PATH, Config.SESSION_MAX,
+                            Config.SESSION_TTL_MINUTES * 60, Config.SESSION_MAX_TURNS)
+except (OSError, sqlite3.Error) as e:
+    # Sessions still work within this process, just not across workers or restarts
+    print(f"Session store unavailable, keeping sessions in memory: {e}")
+    sessions = SessionStore(":memory:", Config.SESSION_MAX,
+                            Config.SESSION_TTL_MINUTES * 60, Config.SESSION_MAX_TURNS)
 
 
 @app.on_event("startup")
 async def startup_event():
+    global job_queue
     index_manager.load_indexes()
+    
+    try:
+        job_queue = JobQueue(Config.JOB_DB_PATH, workers=Config.JOB_WORKERS,
+                             retention_seconds=Config.JOB_RETENTION_HOURS * 3600)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Job queue unavailable: {e}")
+        return
+    job_queue.register("course", run_course_job)
+    job_queue.register("checklist", run_checklist_job)
+    job_queue.register("team_courses", run_team_courses_job)
+    job_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if job_queue is not None:
+        job_queue.shutdown()
+
+
+async def within_deadline(awaitable, deadline: Optional[float], default):
+    """Await a result until the time.monotonic() deadline, giving up on it for `default` once it passes."""
+    if deadline is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout=max(deadline - time.monotonic(), 0))
+    except asyncio.TimeoutError:
+        return default
 
 
 @app.post("/ask", response_model=QueryResponse)
@@ -96,67 +145,109 @@ async def ask_question(request: QueryRequest, _: bool = Depends(verify_token)):
     
     start_time = time.time()
     query_hash = hash_query(request.query)
+    filters = request.filters.model_dump(exclude_none=True) if request.filters else {}
+    sources = filters.get("sources") or ["pdf", "notion"]
+    
+    # A follow-up is asked as the question that set its topic plus the follow-up, and one
+    # about "it" or "that" is first searched near the chunks the previous turn retrieved
+    session_id, turns = sessions.open(request.session_id)
+    query, topic, scope = request.query, request.query, filters
+    if turns and is_follow_up(request.query, index_manager.topic_phrases):
+        topic = turns[-1]["topic"]
+        query = rewrite_follow_up(topic, request.query)
+        # Turns record chunk_index values, the filter index works on rows
+        near = index_manager.rows_for_chunks(turns[-1]["chunk_ids"]) if refers_back(request.query) else []
+        if near:
+            scope = dict(filters, near=near)
+    # Filtered answers are cached apart from the unscoped one
+    cache_key = f"{query}\n{json.dumps(scope, sort_keys=True)}" if scope else query
     
     # Check cache first
-    cached_response = response_cache.get(request.query)
+    cached_response = response_cache.get(cache_key)
     if cached_response:
         # Return cached response with minimal latency (cache hit)
         cache_latency = int((time.time() - start_time) * 1000)
         cached_response_copy = cached_response.copy()
         cached_response_copy["latency_ms"] = max(cache_latency, 5)  # Minimum 5ms to show cache hit
-        return QueryResponse(**cached_response_copy)
+        sessions.add_turn(session_id, request.query, topic, cached_response["retrieved_ids"])
+        return QueryResponse(**cached_response_copy, session_id=session_id)
     
+    notion_task = None
     try:
+        # "Show me 4.2.1" is answered straight from the clause index, verbatim
+        clause_number = index_manager.clause_index.match_query(request.query) if "pdf" in sources else None
+        clauses = index_manager.clause_index.lookup(clause_number, filters.get("doc_ids")) if clause_number else []
+        if clauses:
+            answer, citations = response_generator.format_clauses(clauses)
+            retrieved_ids = sorted({index for clause in clauses for index in clause["chunk_indices"]})
+            latency_ms = int((time.time() - start_time) * 1000)
+            log_query(query_hash, retrieved_ids, latency_ms, len(citations))
+            sessions.add_turn(session_id, request.query, request.query, retrieved_ids)
+            return QueryResponse(answer=answer, citations=citations, retrieved_ids=retrieved_ids,
+                                 latency_ms=latency_ms, session_id=session_id)
+        
         # Use max_tokens to determine context size (default 6 chunks for 600 tokens)
         context_chunks = min(6, request.max_tokens // 100)  # Rough estimate
         
-        chunks = await index_manager.retrieval_pipeline.retrieve(
-            request.query, context_chunks
-        )
-        
-        # Check if this query is likely to be found in HR manual or should go to Notion
-        notion_results = []
-        should_try_notion = False
-        
-        # Define HR-related keywords that should stay in HR manual
-        hr_keywords = [
-            'vacation', 'leave', 'sick', 'maternity', 'paternity', 'benefits', 'salary', 'pay',
-            'performance', 'review', 'appraisal', 'disciplinary', 'termination', 'resignation',
-            'probation', 'onboarding', 'training', 'policy', 'procedure', 'employee', 'employment',
-            'workplace', 'hours', 'overtime', 'holiday', 'attendance', 'absence', 'dress code',
-            'code of conduct', 'harassment', 'discrimination', 'safety', 'health', 'insurance',
-            'retirement', 'pension', 'bonus', 'incentive', 'promotion', 'career', 'development'
-        ]
+        deadline = None
+        if Config.ASK_RETRIEVAL_DEADLINE_MS > 0:
+            deadline = time.monotonic() + Config.ASK_RETRIEVAL_DEADLINE_MS / 1000
         
-        query_lower = request.query.lower()
+        # Queries that may well need Notion search it while retrieval runs, instead of after
+        if (Config.NOTION_SPECULATIVE and "pdf" in sources and "notion" in sources
+                and speculate_notion(query, index_manager.query_router)):
+            notion_task = asyncio.create_task(notion_client.search(query, max_results=6))
         
-        # Check if query contains HR-related terms
-        is_hr_related = any(keyword in query_lower for keyword in hr_keywords)
+        chunks, signals = [], {}
+        if "pdf" in sources:
+            chunks, signals = await within_deadline(
+                index_manager.retrieval_pipeline.retrieve_with_signals(query, context_chunks, filters=scope),
+                deadline, ([], {})
+            )
+            # Nothing left near the previous answer, e.g. after a re-ingest: search as usual
+            if not chunks and scope is not filters:
+                chunks, signals = await within_deadline(
+                    index_manager.retrieval_pipeline.retrieve_with_signals(query, context_chunks, filters=filters),
+                    deadline, ([], {})
+                )
         
-        if not chunks:
-            should_try_notion = True
-        elif not is_hr_related:
-            # If query doesn't seem HR-related, try Notion first
-            should_try_notion = True
+        # Decide whether Notion is worth a round trip: learned router when trained, keyword rules otherwise
+        features = route_features(query, chunks, signals) if chunks else None
+        # A question scoped to part of the manual that matched nothing there gets the
+        # no-match answer, rather than one from Notion the user didn't ask for
+        pdf_scoped = any(filters.get(field) is not None for field in ("doc_ids", "sections", "page_from", "page_to"))
+        if "notion" not in sources or (pdf_scoped and not chunks):
+            route = "pdf"
+        elif not chunks:
+            route = "notion"
+        elif index_manager.query_router is not None:
+            route = index_manager.query_router.route(features, signals.get("query_embedding"))
         else:
-            # For HR-related queries, check if chunks are actually relevant
-            max_rrf_score = max(chunk.get("rrf_score", 0) for chunk in chunks)
-            if max_rrf_score < 0.01:  # Very low relevance threshold
-                should_try_notion = True
+            route = keyword_route(query, chunks)
         
-        if should_try_notion:
-            print(f"DEBUG: Trying Notion fallback for query: {request.query}")
-            notion_results = await notion_client.search(request.query, max_results=6)
-            print(f"DEBUG: Notion search returned {len(notion_results)} results")
-            # If we found Notion results, use them instead of HR chunks
-            if notion_results:
+        # While collecting training data, a small share of routed traffic searches both sources
+        # whatever the route, so the router log also sees what Notion adds to queries the current
+        # policy keeps in the manual
+        explore = (router_log is not None and features is not None and "notion" in sources
+                   and random.random() < Config.ROUTER_EXPLORE_RATE)
+        searched = "both" if explore else route
+        
+        notion_results = []
+        if searched != "pdf":
+            notion_results = await within_deadline(
+                notion_task or notion_client.search(query, max_results=6), deadline, []
+            )
+            # A Notion-only route answers from Notion when it found anything
+            if notion_results and searched == "notion":
                 chunks = []
-                print(f"DEBUG: Using Notion results, clearing HR chunks")
-            else:
-                print(f"DEBUG: No Notion results found, using HR chunks")
+        
+        # Only the sentences that bear on the question go to the model; ids still name whole chunks
+        context = chunks
+        if chunks and index_manager.context_compressor is not None:
+            context = index_manager.context_compressor.compress(query, chunks, signals.get("query_embedding"))
         
         answer, citations = await response_generator.generate_response(
-            request.query, chunks, notion_results
+            query, context, notion_results
         )
         
         latency_ms = int((time.time() - start_time) * 1000)
@@ -188,15 +279,34 @@ async def ask_question(request: QueryRequest, _: bool = Depends(verify_token)):
         }
         
         # Cache the response
-        response_cache.put(request.query, response_data)
+        response_cache.put(cache_key, response_data)
+        
+        if router_log is not None and features is not None:
+            if explore:
+                # Both sources were in front of the model, so the ones it cited are the label
+                sources_used = [name for name, marker in (("pdf", "[HR Manual —"), ("notion", "[Notion —"))
+                                if marker in answer]
+            else:
+                sources_used = [name for name, used in (("pdf", chunks), ("notion", notion_results)) if used]
+            answered = not answer.startswith("Not specified")
+            router_log.append(
+                query_hash, features, signals.get("query_embedding"), route,
+                answer_source=("both" if len(sources_used) == 2 else sources_used[0]) if answered and sources_used else None,
+                explore=explore
+            )
         
         log_query(query_hash, retrieved_ids, latency_ms, len(citations))
+        sessions.add_turn(session_id, request.query, topic, retrieved_ids)
         
-        return QueryResponse(**response_data)
+        return QueryResponse(**response_data, session_id=session_id)
         
     except Exception as e:
         log_error("ask_question", str(e))
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+    finally:
+        # A speculative search the route didn't need is abandoned
+        if notion_task is not None and not notion_task.done():
+            notion_task.cancel()
 
 
 @app.post("/ingest", response_model=IngestResponse)
@@ -227,6 +337,12 @@ async def health_check():
     return HealthResponse(ok=index_manager.indexes_loaded)
 
 
+@app.get("/metrics/llm")
+async def llm_metrics():
+    """OpenAI calls in flight, and queue depth and recent queue times per priority class."""
+    return llm_scheduler.stats()
+
+
 @app.post("/validate-token", response_model=TokenValidationResponse)
 async def validate_token_endpoint(request: TokenValidationRequest):
     """Validate API token without requiring authentication."""
@@ -304,23 +420,43 @@ async def get_team_members():
         raise HTTPException(status_code=500, detail=f"Error reading team data: {str(e)}")
 
 
+def course_job_payload(request: CourseGenerationRequest, user_data: dict) -> Dict:
+    """Everything a course generation needs, detached from the request so it can run as a job."""
+    return course_payload(user_data, request.learning_goal, request.use_cache)
+
+
+async def run_course_job(payload: Dict) -> Dict:
+    course_content = await response_generator.generate_course(
+        payload["user_context"], payload["learning_goal"],
+        profile=payload["profile"], use_cache=payload["use_cache"]
+    )
+    return {"course_content": course_content}
+
+
+async def run_checklist_job(payload: Dict) -> Dict:
+    checklist = await response_generator.generate_checklist(
+        payload["generated_course"], use_cache=payload["use_cache"]
+    )
+    return {"checklist": checklist}
+
+
+async def run_team_courses_job(payload: Dict) -> Dict:
+    members = load_team()
+    if payload["members"]:
+        members = [member for member in members if member["name"] in payload["members"]]
+    # Blocks this job's worker thread; the batch runs its own bounded pool underneath
+    return TeamCourseBatch(response_generator).run(
+        members, payload["cycle"], payload["learning_goal"],
+        use_cache=payload["use_cache"], overwrite=payload["overwrite"]
+    )
+
+
 @app.post("/generate-course", response_model=CourseGenerationResponse)
 async def generate_personalized_course(request: CourseGenerationRequest, user_data: dict = Depends(verify_user_token)):
     """Generate a personalized learning course based on user's current skills and learning goals."""
     try:
-        # Build context for OpenAI based on user's current skills and position
-        user_context = f"""
-        User Profile:
-        - Name: {user_data['name']}
-        - Position: {user_data['position']}
-        - Current Hard Skills: {', '.join(user_data['hard_skills'])}
-        - Current Soft Skills: {', '.join(user_data['soft_skills'])}
-
-        Learning Goal: {request.learning_goal}
-        """
-
         # Generate personalized course using OpenAI
-        course_content = await response_generator.generate_course(user_context, request.learning_goal)
+        course_content = (await run_course_job(course_job_payload(request, user_data)))["course_content"]
 
         return CourseGenerationResponse(
             success=True,
@@ -333,12 +469,38 @@ async def generate_personalized_course(request: CourseGenerationRequest, user_da
         raise HTTPException(status_code=500, detail=f"Error generating course: {str(e)}")
 
 
+@app.post("/generate-course/stream")
+async def stream_personalized_course(request: CourseGenerationRequest, user_data: dict = Depends(verify_user_token)):
+    """
+    Server-sent events: a "section" event ({index, html}) for each completed course
+    section, then "done", or "error" if generation fails part way.
+    """
+    payload = course_job_payload(request, user_data)
+    
+    # A plain generator is iterated on the threadpool, so the blocking stream doesn't stall the loop
+    def events():
+        try:
+            sections = response_generator.stream_course(
+                payload["user_context"], payload["learning_goal"],
+                profile=payload["profile"], use_cache=payload["use_cache"]
+            )
+            for index, html in enumerate(sections):
+                yield f"event: section\ndata: {json.dumps({'index': index, 'html': html})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            log_error("stream_course", str(e))
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.post("/generate-checklist", response_model=ChecklistGenerationResponse)
 async def generate_checklist(request: ChecklistGenerationRequest, user_data: dict = Depends(verify_user_token)):
     """Generate a checklist of actionable items from a previously generated course."""
     try:
         # Generate checklist from the course content
-        checklist = await response_generator.generate_checklist(request.generated_course)
+        checklist = (await run_checklist_job(request.model_dump()))["checklist"]
 
         return ChecklistGenerationResponse(
             success=True,
@@ -351,6 +513,117 @@ async def generate_checklist(request: ChecklistGenerationRequest, user_data: dic
         raise HTTPException(status_code=500, detail=f"Error generating checklist: {str(e)}")
 
 
+@app.post("/generate-checklist/stream")
+async def stream_checklist(request: ChecklistGenerationRequest, user_data: dict = Depends(verify_user_token)):
+    """
+    Server-sent events: a "category" event ({index, category}) as each checklist
+    category is complete, then "done", or "error" if generation fails part way.
+    """
+    def events():
+        try:
+            categories = response_generator.stream_checklist(request.generated_course, use_cache=request.use_cache)
+            for index, category in enumerate(categories):
+                yield f"event: category\ndata: {json.dumps({'index': index, 'category': category})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            log_error("stream_checklist", str(e))
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def require_job_queue() -> JobQueue:
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="Job queue not available")
+    return job_queue
+
+
+@app.post("/jobs/generate-course", response_model=JobResponse)
+async def submit_course_job(request: CourseGenerationRequest, user_data: dict = Depends(verify_user_token),
+                            idempotency_key: Optional[str] = Header(None)):
+    """Queue a course generation and return its job; the same user and goal reuse one job."""
+    payload = course_job_payload(request, user_data)
+    job = require_job_queue().submit(
+        "course", user_data["name"], payload,
+        idempotency_key=idempotency_key or json.dumps(payload["profile"], sort_keys=True),
+        reuse_finished=request.use_cache
+    )
+    return JobResponse(**job)
+
+
+@app.post("/jobs/generate-checklist", response_model=JobResponse)
+async def submit_checklist_job(request: ChecklistGenerationRequest, user_data: dict = Depends(verify_user_token),
+                               idempotency_key: Optional[str] = Header(None)):
+    """Queue a checklist generation and return its job; the same course reuses one job."""
+    job = require_job_queue().submit(
+        "checklist", user_data["name"], request.model_dump(),
+        idempotency_key=idempotency_key or hashlib.sha256(request.generated_course.encode("utf-8")).hexdigest(),
+        reuse_finished=request.use_cache
+    )
+    return JobResponse(**job)
+
+
+@app.post("/jobs/generate-team-courses", response_model=JobResponse)
+async def submit_team_courses_job(request: TeamCourseBatchRequest, user_data: dict = Depends(verify_user_token),
+                                  idempotency_key: Optional[str] = Header(None)):
+    """
+    Queue roadmap generation for the whole team (or the named members) for a review
+    cycle. Roadmaps are saved per member, so a rerun only generates missing ones.
+    """
+    payload = request.model_dump()
+    payload["cycle"] = request.cycle or current_cycle()
+    job = require_job_queue().submit(
+        "team_courses", user_data["name"], payload,
+        idempotency_key=idempotency_key or json.dumps(
+            [payload["cycle"], payload["learning_goal"], sorted(payload["members"] or [])]
+        ),
+        # Finished batches rerun cheaply, picking up members that failed or were added
+        reuse_finished=False
+    )
+    return JobResponse(**job)
+
+
+def get_user_job(job_id: str, user_data: dict) -> Dict:
+    job = require_job_queue().get(job_id)
+    # Other users' jobs are reported as missing rather than forbidden
+    if job is None or job["owner"] != user_data["name"]:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, user_data: dict = Depends(verify_user_token)):
+    return JobResponse(**get_user_job(job_id, user_data))
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, user_data: dict = Depends(verify_user_token)):
+    """Server-sent events: the job on every status change, ending once it has finished."""
+    job = get_user_job(job_id, user_data)
+    
+    async def events():
+        last_status = None
+        last_sent = 0.0
+        current = job
+        while True:
+            if current["status"] != last_status:
+                last_status = current["status"]
+                last_sent = time.time()
+                yield f"event: status\ndata: {JobResponse(**current).model_dump_json()}\n\n"
+                if last_status in TERMINAL_STATUSES:
+                    return
+            elif time.time() - last_sent > 15:
+                # Comment lines keep proxies from closing an idle stream
+                last_sent = time.time()
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(0.5)
+            current = job_queue.get(job_id) or current
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.get("/")
 async def root():
     return {
@@ -363,8 +636,16 @@ async def root():
             "POST /validate-token": "Validate API token",
             "POST /validate-user-token": "Validate user ID token and return user data",
             "POST /generate-course": "Generate personalized learning course (requires Bearer token)",
+            "POST /generate-course/stream": "Stream a course section by section as server-sent events (requires Bearer token)",
             "POST /generate-checklist": "Generate checklist from course content (requires Bearer token)",
+            "POST /generate-checklist/stream": "Stream checklist categories as server-sent events (requires Bearer token)",
+            "POST /jobs/generate-course": "Queue a course generation, returning a job (requires Bearer token)",
+            "POST /jobs/generate-checklist": "Queue a checklist generation, returning a job (requires Bearer token)",
+            "POST /jobs/generate-team-courses": "Queue roadmap generation for the whole team for a review cycle (requires Bearer token)",
+            "GET /jobs/{job_id}": "Job status and result (requires Bearer token)",
+            "GET /jobs/{job_id}/events": "Server-sent job status updates (requires Bearer token)",
             "GET /team": "Get list of team members",
+            "GET /metrics/llm": "OpenAI scheduler queue metrics",
             "GET /healthz": "Health check"
         }
     }
@@ -1,10 +1,20 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 
 
+class RetrievalFilters(BaseModel):
+    doc_ids: Optional[List[str]] = None
+    sections: Optional[List[str]] = None  # heading prefixes, e.g. "SECTION 4"
+    page_from: Optional[int] = None
+    page_to: Optional[int] = None
+    sources: Optional[List[str]] = None  # "pdf" and/or "notion"
+
+
 class QueryRequest(BaseModel):
     query: str
     max_tokens: int = 600
+    filters: Optional[RetrievalFilters] = None
+    session_id: Optional[str] = None  # from a previous response, to ask follow-up questions
 
 
 class QueryResponse(BaseModel):
@@ -12,6 +22,7 @@ class QueryResponse(BaseModel):
     citations: List[str]
     retrieved_ids: List[int]
     latency_ms: int
+    session_id: Optional[str] = None
 
 
 class IngestRequest(BaseModel):
@@ -58,6 +69,7 @@ class UserTokenValidationResponse(BaseModel):
 
 class CourseGenerationRequest(BaseModel):
     learning_goal: str
+    use_cache: bool = True  # False generates a fresh course
 
 
 class CourseGenerationResponse(BaseModel):
@@ -68,9 +80,28 @@ class CourseGenerationResponse(BaseModel):
 
 class ChecklistGenerationRequest(BaseModel):
     generated_course: str
+    use_cache: bool = True
 
 
 class ChecklistGenerationResponse(BaseModel):
     success: bool
     message: str
     checklist: Optional[List] = None
+
+
+class TeamCourseBatchRequest(BaseModel):
+    learning_goal: str  # for members without their own learning_goal in team.json
+    cycle: Optional[str] = None  # review cycle label; defaults to the current quarter
+    members: Optional[List[str]] = None  # names to include; None means the whole team
+    overwrite: bool = False  # regenerate roadmaps already saved for this cycle
+    use_cache: bool = True
+
+
+class JobResponse(BaseModel):
+    job_id: str
+    kind: str
+    status: str  # queued, running, succeeded or failed
+    result: Optional[Dict] = None  # the matching *GenerationResponse fields once succeeded
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
@@ -0,0 +1,149 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterator
+
+import tiktoken
+
+from .config import Config
+
+
+# Scheduling classes, most urgent first: Q&A a user is waiting on, single
+# course and checklist generations, then team-wide batches
+PRIORITIES = ("interactive", "generation", "batch")
+
+
+@lru_cache(maxsize=1)
+def _chat_encoding():
+    try:
+        return tiktoken.encoding_for_model(Config.CHAT_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    return len(_chat_encoding().encode(text))
+
+
+class RateLimiter:
+    """
+    Thread-safe token buckets for requests per minute and tokens per minute.
+    Shared by the LLM scheduler and ingestion's embedding pipeline.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.request_rate = requests_per_minute / 60.0
+        self.token_rate = tokens_per_minute / 60.0
+        # Allow bursts of ~10 seconds of quota
+        self.request_capacity = max(1.0, requests_per_minute / 6.0)
+        self.token_capacity = max(1.0, tokens_per_minute / 6.0)
+        self.request_level = self.request_capacity
+        self.token_level = self.token_capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.request_level = min(self.request_capacity, self.request_level + elapsed * self.request_rate)
+        self.token_level = min(self.token_capacity, self.token_level + elapsed * self.token_rate)
+
+    def try_acquire(self, tokens: int) -> float:
+        """Take one request of `tokens` tokens if it fits now and return 0, else the seconds until it would."""
+        # A request larger than the bucket waits for a full bucket and then runs it into debt
+        needed = min(tokens, self.token_capacity)
+        with self.lock:
+            self._refill()
+            if self.request_level >= 1 and self.token_level >= needed:
+                self.request_level -= 1
+                self.token_level -= tokens
+                return 0.0
+            return max((1 - self.request_level) / self.request_rate,
+                       (needed - self.token_level) / self.token_rate, 0.01)
+
+    def acquire(self, tokens: int):
+        """Block until one request of `tokens` tokens fits the limits."""
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class LLMScheduler:
+    """
+    Process-wide gate in front of every OpenAI call. Callers queue by priority
+    class, first come first served within a class, and the head of the queue
+    is admitted once a concurrency slot is free and the shared request and
+    token buckets cover it. Lower classes only run when no higher one waits,
+    so a burst of course generations can't push Q&A into the rate limit.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, max_concurrency: int,
+                 window: int = 1000):
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_concurrency = max(1, max_concurrency)
+        self.in_flight = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._waits = {priority: deque(maxlen=window) for priority in PRIORITIES}
+        self._admitted = {priority: 0 for priority in PRIORITIES}
+
+    @contextmanager
+    def slot(self, priority: str, tokens: int) -> Iterator[float]:
+        """
+        Hold a concurrency slot for one call of about `tokens` tokens (prompt plus
+        completion limit, as OpenAI counts it), blocking until it is admitted.
+        Yields the seconds spent queued.
+        """
+        queued_at = time.monotonic()
+        entry = (PRIORITIES.index(priority), next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            while True:
+                wait = None
+                if self._waiting[0] == entry and self.in_flight < self.max_concurrency:
+                    wait = self.limiter.try_acquire(tokens)
+                    if not wait:
+                        break
+                self._cond.wait(timeout=wait)
+            heapq.heappop(self._waiting)
+            self.in_flight += 1
+            queue_time = time.monotonic() - queued_at
+            self._waits[priority].append(queue_time)
+            self._admitted[priority] += 1
+            # The next caller in line may fit as well
+            self._cond.notify_all()
+
+        try:
+            yield queue_time
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        """Queue depth and recent queue times (ms) per priority class."""
+        with self._cond:
+            waiting = [PRIORITIES[rank] for rank, _ in self._waiting]
+            classes = {}
+            for priority in PRIORITIES:
+                waits = sorted(self._waits[priority])
+                classes[priority] = {
+                    "admitted": self._admitted[priority],
+                    "waiting": waiting.count(priority),
+                    "queue_ms_p50": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                    "queue_ms_p95": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0.0,
+                    "queue_ms_max": round(waits[-1] * 1000, 1) if waits else 0.0
+                }
+            return {"in_flight": self.in_flight, "max_concurrency": self.max_concurrency, "classes": classes}
+
+
+llm_scheduler = LLMScheduler(Config.LLM_REQUESTS_PER_MINUTE, Config.LLM_TOKENS_PER_MINUTE,
+                             Config.LLM_MAX_CONCURRENCY)
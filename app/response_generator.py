@@ -1,6 +1,176 @@
-from typing import List, Dict, Tuple
+import asyncio
+import json
+import re
+import sqlite3
+from typing import Iterator, List, Dict, Optional, Tuple
 from openai import OpenAI
 from .config import Config
+from .cache import CompletionCache
+from .rate_limit import count_tokens, llm_scheduler
+
+
+# Course HTML is split into sections at each <h2>; the part before the first is the title
+SECTION_START = "<h2"
+COURSE_MAX_TOKENS = 4000
+
+
+def count_message_tokens(messages: List[Dict]) -> int:
+    """Approximate prompt tokens of a chat request, as rate limits count them."""
+    # Each message carries a few tokens of role and separator framing
+    return sum(count_tokens(message["content"]) + 4 for message in messages) + 3
+
+
+def _clean_course_fragment(content: str) -> str:
+    """Escape, newline and whitespace cleanup shared by whole courses and streamed sections."""
+    # Remove any escaped characters and convert to clean HTML
+    content = content.replace('\\n', '')      # Remove escaped newlines
+    content = content.replace('\\r', '')      # Remove escaped carriage returns
+    content = content.replace('\\t', '')      # Remove escaped tabs
+    
+    # Handle double-escaped characters
+    content = content.replace('\\\\n', '')    # Remove double-escaped newlines
+    content = content.replace('\\\\r', '')    # Remove double-escaped carriage returns
+    content = content.replace('\\\\t', '')    # Remove double-escaped tabs
+    
+    # Clean up any remaining escape sequences
+    content = re.sub(r'\\([ntr])', '', content)  # Remove any remaining escape sequences
+    
+    # Remove all newlines to create clean HTML
+    content = content.replace('\n', '')
+    content = content.replace('\r', '')
+    
+    # Clean up extra spaces around HTML tags
+    content = re.sub(r'>\s+<', '><', content)  # Remove spaces between tags
+    
+    # Clean up multiple spaces
+    return re.sub(r'\s+', ' ', content)  # Replace multiple spaces with single space
+
+
+def clean_course_html(content: str) -> str:
+    """Clean up the response content to ensure clean HTML formatting."""
+    return _clean_course_fragment(content.strip()).strip()
+
+
+class CourseSectionStream:
+    """
+    Applies clean_course_html incrementally. Raw completion text is fed as it
+    arrives and each section is returned, cleaned, as soon as the next <h2>
+    starts; joined, the sections equal clean_course_html of the whole text.
+    None of the cleanup rules can reach across a "<", which is what makes
+    cleaning section by section exact.
+    """
+    
+    def __init__(self):
+        self._buffer = ""
+        self._scan_from = 1
+        self._started = False
+    
+    def feed(self, text: str) -> List[str]:
+        self._buffer += text
+        sections = []
+        while True:
+            boundary = self._buffer.find(SECTION_START, self._scan_from)
+            if boundary == -1:
+                break
+            sections.append(self._clean(self._buffer[:boundary], last=False))
+            self._buffer = self._buffer[boundary:]
+            self._scan_from = 1
+        # A section start may be split across deltas, so rescan its possible prefix next time
+        self._scan_from = max(1, len(self._buffer) - len(SECTION_START) + 1)
+        return [section for section in sections if section]
+    
+    def finish(self) -> List[str]:
+        section = self._clean(self._buffer, last=True)
+        self._buffer = ""
+        return [section] if section else []
+    
+    def _clean(self, raw: str, last: bool) -> str:
+        section = _clean_course_fragment(raw)
+        if not self._started:
+            section = section.lstrip()
+        if last:
+            section = section.rstrip()
+        elif section.endswith(" ") and section[:-1].endswith(">"):
+            # The next section opens with "<", so this whitespace sits between two tags
+            section = section[:-1]
+        self._started = self._started or bool(section)
+        return section
+
+
+# Structured output for checklists: a flat list of categories, each a list of strings
+CHECKLIST_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "checklist",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "checklist": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "category": {"type": "string"},
+                            "items": {"type": "array", "items": {"type": "string"}}
+                        },
+                        "required": ["category", "items"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["checklist"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+class ChecklistStream:
+    """
+    Incremental parser for {"checklist": [{"category": ..., "items": [...]}, ...]}.
+    Text is fed as it streams, and each category is returned as soon as its
+    object closes, so nothing waits for or re-parses the rest of the document.
+    """
+    
+    # Categories are the objects directly inside the top-level checklist array
+    CATEGORY_DEPTH = 3
+    
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._capture: Optional[List[str]] = None
+    
+    def feed(self, text: str) -> List[Dict]:
+        categories = []
+        for char in text:
+            if self._capture is not None:
+                self._capture.append(char)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if char == "{" and self._depth == self.CATEGORY_DEPTH:
+                    self._capture = [char]
+            elif char in "}]":
+                if char == "}" and self._depth == self.CATEGORY_DEPTH and self._capture is not None:
+                    try:
+                        category = json.loads("".join(self._capture))
+                    except ValueError:
+                        category = None
+                    if isinstance(category, dict):
+                        categories.append(category)
+                    self._capture = None
+                self._depth -= 1
+        return categories
 
 
 class ResponseGenerator:
@@ -11,6 +181,107 @@ class ResponseGenerator:
             max_retries=2  # More retries for reliability
         )
         self.system_prompt = self._build_system_prompt()
+        
+        self.completion_cache: Optional[CompletionCache] = None
+        if Config.COMPLETION_CACHE_ENABLED:
+            try:
+                self.completion_cache = CompletionCache(
+                    Config.COMPLETION_CACHE_PATH, max_entries=Config.COMPLETION_CACHE_MAX_ENTRIES
+                )
+            except (OSError, sqlite3.Error) as e:
+                print(f"Completion cache unavailable, continuing without it: {e}")
+    
+    def _chat(self, priority: str, messages: List[Dict], max_tokens: int, **request):
+        """A non-streaming chat completion, admitted by the shared LLM scheduler."""
+        with llm_scheduler.slot(priority, count_message_tokens(messages) + max_tokens):
+            return self.client.chat.completions.create(
+                model=Config.CHAT_MODEL, messages=messages, max_tokens=max_tokens, **request
+            )
+    
+    def _completion_key(self, messages: List[Dict], temperature: float, max_tokens: int,
+                        cache_prompt=None, response_format: Optional[Dict] = None) -> str:
+        prompt = cache_prompt if cache_prompt is not None else messages
+        if response_format is not None:
+            prompt = [prompt, response_format]
+        return CompletionCache.key(Config.CHAT_MODEL, prompt, temperature, max_tokens)
+    
+    def _cached_completion(self, messages: List[Dict], temperature: float, max_tokens: int, timeout: float,
+                           cache_prompt=None, use_cache: bool = True, response_format: Optional[Dict] = None,
+                           priority: str = "generation", limiter=None) -> str:
+        """
+        Chat completion served from the persistent cache when the same request was
+        answered before. cache_prompt keys the entry in place of the messages.
+        A limiter (see rate_limit.RateLimiter) is only charged for cache misses.
+        """
+        cache = self.completion_cache if use_cache else None
+        key = None
+        if cache is not None:
+            key = self._completion_key(messages, temperature, max_tokens, cache_prompt, response_format)
+            content = cache.get(key)
+            if content is not None:
+                return content
+        
+        if limiter is not None:
+            limiter.acquire(count_message_tokens(messages) + max_tokens)
+        extra = {"response_format": response_format} if response_format is not None else {}
+        response = self._chat(
+            priority,
+            messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=False,
+            timeout=timeout,
+            **extra
+        )
+        content = (response.choices[0].message.content or "").strip()
+        
+        # Truncated completions aren't worth replaying
+        if cache is not None and response.choices[0].finish_reason == "stop":
+            cache.put(key, content)
+        return content
+    
+    def _streamed_completion(self, messages: List[Dict], temperature: float, max_tokens: int, timeout: float,
+                             cache_prompt=None, use_cache: bool = True,
+                             response_format: Optional[Dict] = None,
+                             priority: str = "generation") -> Iterator[str]:
+        """
+        Like _cached_completion, but yields the text as it is generated. A cached
+        completion is yielded whole; a fresh one is cached once it finishes. The
+        scheduler slot is held until the stream is consumed or closed.
+        """
+        cache = self.completion_cache if use_cache else None
+        key = None
+        if cache is not None:
+            key = self._completion_key(messages, temperature, max_tokens, cache_prompt, response_format)
+            content = cache.get(key)
+            if content is not None:
+                yield content
+                return
+        
+        extra = {"response_format": response_format} if response_format is not None else {}
+        parts = []
+        finish_reason = None
+        with llm_scheduler.slot(priority, count_message_tokens(messages) + max_tokens):
+            stream = self.client.chat.completions.create(
+                model=Config.CHAT_MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                timeout=timeout,
+                **extra
+            )
+            for event in stream:
+                if not event.choices:
+                    continue
+                choice = event.choices[0]
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                    yield choice.delta.content
+                finish_reason = choice.finish_reason or finish_reason
+        
+        if cache is not None and finish_reason == "stop":
+            cache.put(key, "".join(parts).strip())
     
     def _build_system_prompt(self) -> str:
         return """You are an AI assistant that answers questions about HR policies and procedures based strictly on the provided document chunks.
@@ -34,6 +305,9 @@ IMPORTANT INSTRUCTIONS:
                 return await self._generate_notion_response(query, notion_results)
             return "Not specified in the retrieved sections.", []
         
+        if notion_results:
+            return await self._generate_combined_response(query, chunks, notion_results)
+        
         context_parts, citations = self._prepare_context(chunks)
         context = "\n".join(context_parts)
         
@@ -57,24 +331,44 @@ IMPORTANT INSTRUCTIONS:
             else:
                 page_start = page_end = chunk.get("page_start", 1)
             
-            page_info = f"p.{page_start}" if page_start == page_end else f"pp.{page_start}–{page_end}"
-            citation = f"[HR Manual — {heading_path}, {page_info}]"
+            citation = self._format_citation(heading_path, page_start, page_end)
             
             citations.append(citation)
             chunk_id = chunk.get("chunk_index", chunk.get("chunk_id", i))
-            context_parts.append(f"<CHUNK id={chunk_id}>\n{chunk['text']}\n</CHUNK>\n")
+            # Compression may drop the lines that carry the chunk's heading, so its citation goes with it
+            text = f"{citation}\n{chunk['text']}" if chunk.get("compressed") else chunk['text']
+            context_parts.append(f"<CHUNK id={chunk_id}>\n{text}\n</CHUNK>\n")
         
         return context_parts, citations
     
+    def _format_citation(self, heading_path: str, page_start: int, page_end: int) -> str:
+        page_info = f"p.{page_start}" if page_start == page_end else f"pp.{page_start}–{page_end}"
+        return f"[HR Manual — {heading_path}, {page_info}]"
+    
+    def format_clauses(self, clauses: List[Dict]) -> Tuple[str, List[str]]:
+        """Quote clauses verbatim with their citations; no model call is involved."""
+        sections = []
+        citations = []
+        for clause in clauses:
+            citation = self._format_citation(
+                " → ".join(clause["headings_path"][:3]), clause["page_start"], clause["page_end"]
+            )
+            body = f"\n{clause['text']}" if clause["text"] else ""
+            sections.append(f"**{clause['headings_path'][-1]}**{body}\n{citation}")
+            citations.append(citation)
+        return "\n\n".join(sections), citations
+    
     async def _generate_answer(self, query: str, context: str) -> str:
         messages = [
             {"role": "system", "content": self.system_prompt},
             {"role": "user", "content": f"Question: {query}\n\nContext:\n{context}\n\nAnswer:"}
         ]
         
-        response = self.client.chat.completions.create(
-            model=Config.CHAT_MODEL,
-            messages=messages,
+        # Scheduling waits happen off the event loop, so queued calls don't stall other requests
+        response = await asyncio.to_thread(
+            self._chat,
+            "interactive",
+            messages,
             temperature=0.1,  # Lower temperature for faster generation
             max_tokens=250,   # Further reduced for speed
             stream=False      # Ensure no streaming overhead
@@ -107,22 +401,7 @@ IMPORTANT INSTRUCTIONS:
         if not notion_results:
             return "Not specified in the retrieved sections.", []
         
-        # Prepare Notion context
-        notion_context = []
-        citations = []
-        
-        for i, result in enumerate(notion_results[:3]):  # Limit to top 3 results
-            title = result.get("title", "Untitled")
-            content = result.get("content", "")
-            url = result.get("url", "")
-            
-            # Use actual content if available, otherwise fall back to title
-            content_text = content if content else title
-            
-            notion_context.append(f"<NOTION_RESULT id={i}>\nTitle: {title}\nContent: {content_text}\n</NOTION_RESULT>\n")
-            citations.append(f"[Notion — {title}]")
-        
-        context = "\n".join(notion_context)
+        context, citations = self._prepare_notion_context(notion_results)
         
         # Generate answer using Notion context
         messages = [
@@ -139,9 +418,10 @@ IMPORTANT INSTRUCTIONS:
             {"role": "user", "content": f"Question: {query}\n\nNotion Search Results:\n{context}\n\nAnswer:"}
         ]
         
-        response = self.client.chat.completions.create(
-            model=Config.CHAT_MODEL,
-            messages=messages,
+        response = await asyncio.to_thread(
+            self._chat,
+            "interactive",
+            messages,
             temperature=0.1,
             max_tokens=250,
             stream=False
@@ -152,6 +432,48 @@ IMPORTANT INSTRUCTIONS:
         
         return answer, used_citations
     
+    def _prepare_notion_context(self, notion_results: List[Dict]) -> Tuple[str, List[str]]:
+        notion_context = []
+        citations = []
+        
+        for i, result in enumerate(notion_results[:3]):  # Limit to top 3 results
+            title = result.get("title", "Untitled")
+            content = result.get("content", "")
+            
+            # Use actual content if available, otherwise fall back to title
+            content_text = content if content else title
+            
+            notion_context.append(f"<NOTION_RESULT id={i}>\nTitle: {title}\nContent: {content_text}\n</NOTION_RESULT>\n")
+            citations.append(f"[Notion — {title}]")
+        
+        return "\n".join(notion_context), citations
+    
+    async def _generate_combined_response(self, query: str, chunks: List[Dict],
+                                          notion_results: List[Dict]) -> Tuple[str, List[str]]:
+        """Answer from HR manual chunks and Notion results together, when the router expects both to matter."""
+        context_parts, citations = self._prepare_context(chunks)
+        notion_context, notion_citations = self._prepare_notion_context(notion_results)
+        context = "\n".join(context_parts) + "\n" + notion_context
+        
+        messages = [
+            {"role": "system", "content": self.system_prompt + """
+9. Some context comes from Notion pages (<NOTION_RESULT>); cite those as [Notion — <Title>]"""},
+            {"role": "user", "content": f"Question: {query}\n\nContext:\n{context}\n\nAnswer:"}
+        ]
+        
+        response = await asyncio.to_thread(
+            self._chat,
+            "interactive",
+            messages,
+            temperature=0.1,
+            max_tokens=250,
+            stream=False
+        )
+        
+        answer = response.choices[0].message.content.strip()
+        return answer, (self._extract_citations(answer, citations)
+                        + self._extract_notion_citations(answer, notion_citations))
+    
     def _extract_notion_citations(self, answer: str, citations: List[str]) -> List[str]:
         """Extract Notion citations from the generated answer."""
         import re
@@ -173,12 +495,52 @@ IMPORTANT INSTRUCTIONS:
             
             return used_citations if used_citations else list(set(citations))
     
-    async def generate_course(self, user_context: str, learning_goal: str) -> str:
-        """Generate a personalized learning course based on user context and learning goal."""
+    async def generate_course(self, user_context: str, learning_goal: str,
+                              profile: Optional[Dict] = None, use_cache: bool = True,
+                              priority: str = "generation", limiter=None) -> str:
+        """
+        Generate a personalized learning course based on user context and learning goal.
+        When given, the normalized profile keys the completion cache instead of the full prompt.
+        """
+        messages = self._course_messages(user_context, learning_goal)
+        
+        content = await asyncio.to_thread(
+            self._cached_completion,
+            messages,
+            temperature=0.7,  # Higher temperature for more creative and personalized content
+            max_tokens=COURSE_MAX_TOKENS,  # Increased tokens for comprehensive course content
+            timeout=90.0,  # Additional timeout for course generation specifically
+            cache_prompt=["course", profile] if profile is not None else None,
+            use_cache=use_cache,
+            priority=priority,
+            limiter=limiter
+        )
+        
+        return clean_course_html(content)
+    
+    def stream_course(self, user_context: str, learning_goal: str,
+                      profile: Optional[Dict] = None, use_cache: bool = True) -> Iterator[str]:
+        """
+        Yield the course as cleaned HTML sections (title, then one per <h2>) while the
+        completion streams. Shares generate_course's prompt, settings and cache entries.
+        """
+        sections = CourseSectionStream()
+        for delta in self._streamed_completion(
+            self._course_messages(user_context, learning_goal),
+            temperature=0.7,
+            max_tokens=COURSE_MAX_TOKENS,
+            timeout=90.0,
+            cache_prompt=["course", profile] if profile is not None else None,
+            use_cache=use_cache
+        ):
+            yield from sections.feed(delta)
+        yield from sections.finish()
+    
+    def _course_messages(self, user_context: str, learning_goal: str) -> List[Dict]:
+        # The fixed template precedes the user's profile, so every course request
+        # shares a ~1k-token prompt prefix that OpenAI can serve from its prompt cache
         course_prompt = f"""You are an expert learning and development specialist. Based on the user's current skills, position, and learning goals, create a comprehensive personalized learning roadmap.
 
-{user_context}
-
 Please create a detailed learning roadmap in clean HTML format following this exact template structure. Do NOT include DOCTYPE, html, head, meta, style tags or any document structure. Only include the content HTML elements:
 
 <h1>Specialist Growth Roadmap Template</h1>
@@ -240,7 +602,7 @@ IMPORTANT: Generate ONLY the HTML content elements (h1, h2, table, ul, li, stron
 Make sure to:
 1. Fill in all sections with specific, actionable content
 2. Base recommendations on the user's current skill level and position
-3. Align with their stated learning goal: "{learning_goal}"
+3. Align with their stated learning goal, given below
 4. Provide realistic timelines and achievable milestones
 5. Include specific resources, courses, and learning materials
 6. Consider both technical and soft skill development
@@ -248,53 +610,17 @@ Make sure to:
 8. Use clean HTML formatting with tables, headers, and lists
 9. NO newline characters, NO document structure, NO styling
 
+{user_context}
+
+Stated learning goal: "{learning_goal}"
+
 Generate the complete roadmap in clean HTML content now:"""
 
         messages = [
             {"role": "system", "content": "You are an expert learning and development specialist with deep knowledge of career development, skill assessment, and personalized learning paths."},
             {"role": "user", "content": course_prompt}
         ]
-        
-        response = self.client.chat.completions.create(
-            model=Config.CHAT_MODEL,
-            messages=messages,
-            temperature=0.7,  # Higher temperature for more creative and personalized content
-            max_tokens=4000,  # Increased tokens for comprehensive course content
-            stream=False,
-            timeout=90.0  # Additional timeout for course generation specifically
-        )
-        
-        # Clean up the response content to ensure clean HTML formatting
-        content = response.choices[0].message.content.strip()
-        
-        # Remove any escaped characters and convert to clean HTML
-        content = content.replace('\\n', '')      # Remove escaped newlines
-        content = content.replace('\\r', '')      # Remove escaped carriage returns
-        content = content.replace('\\t', '')      # Remove escaped tabs
-        
-        # Handle double-escaped characters
-        content = content.replace('\\\\n', '')    # Remove double-escaped newlines
-        content = content.replace('\\\\r', '')    # Remove double-escaped carriage returns
-        content = content.replace('\\\\t', '')    # Remove double-escaped tabs
-        
-        # Clean up any remaining escape sequences
-        import re
-        content = re.sub(r'\\([ntr])', '', content)  # Remove any remaining escape sequences
-        
-        # Remove all newlines to create clean HTML
-        content = content.replace('\n', '')
-        content = content.replace('\r', '')
-        
-        # Clean up extra spaces around HTML tags
-        content = re.sub(r'>\s+<', '><', content)  # Remove spaces between tags
-        
-        # Clean up multiple spaces
-        content = re.sub(r'\s+', ' ', content)  # Replace multiple spaces with single space
-        
-        # Ensure proper HTML formatting
-        content = content.strip()
-        
-        return content
+        return messages
     
     async def generate_course_content(self, prompt: str) -> str:
         """Generate course content for PDP based on a simple prompt."""
@@ -303,9 +629,10 @@ Generate the complete roadmap in clean HTML content now:"""
             {"role": "user", "content": prompt}
         ]
         
-        response = self.client.chat.completions.create(
-            model=Config.CHAT_MODEL,
-            messages=messages,
+        response = await asyncio.to_thread(
+            self._chat,
+            "generation",
+            messages,
             temperature=0.7,
             max_tokens=2000,
             stream=False
@@ -313,8 +640,48 @@ Generate the complete roadmap in clean HTML content now:"""
         
         return response.choices[0].message.content.strip()
     
-    async def generate_checklist(self, course_content: str) -> List:
+    async def generate_checklist(self, course_content: str, use_cache: bool = True) -> List:
         """Generate a checklist of actionable items from course content."""
+        content = await asyncio.to_thread(
+            self._cached_completion,
+            self._checklist_messages(course_content),
+            temperature=0.3,  # Lower temperature for more structured output
+            max_tokens=3000,  # Sufficient tokens for comprehensive checklist
+            timeout=60.0,
+            use_cache=use_cache,
+            response_format=CHECKLIST_RESPONSE_FORMAT
+        )
+        
+        # Even a truncated completion yields every category that closed
+        checklist = ChecklistStream().feed(content)
+        if checklist:
+            # Ensure flat structure - flatten any nested items
+            return self._flatten_checklist(checklist)
+        # Fallback for a refusal or other non-JSON reply
+        return self._create_fallback_checklist(content)
+    
+    def stream_checklist(self, course_content: str, use_cache: bool = True) -> Iterator[Dict]:
+        """Yield checklist categories one by one as the structured completion streams."""
+        parser = ChecklistStream()
+        parts = []
+        emitted = False
+        for delta in self._streamed_completion(
+            self._checklist_messages(course_content),
+            temperature=0.3,
+            max_tokens=3000,
+            timeout=60.0,
+            use_cache=use_cache,
+            response_format=CHECKLIST_RESPONSE_FORMAT
+        ):
+            parts.append(delta)
+            for category in self._flatten_checklist(parser.feed(delta)):
+                emitted = True
+                yield category
+        
+        if not emitted:
+            yield from self._create_fallback_checklist("".join(parts))
+    
+    def _checklist_messages(self, course_content: str) -> List[Dict]:
         checklist_prompt = f"""You are an expert learning and development specialist. Based on the provided course content, create a comprehensive checklist of actionable items that a user needs to complete to reach their learning goals.
 
 Course Content:
@@ -357,36 +724,7 @@ Generate a comprehensive checklist that covers all aspects of the course content
             {"role": "system", "content": "You are an expert learning and development specialist who creates actionable, structured learning checklists from course content. Always use a flat structure with no nested sub-items or sub-categories."},
             {"role": "user", "content": checklist_prompt}
         ]
-        
-        response = self.client.chat.completions.create(
-            model=Config.CHAT_MODEL,
-            messages=messages,
-            temperature=0.3,  # Lower temperature for more structured output
-            max_tokens=3000,  # Sufficient tokens for comprehensive checklist
-            stream=False,
-            timeout=60.0
-        )
-        
-        content = response.choices[0].message.content.strip()
-        
-        # Try to parse the JSON response
-        import json
-        try:
-            # Extract JSON from the response (in case there's extra text)
-            json_start = content.find('{')
-            json_end = content.rfind('}') + 1
-            if json_start != -1 and json_end > json_start:
-                json_content = content[json_start:json_end]
-                parsed_data = json.loads(json_content)
-                checklist = parsed_data.get("checklist", [])
-                # Ensure flat structure - flatten any nested items
-                return self._flatten_checklist(checklist)
-            else:
-                # Fallback: create a simple checklist structure
-                return self._create_fallback_checklist(content)
-        except json.JSONDecodeError:
-            # Fallback: create a simple checklist structure
-            return self._create_fallback_checklist(content)
+        return messages
     
     def _flatten_checklist(self, checklist: List) -> List:
         """Flatten any nested checklist structures to ensure only flat structure."""
@@ -1,91 +1,300 @@
+import asyncio
 import re
-from typing import List, Dict, Tuple
+from collections import ChainMap
+from typing import List, Dict, Mapping, Optional, Set, Tuple
 import numpy as np
 import faiss
 from openai import OpenAI
 from rank_bm25 import BM25Okapi
 from .config import Config
+from .filters import FilterIndex
+from .rate_limit import count_tokens, llm_scheduler
+
+
+# Relevance keywords for different query types
+RELEVANCE_MAP = {
+    'vacation': ['leave', 'vacation', 'annual', 'time off', 'attendance', 'rest'],
+    'sick': ['sick', 'illness', 'medical', 'health', 'leave', 'certificate'],
+    'maternity': ['maternity', 'pregnancy', 'leave', 'birth', 'adoptive'],
+    'performance': ['performance', 'evaluation', 'appraisal', 'review', 'management'],
+    'benefits': ['benefits', 'compensation', 'salary', 'reward', 'package', 'allowance'],
+    'termination': ['termination', 'dismissal', 'resignation', 'cessation', 'employment', 'end'],
+    'working hours': ['hours', 'work', 'schedule', 'time', 'attendance', 'shift'],
+    'disciplinary': ['disciplinary', 'misconduct', 'procedure', 'relations', 'employee'],
+    'probation': ['probation', 'probationary', 'period', 'employment', 'orientation', 'new'],
+    'offered': ['benefits', 'compensation', 'salary', 'reward', 'package']  # for "benefits offered"
+}
+
+
+class KeywordMatcher:
+    """Finds which of a fixed set of keywords occur as substrings of a text in one scan."""
+
+    def __init__(self, keywords: List[str]):
+        self.keywords = list(dict.fromkeys(keywords))
+        # Longest alternatives first so each position reports its longest keyword;
+        # every shorter keyword at that position is a prefix of it
+        ordered = sorted(self.keywords, key=len, reverse=True)
+        self._pattern = re.compile("(?=(" + "|".join(re.escape(kw) for kw in ordered) + "))")
+        self._prefixes = {
+            kw: {other for other in self.keywords if kw.startswith(other)}
+            for kw in self.keywords
+        }
+
+    def find(self, text: str) -> Set[str]:
+        found: Set[str] = set()
+        for match in self._pattern.finditer(text):
+            found |= self._prefixes[match.group(1)]
+            if len(found) == len(self.keywords):
+                break
+        return found
+
+
+RELEVANCE_MATCHERS = {key: KeywordMatcher(keywords) for key, keywords in RELEVANCE_MAP.items()}
+
+
+FUSION_METHODS = ("rrf", "weighted_rrf", "minmax", "zscore")
 
 
 class RetrievalPipeline:
     def __init__(self, metadata: List[Dict], bm25_index: BM25Okapi, 
-                 faiss_index: faiss.IndexHNSWFlat, embeddings: np.ndarray):
+                 faiss_index: faiss.Index, embeddings: np.ndarray,
+                 manifest: Optional[Dict] = None, projection: Optional[Dict] = None):
         self.metadata = metadata
         self.bm25_index = bm25_index
         self.faiss_index = faiss_index
         self.embeddings = embeddings
         self.client = OpenAI(api_key=Config.OPENAI_API_KEY)
+        
+        manifest = manifest or {}
+        self.inner_product = manifest.get("metric") == "inner_product"
+        self.normalize_queries = bool(manifest.get("normalized", False))
+        self.rescore = bool(manifest.get("rescore", False))
+        
+        # Query embeddings must be reduced exactly as the stored ones were
+        reduction = manifest.get("dimension_reduction") or {}
+        self.projection = projection if reduction.get("method") == "pca" else None
+        if self.projection is not None:
+            self.request_dimensions = reduction.get("source_dimensions")
+        else:
+            self.request_dimensions = manifest.get("embedding_dimensions")
+        
+        if Config.FUSION_METHOD not in FUSION_METHODS:
+            raise ValueError(f"Unknown FUSION_METHOD '{Config.FUSION_METHOD}', expected one of {FUSION_METHODS}")
+        
+        # Per-chunk scratch buffers reused by every fusion; only candidate slots are touched
+        self._fusion_scores = np.zeros(len(metadata), dtype=np.float64)
+        self._fusion_seen = np.zeros(len(metadata), dtype=bool)
+        
+        self.filter_index = FilterIndex(metadata)
     
-    async def retrieve(self, query: str, max_results: int = 6) -> List[Dict]:
+    def configure_search(self, ef_search: Optional[int] = None, nprobe: Optional[int] = None):
+        """Set FAISS search-time parameters; values the index type doesn't use are ignored."""
+        index = faiss.downcast_index(self.faiss_index)
+        if ef_search is not None and hasattr(index, "hnsw"):
+            index.hnsw.efSearch = ef_search
+        
+        if nprobe is not None:
+            ivf_index = faiss.try_extract_index_ivf(self.faiss_index)
+            if ivf_index is not None:
+                ivf_index.nprobe = min(nprobe, ivf_index.nlist)
+    
+    async def retrieve(self, query: str, max_results: int = 6,
+                       filters: Optional[Dict] = None) -> List[Mapping]:
+        chunks, _ = await self.retrieve_with_signals(query, max_results, filters)
+        return chunks
+    
+    async def retrieve_with_signals(self, query: str, max_results: int = 6,
+                                    filters: Optional[Dict] = None) -> Tuple[List[Mapping], Dict]:
         """
         Retrieve relevant chunks using the pipeline defined in the brief:
-        1. BM25: top-50 on chunk text
-        2. FAISS: top-30 using embedding
-        3. RRF: fuse lists → top-12
+        1. BM25: top-50 on chunk text (Config.BM25_TOP_K)
+        2. FAISS: top-30 using embedding (Config.FAISS_TOP_K)
+        3. Fusion: RRF by default (Config.FUSION_METHOD) → top-12
         4. Context set: take top-6 chunks (parameterized)
+        Optional filters (see FilterIndex.select) restrict both legs to the
+        matching chunks while they search, rather than afterwards.
+        Alongside the chunks, returns what the query router scores: each leg's
+        top scores, best first, and the query embedding in index space.
         """
+        selection = self.filter_index.select(**filters) if filters else None
+        allowed = self.filter_index.rows(selection) if selection is not None else None
+        if allowed is not None and len(allowed) == 0:
+            return [], {}
+        
         # Enhanced query for better retrieval
         enhanced_query = self._enhance_query(query)
         
-        # Get top-50 from BM25
-        bm25_results = self._bm25_retrieve(enhanced_query, k=50)
+        # Get top candidates from BM25
+        bm25_ids, bm25_scores = self._bm25_retrieve(enhanced_query, k=Config.BM25_TOP_K, allowed=allowed)
         
-        # Get top-30 from FAISS
-        faiss_results = await self._faiss_retrieve(enhanced_query, k=30)
+        # Get top candidates from FAISS
+        # Scheduling waits happen off the event loop, so queued calls don't stall other requests
+        query_embedding = await asyncio.to_thread(self._embed_query, enhanced_query)
+        faiss_ids, faiss_scores = self._faiss_retrieve(
+            query_embedding, k=Config.FAISS_TOP_K, selection=selection, allowed=allowed
+        )
         
-        # Fuse using RRF to get top-12
-        rrf_results = self._reciprocal_rank_fusion(bm25_results, faiss_results, max_results=12)
+        # Fuse both legs to get top-12
+        fused_results = self._fuse_results(bm25_ids, bm25_scores, faiss_ids, faiss_scores, max_results=12)
         
         # Filter for relevance and return top-k (default 6) chunks
-        filtered_results = self._filter_relevant_chunks(query, rrf_results)
-        return filtered_results[:max_results]
+        filtered_results = self._filter_relevant_chunks(query, fused_results)
+        signals = {"bm25_scores": bm25_scores, "faiss_scores": faiss_scores, "query_embedding": query_embedding[0]}
+        return filtered_results[:max_results], signals
     
-    def _bm25_retrieve(self, query: str, k: int) -> List[Tuple[int, float]]:
+    def _bm25_retrieve(self, query: str, k: int,
+                       allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
         query_tokens = re.findall(r'\b\w+\b', query.lower())
-        scores = self.bm25_index.get_scores(query_tokens)
-        top_indices = np.argsort(scores)[::-1][:k]
+        if allowed is None:
+            scores = self.bm25_index.get_scores(query_tokens)
+            rows = None
+        else:
+            # Only the allowed documents are scored at all
+            scores = np.asarray(self.bm25_index.get_batch_scores(query_tokens, allowed.tolist()))
+            rows = allowed
+        top_indices = self._top_k(scores, k)
+        top_indices = top_indices[scores[top_indices] > 0]
         
-        return [(idx, scores[idx]) for idx in top_indices if scores[idx] > 0]
+        if rows is None:
+            return top_indices, scores[top_indices]
+        return rows[top_indices], scores[top_indices]
     
-    async def _faiss_retrieve(self, query: str, k: int) -> List[Tuple[int, float]]:
-        response = self.client.embeddings.create(
-            model=Config.EMBEDDING_MODEL,
-            input=[query]
-        )
+    def _faiss_retrieve(self, query_embedding: np.ndarray, k: int, selection: Optional[np.ndarray] = None,
+                        allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        params = None
+        if allowed is not None:
+            # Small subsets are cheaper to score exactly than to walk the index for
+            if len(allowed) <= Config.FILTER_EXACT_MAX_ROWS:
+                return self._exact_search(query_embedding, allowed, k)
+            params = self._selector_params(selection)
+        
+        try:
+            if self.rescore:
+                return self._search_and_rescore(query_embedding, k, params)
+            
+            distances, indices = self.faiss_index.search(query_embedding, k, params=params)
+        except RuntimeError:
+            if params is None:
+                raise
+            # Index types without ID selector support (flat PQ) fall back to exact scoring
+            return self._exact_search(query_embedding, allowed, k)
+        
+        # Inner product on unit vectors is already cosine similarity
+        similarities = distances[0] if self.inner_product else 1 / (1 + distances[0])
+        
+        # FAISS pads with -1 when the index holds fewer than k vectors
+        valid = indices[0] >= 0
+        return indices[0][valid].astype(np.int64), similarities[valid]
+    
+    def _embed_query(self, query: str) -> np.ndarray:
+        request = {"model": Config.EMBEDDING_MODEL, "input": [query]}
+        if self.request_dimensions:
+            request["dimensions"] = self.request_dimensions
+        with llm_scheduler.slot("interactive", count_tokens(query)):
+            response = self.client.embeddings.create(**request)
         
         query_embedding = np.array([response.data[0].embedding], dtype=np.float32)
-        distances, indices = self.faiss_index.search(query_embedding, k)
-        similarities = 1 / (1 + distances[0])
+        if self.projection is not None:
+            query_embedding = (query_embedding - self.projection["mean"]) @ self.projection["components"].T
+            query_embedding = np.ascontiguousarray(query_embedding, dtype=np.float32)
+        if self.normalize_queries:
+            faiss.normalize_L2(query_embedding)
+        return query_embedding
+    
+    def _selector_params(self, selection: np.ndarray) -> faiss.SearchParameters:
+        """Search parameters restricting the index to the selected rows, keeping its tuned settings."""
+        index = faiss.downcast_index(self.faiss_index)
+        ivf_index = faiss.try_extract_index_ivf(self.faiss_index)
+        if hasattr(index, "hnsw"):
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = index.hnsw.efSearch
+        elif ivf_index is not None:
+            params = faiss.SearchParametersIVF()
+            params.nprobe = ivf_index.nprobe
+        else:
+            params = faiss.SearchParameters()
+        
+        params.sel = faiss.IDSelectorBitmap(self.filter_index.size, faiss.swig_ptr(selection))
+        # The selector only points at the bitset, so keep it alive with the params
+        params.bitset = selection
+        return params
+    
+    def _exact_search(self, query_embedding: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        vectors = np.asarray(self.embeddings[rows], dtype=np.float32)
+        if self.inner_product:
+            similarities = vectors @ query_embedding[0]
+        else:
+            similarities = 1 / (1 + ((vectors - query_embedding[0]) ** 2).sum(axis=1))
+        order = self._top_k(similarities, k)
+        return rows[order], similarities[order]
+    
+    def _search_and_rescore(self, query_embedding: np.ndarray, k: int,
+                            params: Optional[faiss.SearchParameters] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Over-fetch from the compressed index, then rank candidates by exact float similarity."""
+        _, indices = self.faiss_index.search(query_embedding, k * Config.FAISS_RESCORE_FACTOR, params=params)
+        candidates = indices[0][indices[0] >= 0].astype(np.int64)
+        
+        similarities = np.asarray(self.embeddings[candidates], dtype=np.float32) @ query_embedding[0]
+        order = self._top_k(similarities, k)
+        return candidates[order], similarities[order]
+    
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k highest scores, best first, without a full sort."""
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
+    
+    def _leg_scores(self, scores: np.ndarray, weight: float) -> np.ndarray:
+        """Per-candidate contribution of one ranked leg under Config.FUSION_METHOD."""
+        method = Config.FUSION_METHOD
+        if method in ("rrf", "weighted_rrf"):
+            if method == "rrf":
+                weight = 1.0
+            return weight / (Config.FUSION_RRF_K + np.arange(1, len(scores) + 1, dtype=np.float64))
         
-        return [(int(idx), float(sim)) for idx, sim in zip(indices[0], similarities)]
+        if len(scores) == 0:
+            return np.empty(0, dtype=np.float64)
+        scores = scores.astype(np.float64, copy=False)
+        if method == "minmax":
+            spread = scores.max() - scores.min()
+            normalized = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+        else:  # zscore
+            std = scores.std()
+            normalized = (scores - scores.mean()) / std if std > 0 else np.zeros_like(scores)
+        return weight * normalized
     
-    def _reciprocal_rank_fusion(self, bm25_results: List[Tuple[int, float]], 
-                               faiss_results: List[Tuple[int, float]], 
-                               max_results: int, k: int = 60) -> List[Dict]:
-        bm25_ranks = {idx: rank + 1 for rank, (idx, _) in enumerate(bm25_results)}
-        faiss_ranks = {idx: rank + 1 for rank, (idx, _) in enumerate(faiss_results)}
-        
-        all_indices = set(bm25_ranks.keys()) | set(faiss_ranks.keys())
-        rrf_scores = {}
-        
-        for idx in all_indices:
-            score = 0
-            if idx in bm25_ranks:
-                score += 1 / (k + bm25_ranks[idx])
-            if idx in faiss_ranks:
-                score += 1 / (k + faiss_ranks[idx])
-            rrf_scores[idx] = score
-        
-        sorted_indices = sorted(rrf_scores.keys(), key=lambda x: rrf_scores[x], reverse=True)
-        top_indices = sorted_indices[:max_results]
-        
-        results = []
-        for idx in top_indices:
-            chunk = self.metadata[idx].copy()
-            chunk["rrf_score"] = rrf_scores[idx]
-            results.append(chunk)
-        
-        return results
+    def _fuse_results(self, bm25_ids: np.ndarray, bm25_scores: np.ndarray,
+                      faiss_ids: np.ndarray, faiss_scores: np.ndarray,
+                      max_results: int) -> List[Mapping]:
+        """
+        Fuse the BM25 and FAISS legs in O(candidates). Each leg's ids are
+        unique, so contributions are scattered straight into the scratch
+        buffer and the union is the BM25 ids plus the unseen FAISS ids.
+        """
+        fused = self._fusion_scores
+        seen = self._fusion_seen
+        
+        fused[bm25_ids] += self._leg_scores(bm25_scores, Config.FUSION_BM25_WEIGHT)
+        fused[faiss_ids] += self._leg_scores(faiss_scores, Config.FUSION_FAISS_WEIGHT)
+        
+        seen[bm25_ids] = True
+        candidates = np.concatenate((bm25_ids, faiss_ids[~seen[faiss_ids]]))
+        candidate_scores = fused[candidates]
+        
+        # Reset only the touched slots for the next query
+        fused[candidates] = 0.0
+        seen[bm25_ids] = False
+        
+        order = self._top_k(candidate_scores, max_results)
+        
+        # Layer the score over the stored chunk instead of copying it
+        return [
+            ChainMap({"rrf_score": float(candidate_scores[i])}, self.metadata[candidates[i]])
+            for i in order
+        ]
     
     def _enhance_query(self, query: str) -> str:
         """Enhance query with relevant synonyms and terms."""
@@ -113,45 +322,31 @@ class RetrievalPipeline:
                 
         return enhanced
     
-    def _filter_relevant_chunks(self, original_query: str, chunks: List[Dict]) -> List[Dict]:
+    def _filter_relevant_chunks(self, original_query: str, chunks: List[Mapping]) -> List[Mapping]:
         """Filter out chunks that are clearly irrelevant to the query."""
         query_lower = original_query.lower()
         
-        # Define relevance keywords for different query types
-        relevance_map = {
-            'vacation': ['leave', 'vacation', 'annual', 'time off', 'attendance', 'rest'],
-            'sick': ['sick', 'illness', 'medical', 'health', 'leave', 'certificate'],
-            'maternity': ['maternity', 'pregnancy', 'leave', 'birth', 'adoptive'],
-            'performance': ['performance', 'evaluation', 'appraisal', 'review', 'management'],
-            'benefits': ['benefits', 'compensation', 'salary', 'reward', 'package', 'allowance'],
-            'termination': ['termination', 'dismissal', 'resignation', 'cessation', 'employment', 'end'],
-            'working hours': ['hours', 'work', 'schedule', 'time', 'attendance', 'shift'],
-            'disciplinary': ['disciplinary', 'misconduct', 'procedure', 'relations', 'employee'],
-            'probation': ['probation', 'probationary', 'period', 'employment', 'orientation', 'new'],
-            'offered': ['benefits', 'compensation', 'salary', 'reward', 'package']  # for "benefits offered"
-        }
-        
-        # Find relevant keywords for this query
-        relevant_keywords = []
-        for key, keywords in relevance_map.items():
+        # Find the keyword matcher for this query type
+        matcher = None
+        for key, key_matcher in RELEVANCE_MATCHERS.items():
             if key in query_lower:
-                relevant_keywords.extend(keywords)
+                matcher = key_matcher
                 break
         
-        if not relevant_keywords:
+        if matcher is None:
             return chunks  # No filtering if we can't determine relevance
         
         filtered_chunks = []
         for chunk in chunks:
-            chunk_text = chunk.get('text', '').lower()
-            chunk_headings = ' '.join(chunk.get('headings_path', [])).lower()
+            text_hits = matcher.find(chunk["text_lower"])
+            heading_hits = matcher.find(chunk["headings_lower"])
             
             # Check if chunk contains relevant keywords
             relevance_score = 0
-            for keyword in relevant_keywords:
-                if keyword in chunk_text:
+            for keyword in matcher.keywords:
+                if keyword in text_hits:
                     relevance_score += 2  # Higher weight for text content
-                elif keyword in chunk_headings:
+                elif keyword in heading_hits:
                     relevance_score += 1  # Lower weight for headings
             
             # More strict filtering - require at least some relevance
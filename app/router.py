@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import base64
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from .config import Config
+
+
+# Where an answer should come from: the indexed HR manual, live Notion search, or both
+ROUTES = ("pdf", "notion", "both")
+
+# The original routing rule: queries mentioning any of these stay in the HR manual
+HR_KEYWORDS = [
+    'vacation', 'leave', 'sick', 'maternity', 'paternity', 'benefits', 'salary', 'pay',
+    'performance', 'review', 'appraisal', 'disciplinary', 'termination', 'resignation',
+    'probation', 'onboarding', 'training', 'policy', 'procedure', 'employee', 'employment',
+    'workplace', 'hours', 'overtime', 'holiday', 'attendance', 'absence', 'dress code',
+    'code of conduct', 'harassment', 'discrimination', 'safety', 'health', 'insurance',
+    'retirement', 'pension', 'bonus', 'incentive', 'promotion', 'career', 'development'
+]
+
+FEATURE_NAMES = ("bm25_top", "bm25_margin", "faiss_top", "faiss_margin", "fused_top", "hr_keyword", "query_words")
+# Known from the query text alone, before retrieval runs
+QUERY_FEATURES = ("hr_keyword", "query_words")
+
+
+def route_features(query: str, chunks: List[Mapping], signals: Dict) -> np.ndarray:
+    """Scalar features of one retrieval, in FEATURE_NAMES order."""
+    bm25 = signals.get("bm25_scores", np.empty(0))
+    faiss = signals.get("faiss_scores", np.empty(0))
+    query_lower = query.lower()
+    return np.array([
+        np.log1p(bm25[0]) if len(bm25) else 0.0,
+        (bm25[0] - bm25[:5].mean()) / bm25[0] if len(bm25) and bm25[0] > 0 else 0.0,
+        faiss[0] if len(faiss) else 0.0,
+        faiss[0] - faiss[:5].mean() if len(faiss) else 0.0,
+        max((chunk.get("rrf_score", 0.0) for chunk in chunks), default=0.0),
+        float(any(keyword in query_lower for keyword in HR_KEYWORDS)),
+        np.log1p(len(query.split()))
+    ], dtype=np.float64)
+
+
+def keyword_route(query: str, chunks: List[Mapping]) -> str:
+    """Routing without a trained model: keyword match, then a relevance floor."""
+    query_lower = query.lower()
+    if not any(keyword in query_lower for keyword in HR_KEYWORDS):
+        # If query doesn't seem HR-related, try Notion first
+        return "notion"
+    # For HR-related queries, check if chunks are actually relevant
+    if max(chunk.get("rrf_score", 0) for chunk in chunks) < 0.01:
+        return "notion"
+    return "pdf"
+
+
+class QueryRouter:
+    """
+    Multinomial logistic regression over a retrieval's scalar features and its
+    query embedding, deciding where /ask should look for an answer. Scoring is
+    one small matrix-vector product, well under a millisecond, and runs on
+    signals retrieval already produced, so routing adds no network call.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, mean: np.ndarray, scale: np.ndarray,
+                 embedding_dim: int, embedding_mean: Optional[np.ndarray] = None):
+        self.weights = weights
+        self.bias = bias
+        self.mean = mean
+        self.scale = scale
+        self.embedding_dim = embedding_dim
+        # Mean training embedding, standing in for the query embedding before it is computed
+        self.embedding_mean = embedding_mean
+
+    def _inputs(self, features: np.ndarray, embedding: Optional[np.ndarray]) -> np.ndarray:
+        standardized = (features - self.mean) / self.scale
+        if not self.embedding_dim:
+            return standardized
+        return np.concatenate((standardized, embedding.astype(np.float64, copy=False)))
+
+    def probabilities(self, features: np.ndarray, embedding: Optional[np.ndarray] = None) -> np.ndarray:
+        """Probability of each route in ROUTES order."""
+        logits = self.weights @ self._inputs(features, embedding) + self.bias
+        exp = np.exp(logits - logits.max())
+        return exp / exp.sum()
+
+    def route(self, features: np.ndarray, embedding: Optional[np.ndarray] = None) -> str:
+        """Notion is searched only when it is likely enough to contribute to the answer."""
+        p_pdf, p_notion, p_both = self.probabilities(features, embedding)
+        if p_notion + p_both < Config.ROUTER_NOTION_THRESHOLD:
+            return "pdf"
+        return "both" if p_both > p_notion else "notion"
+
+    def notion_prior(self, query: str) -> float:
+        """
+        P(notion or both) from the query text alone, with the retrieval features
+        and the embedding held at their training means, for deciding before
+        retrieval whether Notion may be needed.
+        """
+        known = route_features(query, [], {})
+        features = self.mean.copy()
+        for name in QUERY_FEATURES:
+            features[FEATURE_NAMES.index(name)] = known[FEATURE_NAMES.index(name)]
+        probabilities = self.probabilities(features, self.embedding_mean if self.embedding_dim else None)
+        return float(probabilities[1] + probabilities[2])
+    
+    @classmethod
+    def fit(cls, features: np.ndarray, embeddings: Optional[np.ndarray], labels: List[str],
+            l2: float = 1e-2, epochs: int = 2000, learning_rate: float = 0.5) -> "QueryRouter":
+        """Full-batch gradient descent with class-balanced weights and L2 regularization."""
+        mean = features.mean(axis=0)
+        scale = features.std(axis=0)
+        scale[scale == 0] = 1.0
+        inputs = (features - mean) / scale
+        embedding_dim = 0
+        embedding_mean = None
+        if embeddings is not None:
+            inputs = np.hstack((inputs, embeddings.astype(np.float64)))
+            embedding_dim = embeddings.shape[1]
+            embedding_mean = embeddings.astype(np.float64).mean(axis=0)
+
+        targets = np.zeros((len(labels), len(ROUTES)))
+        targets[np.arange(len(labels)), [ROUTES.index(label) for label in labels]] = 1.0
+        counts = targets.sum(axis=0)
+        sample_weights = (targets / np.maximum(counts, 1)).sum(axis=1) * len(labels) / np.count_nonzero(counts)
+
+        weights = np.zeros((len(ROUTES), inputs.shape[1]))
+        bias = np.zeros(len(ROUTES))
+        for _ in range(epochs):
+            logits = inputs @ weights.T + bias
+            probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+            probabilities /= probabilities.sum(axis=1, keepdims=True)
+            error = (probabilities - targets) * sample_weights[:, None] / len(labels)
+            weights -= learning_rate * (error.T @ inputs + l2 * weights)
+            bias -= learning_rate * error.sum(axis=0)
+        return cls(weights, bias, mean, scale, embedding_dim, embedding_mean)
+
+    def save(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(f, weights=self.weights, bias=self.bias, mean=self.mean, scale=self.scale,
+                     embedding_dim=self.embedding_dim,
+                     embedding_mean=self.embedding_mean if self.embedding_mean is not None else np.empty(0),
+                     feature_names=np.array(FEATURE_NAMES), routes=np.array(ROUTES))
+
+    @classmethod
+    def load(cls, path: str) -> "QueryRouter":
+        with np.load(path, allow_pickle=False) as data:
+            if tuple(data["feature_names"]) != FEATURE_NAMES or tuple(data["routes"]) != ROUTES:
+                raise ValueError("router was trained on different features; retrain it")
+            embedding_dim = int(data["embedding_dim"])
+            if embedding_dim and "embedding_mean" not in data.files:
+                raise ValueError("router predates the stored embedding mean; retrain it")
+            return cls(data["weights"], data["bias"], data["mean"], data["scale"], embedding_dim,
+                       data["embedding_mean"] if embedding_dim else None)
+
+
+def speculate_notion(query: str, router: Optional[QueryRouter]) -> bool:
+    """Whether Notion search should start alongside retrieval rather than after it."""
+    if router is None:
+        # The keyword rules send every query without an HR term to Notion
+        query_lower = query.lower()
+        return not any(keyword in query_lower for keyword in HR_KEYWORDS)
+    return router.notion_prior(query) >= Config.NOTION_SPECULATE_THRESHOLD
+
+
+class RouterLog:
+    """
+    Append-only JSONL of routed queries (hashed) with their features and outcome.
+    Outside exploration the outcome only reflects the route taken, so only
+    explore records, where both sources were searched, are trained on.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, query_hash: str, features: np.ndarray, embedding: Optional[np.ndarray],
+               route: str, answer_source: Optional[str], explore: bool = False):
+        record = {
+            "ts": time.time(),
+            "query_hash": query_hash,
+            "features": features.tolist(),
+            # float16 keeps a 3k-dimension embedding to a few KB per line
+            "embedding": base64.b64encode(embedding.astype(np.float16).tobytes()).decode("ascii")
+                         if embedding is not None else None,
+            "route": route,
+            "answer_source": answer_source,
+            "explore": explore
+        }
+        try:
+            with self._lock:
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"Router log unavailable: {e}")
+
+
+def load_logged_examples(path: str) -> List[Tuple[np.ndarray, Optional[np.ndarray], str]]:
+    """
+    Exploration queries, which searched both sources, labelled by the sources their
+    answer cited. Routed queries only show the outcome of the route already taken,
+    so learning from them would just reproduce the current policy.
+    """
+    examples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if not record.get("explore") or record.get("answer_source") not in ROUTES:
+                continue
+            embedding = None
+            if record.get("embedding"):
+                embedding = np.frombuffer(base64.b64decode(record["embedding"]), dtype=np.float16).astype(np.float64)
+            examples.append((np.array(record["features"], dtype=np.float64), embedding, record["answer_source"]))
+    return examples
+
+
+def labeled_questions(gold_path: Optional[str], labels_path: Optional[str]) -> List[Tuple[str, str]]:
+    """Gold evaluation questions are all answered by the HR manual; the labels file routes each explicitly."""
+    questions = []
+    if gold_path:
+        with open(gold_path, "r", encoding="utf-8") as f:
+            questions += [(json.loads(line)["question"], "pdf") for line in f if line.strip()]
+    if labels_path:
+        with open(labels_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    questions.append((record["question"], record["route"]))
+    return questions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the /ask query router")
+    parser.add_argument("--gold", default=None, help="Gold evaluation JSONL (all routed to the HR manual)")
+    parser.add_argument("--labels", default=None, help="JSONL of {question, route} with route in pdf/notion/both")
+    parser.add_argument("--log", default=None, help="Router traffic log to learn its exploration queries from (ROUTER_LOG_PATH)")
+    parser.add_argument("--output", default=Config.ROUTER_MODEL_PATH, help="Where the model is written")
+    parser.add_argument("--no-embedding", action="store_true", help="Use only the scalar retrieval features")
+    parser.add_argument("--l2", type=float, default=1e-2)
+    args = parser.parse_args()
+
+    examples = []
+    questions = labeled_questions(args.gold, args.labels)
+    if questions:
+        Config.validate()
+        # Imported here so a log-only run doesn't load the indexes
+        from .index_manager import IndexManager
+        index_manager = IndexManager()
+        if not index_manager.load_indexes():
+            return 1
+        for question, label in questions:
+            chunks, signals = asyncio.run(index_manager.retrieval_pipeline.retrieve_with_signals(question))
+            examples.append((route_features(question, chunks, signals), signals.get("query_embedding"), label))
+    if args.log:
+        examples += load_logged_examples(args.log)
+
+    use_embedding = not args.no_embedding and all(embedding is not None for _, embedding, _ in examples)
+    if use_embedding and len({len(embedding) for _, embedding, _ in examples}) > 1:
+        print("Embeddings differ in dimension (index rebuilt since logging?); using scalar features only")
+        use_embedding = False
+    if len({label for _, _, label in examples}) < 2:
+        print(f"Need examples of at least two routes, got {len(examples)} examples")
+        return 1
+
+    features = np.stack([example[0] for example in examples])
+    embeddings = np.stack([example[1] for example in examples]) if use_embedding else None
+    labels = [example[2] for example in examples]
+
+    # Hold out a fifth to report accuracy, then fit on everything
+    order = np.random.default_rng(0).permutation(len(examples))
+    held_out, train = order[:len(order) // 5], order[len(order) // 5:]
+    if len(held_out):
+        model = QueryRouter.fit(features[train], embeddings[train] if use_embedding else None,
+                                [labels[i] for i in train], l2=args.l2)
+        correct = sum(
+            ROUTES[int(np.argmax(model.probabilities(features[i], embeddings[i] if use_embedding else None)))] == labels[i]
+            for i in held_out
+        )
+        print(f"Held-out accuracy: {correct}/{len(held_out)}")
+
+    model = QueryRouter.fit(features, embeddings, labels, l2=args.l2)
+    model.save(args.output)
+    counts = {route: labels.count(route) for route in ROUTES}
+    print(f"Trained on {len(labels)} examples {counts} "
+          f"({'with' if use_embedding else 'without'} embeddings) -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
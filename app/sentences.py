@@ -0,0 +1,19 @@
+import re
+from typing import List, Tuple
+
+
+# Sentences end at terminal punctuation, a blank line, or a line starting a list item or numbered clause
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[A-Z0-9])|\n\s*\n|\n(?=\s*(?:[•*-]|\(?\w{1,3}[.)])\s)")
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """[start, end) character offsets of the sentences in a chunk's text."""
+    spans = []
+    start = 0
+    for match in SENTENCE_BREAK.finditer(text):
+        if text[start:match.start()].strip():
+            spans.append((start, match.start()))
+        start = match.end()
+    if text[start:].strip():
+        spans.append((start, len(text)))
+    return spans or [(0, len(text))]
@@ -0,0 +1,132 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# Openers that lean on the previous question: "and for part-time staff?", "what about interns?"
+FOLLOW_UP_OPENER = re.compile(
+    r"^\s*(?:and|but|what about|how about|what if|same for|in that case)\b", re.IGNORECASE
+)
+# References back to something already discussed: "does that apply to contractors?"
+BACK_REFERENCE = re.compile(r"\b(?:it|its|that|this|these|those|they|them|their|same)\b", re.IGNORECASE)
+# Longer questions restate their subject anyway
+FOLLOW_UP_MAX_WORDS = 8
+# Section and clause numbering in front of a heading title: "SECTION 4 – ", "4.2.1 "
+HEADING_NUMBER = re.compile(r"^\s*(?:(?:section|clause|part|chapter)\s+)?[\d.]*\s*[–—:.-]?\s*", re.IGNORECASE)
+
+
+def topic_phrases(headings: Iterable[str], keywords: Iterable[str] = ()) -> List[str]:
+    """
+    Lowercased phrases that name a subject of their own: heading and clause titles
+    without their numbering, plus the given keywords.
+    """
+    phrases = {keyword.lower() for keyword in keywords}
+    for heading in headings:
+        title = HEADING_NUMBER.sub("", heading).strip().lower()
+        if len(title) >= 4:
+            phrases.add(title)
+    return sorted(phrases)
+
+
+def names_topic(query: str, phrases: Iterable[str]) -> bool:
+    query_lower = query.lower()
+    return any(re.search(rf"\b{re.escape(phrase)}\b", query_lower) for phrase in phrases)
+
+
+def refers_back(query: str) -> bool:
+    """Questions about "it" or "that" are about what was just retrieved."""
+    return bool(BACK_REFERENCE.search(query))
+
+
+def is_follow_up(query: str, phrases: Iterable[str] = ()) -> bool:
+    """
+    A short question that leans on the previous one, by its opener or a back
+    reference, and names no HR topic of its own. "What about probation for
+    contractors?" names one, so it is asked as it stands.
+    """
+    if len(query.split()) > FOLLOW_UP_MAX_WORDS:
+        return False
+    if not (FOLLOW_UP_OPENER.match(query) or refers_back(query)):
+        return False
+    return not names_topic(query, phrases)
+
+
+def rewrite_follow_up(topic: str, query: str) -> str:
+    """
+    Standalone form of a follow-up: the question that set the topic followed by
+    the follow-up, e.g. "What is the annual leave entitlement? and for part-time
+    staff?". No model call; retrieval and the answer prompt both get the topic.
+    """
+    return f"{topic.strip()} {query.strip()}"
+
+
+class SessionStore:
+    """
+    Conversation sessions for /ask: the last `max_turns` turns of each, with the
+    chunk ids each retrieved. Kept in SQLite so every server worker sees the same
+    sessions. Sessions idle past the TTL expire, and past `max_sessions` the least
+    recently used are evicted.
+    """
+
+    def __init__(self, path: str, max_sessions: int = 1000, ttl_seconds: float = 1800, max_turns: int = 6):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_turns = max_turns
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, turns TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used)")
+        self.conn.commit()
+
+    def open(self, session_id: Optional[str] = None) -> Tuple[str, List[Dict]]:
+        """The session's id and previous turns, oldest first; unknown or expired ids start a new session."""
+        now = time.time()
+        with self._lock:
+            self.conn.execute("DELETE FROM sessions WHERE last_used < ?", (now - self.ttl_seconds,))
+            row = None
+            if session_id:
+                row = self.conn.execute("SELECT turns FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                session_id = uuid.uuid4().hex
+                turns = []
+                self.conn.execute("INSERT INTO sessions (id, turns, last_used) VALUES (?, '[]', ?)", (session_id, now))
+                self.conn.execute(
+                    "DELETE FROM sessions WHERE id NOT IN "
+                    "(SELECT id FROM sessions ORDER BY last_used DESC LIMIT ?)",
+                    (self.max_sessions,)
+                )
+            else:
+                turns = json.loads(row[0])
+                self.conn.execute("UPDATE sessions SET last_used = ? WHERE id = ?", (now, session_id))
+            self.conn.commit()
+            return session_id, turns
+
+    def add_turn(self, session_id: str, query: str, topic: str, chunk_ids: List[int]):
+        """Record a turn: the query as asked, the question it was about, and the chunks it retrieved."""
+        with self._lock:
+            row = self.conn.execute("SELECT turns FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return
+            turns = (json.loads(row[0]) + [{"query": query, "topic": topic, "chunk_ids": chunk_ids}])[-self.max_turns:]
+            self.conn.execute(
+                "UPDATE sessions SET turns = ?, last_used = ? WHERE id = ?",
+                (json.dumps(turns), time.time(), session_id)
+            )
+            self.conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,177 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+from .config import Config
+from .rate_limit import RateLimiter
+
+
+TEAM_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "team.json")
+
+
+def normalize_text(text: str) -> str:
+    """Case- and whitespace-insensitive form used for cache keys."""
+    return " ".join(text.lower().split())
+
+
+def course_payload(member: Dict, learning_goal: str, use_cache: bool = True) -> Dict:
+    """Everything a course generation for one team member needs, detached from any request."""
+    # Build context for OpenAI based on user's current skills and position
+    user_context = f"""
+        User Profile:
+        - Name: {member['name']}
+        - Position: {member['position']}
+        - Current Hard Skills: {', '.join(member['hard_skills'])}
+        - Current Soft Skills: {', '.join(member['soft_skills'])}
+
+        Learning Goal: {learning_goal}
+        """
+
+    # Repeat requests for the same goal from the same profile reuse the cached course
+    profile = {
+        "position": normalize_text(member['position']),
+        "hard_skills": sorted(normalize_text(skill) for skill in member['hard_skills']),
+        "soft_skills": sorted(normalize_text(skill) for skill in member['soft_skills']),
+        "learning_goal": normalize_text(learning_goal)
+    }
+
+    return {
+        "user_context": user_context,
+        "learning_goal": learning_goal,
+        "profile": profile,
+        "use_cache": use_cache
+    }
+
+
+def load_team(path: str = TEAM_FILE) -> List[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def current_cycle() -> str:
+    """Review cycles default to calendar quarters, e.g. 2024-Q3."""
+    now = datetime.now(timezone.utc)
+    return f"{now.year}-Q{(now.month - 1) // 3 + 1}"
+
+
+def member_slug(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+class TeamCourseBatch:
+    """
+    Generates a development roadmap for each team member with at most
+    `concurrency` completions in flight, paced by request and token budgets.
+    Each roadmap is written to <output_dir>/<cycle>/<member>.json as soon as
+    it finishes, and members that already have one are skipped, so an
+    interrupted run picks up where it stopped.
+    """
+
+    def __init__(self, response_generator, output_dir: str = Config.PDP_OUTPUT_DIR,
+                 concurrency: int = Config.TEAM_BATCH_CONCURRENCY,
+                 requests_per_minute: int = Config.TEAM_BATCH_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = Config.TEAM_BATCH_TOKENS_PER_MINUTE):
+        self.response_generator = response_generator
+        self.output_dir = Path(output_dir)
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    def result_path(self, cycle: str, name: str) -> Path:
+        return self.output_dir / member_slug(cycle) / f"{member_slug(name)}.json"
+
+    def run(self, members: List[Dict], cycle: str, learning_goal: str,
+            use_cache: bool = True, overwrite: bool = False) -> Dict:
+        """
+        Generate roadmaps for `members`, each toward its own "learning_goal" field
+        when team.json has one and `learning_goal` otherwise. Returns the names
+        generated, skipped as already done and failed, with their errors.
+        """
+        summary = {"cycle": cycle, "generated": [], "skipped": [], "failed": {}}
+        pending = []
+        for member in members:
+            if not overwrite and self.result_path(cycle, member["name"]).exists():
+                summary["skipped"].append(member["name"])
+            else:
+                pending.append(member)
+
+        print(f"Cycle {cycle}: {len(pending)} roadmaps to generate, {len(summary['skipped'])} already done")
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="pdp") as executor:
+            futures = {
+                executor.submit(self._generate, member, cycle, member.get("learning_goal") or learning_goal, use_cache):
+                    member["name"]
+                for member in pending
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                name = futures[future]
+                try:
+                    future.result()
+                    summary["generated"].append(name)
+                    print(f"[{done}/{len(pending)}] {name}: generated")
+                except Exception as e:
+                    summary["failed"][name] = str(e)
+                    print(f"[{done}/{len(pending)}] {name}: failed ({e})")
+        return summary
+
+    def _generate(self, member: Dict, cycle: str, learning_goal: str, use_cache: bool):
+        payload = course_payload(member, learning_goal, use_cache)
+        # The batch budget is only spent on completions that miss the cache
+        course_content = asyncio.run(self.response_generator.generate_course(
+            payload["user_context"], payload["learning_goal"],
+            profile=payload["profile"], use_cache=payload["use_cache"], priority="batch", limiter=self.limiter
+        ))
+
+        record = {
+            "name": member["name"],
+            "position": member["position"],
+            "cycle": cycle,
+            "learning_goal": learning_goal,
+            "course_content": course_content,
+            "generated_at": datetime.now(timezone.utc).isoformat()
+        }
+        # Write then rename, so an interrupted run never leaves a partial roadmap behind
+        path = self.result_path(cycle, member["name"])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate development roadmaps for the whole team")
+    parser.add_argument("--goal", required=True, help="Learning goal for members without their own in team.json")
+    parser.add_argument("--cycle", default=None, help="Review cycle label (default: current quarter, e.g. 2024-Q3)")
+    parser.add_argument("--member", action="append", default=None, help="Only this member (repeatable)")
+    parser.add_argument("--team-file", default=TEAM_FILE, help="Team members JSON")
+    parser.add_argument("--output-dir", default=Config.PDP_OUTPUT_DIR, help="Where roadmaps are written")
+    parser.add_argument("--concurrency", type=int, default=Config.TEAM_BATCH_CONCURRENCY)
+    parser.add_argument("--rpm", type=int, default=Config.TEAM_BATCH_REQUESTS_PER_MINUTE, help="Requests per minute")
+    parser.add_argument("--tpm", type=int, default=Config.TEAM_BATCH_TOKENS_PER_MINUTE, help="Tokens per minute")
+    parser.add_argument("--overwrite", action="store_true", help="Regenerate roadmaps that already exist")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the completion cache")
+    args = parser.parse_args()
+
+    Config.validate()
+    # Imported here so argument errors don't pay for the OpenAI client setup
+    from .response_generator import ResponseGenerator
+
+    members = load_team(args.team_file)
+    if args.member:
+        members = [member for member in members if member["name"] in args.member]
+
+    batch = TeamCourseBatch(ResponseGenerator(), output_dir=args.output_dir, concurrency=args.concurrency,
+                            requests_per_minute=args.rpm, tokens_per_minute=args.tpm)
+    summary = batch.run(members, args.cycle or current_cycle(), args.goal,
+                        use_cache=not args.no_cache, overwrite=args.overwrite)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    exit(main())
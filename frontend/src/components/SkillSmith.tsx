@@ -7,6 +7,7 @@ import { ChecklistList } from './ChecklistList';
 import { ChecklistModal } from './ChecklistModal';
 import { PDPResult } from './PDPResult';
 import { ChecklistData, ChecklistCategory } from '@/types/checklist';
+import { runGenerationJob, streamCourse, streamChecklist } from '@/utils';
 
 type PDPState = 'not-logged-in' | 'ready' | 'generating' | 'result';
 type LoadingState = 'initial' | 'extended' | 'very-extended' | 'checking';
@@ -147,33 +148,30 @@ export function SkillSmith() {
     }, 15000);
     
     try {
-      // Send request to generate course
-      const response = await fetch('/api/generate-course', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${state.userAuth.idToken}`
-        },
-        body: JSON.stringify({
-          learning_goal: userInput || "I want to increase my skills and improve my professional development. Please create a comprehensive Personal Development Plan (PDP) for me."
-        })
-      });
+      const learningGoal = userInput || "I want to increase my skills and improve my professional development. Please create a comprehensive Personal Development Plan (PDP) for me.";
+      let data: any;
+      try {
+        // Show each section as soon as it is generated
+        const courseContent = await streamCourse({ learning_goal: learningGoal }, state.userAuth.idToken, (html) => {
+          setPdpResult({ type: 'html', content: html, userInput: learningGoal });
+          setPdpState('result');
+        });
+        data = { success: true, course_content: courseContent };
+      } catch (streamError) {
+        console.error('Course stream failed, falling back to a background job:', streamError);
+        // Generation runs as a background job; poll it rather than holding the request open
+        data = await runGenerationJob('generate-course', { learning_goal: learningGoal }, state.userAuth.idToken);
+      }
 
-      if (response.ok) {
-        const data = await response.json();
-        
-        if (data.success && data.course_content) {
-          // Store the HTML content for display
-          setPdpResult({
-            type: 'html',
-            content: data.course_content,
-            userInput: userInput || "I want to increase my skills and improve my professional development. Please create a comprehensive Personal Development Plan (PDP) for me."
-          });
-        } else {
-          throw new Error(data.message || 'Failed to generate course');
-        }
+      if (data.success && data.course_content) {
+        // Store the HTML content for display
+        setPdpResult({
+          type: 'html',
+          content: data.course_content,
+          userInput: userInput || "I want to increase my skills and improve my professional development. Please create a comprehensive Personal Development Plan (PDP) for me."
+        });
       } else {
-        throw new Error('Failed to generate course');
+        throw new Error(data.message || 'Failed to generate course');
       }
     } catch (error) {
       console.error('Error generating PDP:', error);
@@ -213,124 +211,135 @@ export function SkillSmith() {
 
   const handleGenerateChecklist = async () => {
     setIsGeneratingChecklist(true);
-    
-    try {
-      // Use the existing endpoint that expects generated_course (HTML content from PDP)
-      const response = await fetch('/api/generate-checklist', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${state.userAuth.idToken}`
-        },
-        body: JSON.stringify({
-          generated_course: pdpResult?.content || "No course content available. Please generate a PDP first."
-        })
-      });
 
-      if (response.ok) {
-        const data = await response.json();
-        
-        if (data.success && data.checklist) {
-          // Parse the checklist data
-          const parsedCategories: ChecklistCategory[] = data.checklist.map((cat: any) => {
-            const items: any[] = [];
-            let itemIndex = 0;
+    // Parse a checklist category from the API
+    const parseCategory = (cat: any): ChecklistCategory => {
+      const items: any[] = [];
+      let itemIndex = 0;
+      
+      cat.items.forEach((item: any) => {
+        if (typeof item === 'string') {
+          // Regular string item
+          let text = parseSubItemsFromText(item);
+          items.push({
+            id: `${cat.category}_${itemIndex}`,
+            text: text,
+            completed: false
+          });
+          itemIndex++;
+        } else if (item && typeof item === 'object') {
+          // Handle objects with 'item' and 'sub-items' structure
+          if (item.item && item['sub-items']) {
+            let text = item.item;
+            if (Array.isArray(item['sub-items']) && item['sub-items'].length > 0) {
+              text += '\n• ' + item['sub-items'].join('\n• ');
+            }
+            text = parseSubItemsFromText(text);
+            items.push({
+              id: `${cat.category}_${itemIndex}`,
+              text: text,
+              completed: false
+            });
+            itemIndex++;
+          } else if (item['sub-category'] && item.items) {
+            // Handle nested sub-category structure
+            const subCategoryText = item['sub-category'];
+            const subItems = Array.isArray(item.items) ? item.items : [];
             
-            cat.items.forEach((item: any) => {
-              if (typeof item === 'string') {
-                // Regular string item
-                let text = parseSubItemsFromText(item);
-                items.push({
-                  id: `${cat.category}_${itemIndex}`,
-                  text: text,
-                  completed: false
-                });
-                itemIndex++;
-              } else if (item && typeof item === 'object') {
-                // Handle objects with 'item' and 'sub-items' structure
-                if (item.item && item['sub-items']) {
-                  let text = item.item;
-                  if (Array.isArray(item['sub-items']) && item['sub-items'].length > 0) {
-                    text += '\n• ' + item['sub-items'].join('\n• ');
-                  }
-                  text = parseSubItemsFromText(text);
-                  items.push({
-                    id: `${cat.category}_${itemIndex}`,
-                    text: text,
-                    completed: false
-                  });
-                  itemIndex++;
-                } else if (item['sub-category'] && item.items) {
-                  // Handle nested sub-category structure
-                  const subCategoryText = item['sub-category'];
-                  const subItems = Array.isArray(item.items) ? item.items : [];
-                  
-                  // Create main sub-category item
-                  items.push({
-                    id: `${cat.category}_${itemIndex}`,
-                    text: subCategoryText,
-                    completed: false
-                  });
-                  itemIndex++;
-                  
-                  // Add sub-items
-                  subItems.forEach((subItem: any) => {
-                    let subItemText = '';
-                    if (typeof subItem === 'string') {
-                      subItemText = parseSubItemsFromText(subItem);
-                    } else {
-                      subItemText = JSON.stringify(subItem);
-                    }
-                    
-                    items.push({
-                      id: `${cat.category}_${itemIndex}`,
-                      text: `• ${subItemText}`,
-                      completed: false
-                    });
-                    itemIndex++;
-                  });
-                } else {
-                  // Fallback for other object structures
-                  items.push({
-                    id: `${cat.category}_${itemIndex}`,
-                    text: JSON.stringify(item),
-                    completed: false
-                  });
-                  itemIndex++;
-                }
+            // Create main sub-category item
+            items.push({
+              id: `${cat.category}_${itemIndex}`,
+              text: subCategoryText,
+              completed: false
+            });
+            itemIndex++;
+            
+            // Add sub-items
+            subItems.forEach((subItem: any) => {
+              let subItemText = '';
+              if (typeof subItem === 'string') {
+                subItemText = parseSubItemsFromText(subItem);
               } else {
-                // Fallback for other types
-                items.push({
-                  id: `${cat.category}_${itemIndex}`,
-                  text: String(item),
-                  completed: false
-                });
-                itemIndex++;
+                subItemText = JSON.stringify(subItem);
               }
+              
+              items.push({
+                id: `${cat.category}_${itemIndex}`,
+                text: `• ${subItemText}`,
+                completed: false
+              });
+              itemIndex++;
             });
-            
-            return {
-              category: cat.category,
-              items: items
-            };
+          } else {
+            // Fallback for other object structures
+            items.push({
+              id: `${cat.category}_${itemIndex}`,
+              text: JSON.stringify(item),
+              completed: false
+            });
+            itemIndex++;
+          }
+        } else {
+          // Fallback for other types
+          items.push({
+            id: `${cat.category}_${itemIndex}`,
+            text: String(item),
+            completed: false
           });
+          itemIndex++;
+        }
+      });
+      
+      return {
+        category: cat.category,
+        items: items
+      };
+    };
 
-          // Create new checklist data
-          const newChecklist: ChecklistData = {
-            id: `checklist_${Date.now()}`,
+    const checklistId = `checklist_${Date.now()}`;
+    const generatedAt = new Date().toISOString();
+    const requestBody = {
+      generated_course: pdpResult?.content || "No course content available. Please generate a PDP first."
+    };
+    
+    try {
+      let data: any;
+      try {
+        // Show each category as soon as it is generated
+        const streamed: ChecklistCategory[] = [];
+        const categories = await streamChecklist(requestBody, state.userAuth.idToken, (cat) => {
+          streamed.push(parseCategory(cat));
+          saveChecklists([...checklists, {
+            id: checklistId,
             userId: state.userAuth.user?.name || '',
-            generatedAt: new Date().toISOString(),
-            categories: parsedCategories
-          };
+            generatedAt,
+            categories: [...streamed]
+          }]);
+        });
+        data = { success: true, checklist: categories };
+      } catch (streamError) {
+        console.error('Checklist stream failed, falling back to a background job:', streamError);
+        // Checklists are generated as a background job from the PDP's HTML content
+        data = await runGenerationJob('generate-checklist', requestBody, state.userAuth.idToken);
+      }
 
-          // Add to existing checklists
-          const updatedChecklists = [...checklists, newChecklist];
-          saveChecklists(updatedChecklists);
-        } else {
-          throw new Error(data.message || 'Failed to generate checklist');
-        }
+      if (data.success && data.checklist) {
+        // Parse the checklist data
+        const parsedCategories: ChecklistCategory[] = data.checklist.map(parseCategory);
+
+        // Create new checklist data
+        const newChecklist: ChecklistData = {
+          id: checklistId,
+          userId: state.userAuth.user?.name || '',
+          generatedAt,
+          categories: parsedCategories
+        };
+
+        // Add to existing checklists
+        const updatedChecklists = [...checklists, newChecklist];
+        saveChecklists(updatedChecklists);
       } else {
-        throw new Error('Failed to generate checklist');
+        throw new Error(data.message || 'Failed to generate checklist');
       }
     } catch (error) {
       console.error('Error generating checklist:', error);
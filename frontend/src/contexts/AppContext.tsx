@@ -147,8 +147,11 @@ export function AppProvider({ children }: { children: ReactNode }) {
     dispatch({ type: 'ADD_MESSAGE', payload: userMessage });
     dispatch({ type: 'SET_PROCESSING', payload: true });
 
+    // Follow-up questions continue the server session of the latest answer
+    const sessionId = [...state.messages].reverse().find((message) => message.response?.session_id)?.response?.session_id;
+
     try {
-      const response = await apiClient.askQuestion(content.trim());
+      const response = await apiClient.askQuestion(content.trim(), sessionId);
       
       const assistantMessage: Message = {
         id: (Date.now() + 1).toString(),
@@ -49,9 +49,9 @@ class ApiClient {
     );
   }
 
-  async askQuestion(query: string): Promise<QueryResponse> {
+  async askQuestion(query: string, sessionId?: string): Promise<QueryResponse> {
     try {
-      const request: QueryRequest = { query, max_tokens: 600 };
+      const request: QueryRequest = { query, max_tokens: 600, session_id: sessionId };
       const response: AxiosResponse<QueryResponse> = await this.client.post('/ask', request);
       return response.data;
     } catch (error) {
@@ -2,6 +2,7 @@
 export interface QueryRequest {
   query: string;
   max_tokens: number;
+  session_id?: string;
 }
 
 export interface QueryResponse {
@@ -9,6 +10,7 @@ export interface QueryResponse {
   citations: string[];
   retrieved_ids: number[];
   latency_ms: number;
+  session_id?: string;
 }
 
 export interface TokenValidationRequest {
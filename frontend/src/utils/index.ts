@@ -58,3 +58,126 @@ export function throttle<T extends (...args: any[]) => any>(
     }
   };
 }
+
+// Submits a generation job and polls until it finishes, resolving with the job
+// result ({ success, course_content } / { success, checklist }).
+export async function runGenerationJob(
+  path: string,
+  body: unknown,
+  idToken: string | null,
+  pollInterval: number = 2000
+): Promise<any> {
+  const headers = {
+    'Content-Type': 'application/json',
+    'Authorization': `Bearer ${idToken}`
+  };
+
+  const submitted = await fetch(`/api/jobs/${path}`, {
+    method: 'POST',
+    headers,
+    body: JSON.stringify(body)
+  });
+  if (!submitted.ok) {
+    throw new Error(`Failed to submit ${path} job`);
+  }
+  let job = await submitted.json();
+
+  while (job.status !== 'succeeded' && job.status !== 'failed') {
+    await new Promise((resolve) => setTimeout(resolve, pollInterval));
+    const polled = await fetch(`/api/jobs/${job.job_id}`, { headers });
+    if (!polled.ok) {
+      throw new Error(`Failed to check ${path} job`);
+    }
+    job = await polled.json();
+  }
+
+  if (job.status === 'failed') {
+    throw new Error(job.error || `${path} job failed`);
+  }
+  return { success: true, ...job.result };
+}
+
+// POSTs to a server-sent events endpoint and calls onEvent for each event
+// until the stream sends "done" (resolves) or "error" (rejects).
+async function readEventStream(
+  path: string,
+  body: unknown,
+  idToken: string | null,
+  onEvent: (event: string, data: any) => void
+): Promise<void> {
+  const response = await fetch(`/api/${path}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'Authorization': `Bearer ${idToken}`
+    },
+    body: JSON.stringify(body)
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`Failed to stream ${path}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) {
+      throw new Error(`${path} stream ended unexpectedly`);
+    }
+    buffer += decoder.decode(value, { stream: true });
+
+    // Server-sent events are separated by a blank line
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      const lines = buffer.slice(0, boundary).split('\n');
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf('\n\n');
+
+      const event = lines.find((line) => line.startsWith('event: '))?.slice(7);
+      const data = JSON.parse(lines.find((line) => line.startsWith('data: '))?.slice(6) || '{}');
+      if (event === 'done') {
+        return;
+      } else if (event === 'error') {
+        throw new Error(data.detail || `${path} failed`);
+      } else if (event) {
+        onEvent(event, data);
+      }
+    }
+  }
+}
+
+// Streams a course, calling onSection with the HTML received so far each time
+// a section completes. Resolves with the full HTML.
+export async function streamCourse(
+  body: unknown,
+  idToken: string | null,
+  onSection: (html: string) => void
+): Promise<string> {
+  let html = '';
+  await readEventStream('generate-course/stream', body, idToken, (event, data) => {
+    if (event === 'section') {
+      html += data.html;
+      onSection(html);
+    }
+  });
+  return html;
+}
+
+// Streams a checklist, calling onCategory as each category completes.
+// Resolves with all categories.
+export async function streamChecklist(
+  body: unknown,
+  idToken: string | null,
+  onCategory: (category: any) => void
+): Promise<any[]> {
+  const categories: any[] = [];
+  await readEventStream('generate-checklist/stream', body, idToken, (event, data) => {
+    if (event === 'category') {
+      categories.push(data.category);
+      onCategory(data.category);
+    }
+  });
+  return categories;
+}
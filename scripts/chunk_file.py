@@ -0,0 +1,34 @@
+import json
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+
+class ChunkFile:
+    """Chunks spooled to a JSONL file as they are produced; iterating re-reads them from disk."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.count: Optional[int] = None
+
+    def write(self, chunks: Iterable[Dict]) -> int:
+        """Write each chunk as soon as it arrives, so none are kept in memory."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        count = 0
+        with open(self.path, "w", encoding="utf-8") as f:
+            for chunk in chunks:
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                count += 1
+        self.count = count
+        return count
+
+    def __iter__(self) -> Iterator[Dict]:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def __len__(self) -> int:
+        if self.count is None:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.count = sum(1 for line in f if line.strip())
+        return self.count
@@ -0,0 +1,80 @@
+import re
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+# Numbered headings such as "1. Employment Policies", "3.1 Vacation" or "4.2.1 Eligibility"
+CLAUSE_HEADING = re.compile(r"^(\d+(?:\.\d+)*)\.?\s+(\S.*)$")
+PAGE_NUMBER = re.compile(r"^\d+$")
+
+
+def _clean(text: str) -> str:
+    return text.replace("​", "").strip()
+
+
+class ClauseCollector:
+    """
+    Records each numbered clause of a document - its own verbatim text, heading
+    path and page span - as pages stream past on their way to the chunker.
+    A clause's text runs up to the next numbered heading of any level; parents
+    are reassembled from their sub-clauses at lookup time.
+    """
+
+    def __init__(self, doc_id: str):
+        self.doc_id = doc_id
+        self.clauses: Dict[str, Dict] = {}
+        self._ancestors: List[Dict] = []
+        self._current: Optional[Dict] = None
+        self._parts: List[str] = []
+
+    def observe(self, pages: Iterable[Dict]) -> Iterator[Dict]:
+        for page in pages:
+            self._add_page(page)
+            yield page
+        self._close()
+
+    def records(self) -> List[Dict]:
+        """Clauses in document order, e.g. 1, 1.1, 1.2, 2, 2.1, ..."""
+        return sorted(self.clauses.values(), key=lambda clause: [int(n) for n in clause["clause"].split(".")])
+
+    def _add_page(self, page: Dict):
+        blocks = [block for block in page["text_blocks"] if _clean(block["text"])]
+        # The last block of a page is usually its printed page number
+        if blocks and PAGE_NUMBER.match(_clean(blocks[-1]["text"])):
+            blocks.pop()
+
+        for block in blocks:
+            text = _clean(block["text"])
+            match = CLAUSE_HEADING.match(text) if block["is_heading"] else None
+            if match:
+                self._open(match.group(1), match.group(2), text, page["page_num"])
+            elif self._current is not None:
+                # Bullets and labels start their own line; everything else flows as in the chunker
+                self._parts.append("\n" + text if text == "●" or text.endswith(":") else text)
+                self._current["page_end"] = page["page_num"]
+
+    def _open(self, number: str, title: str, heading: str, page_num: int):
+        self._close()
+        while self._ancestors and not number.startswith(self._ancestors[-1]["clause"] + "."):
+            self._ancestors.pop()
+
+        self._current = {
+            "doc_id": self.doc_id,
+            "clause": number,
+            "title": title,
+            "headings_path": [ancestor["headings_path"][-1] for ancestor in self._ancestors] + [heading],
+            "page_start": page_num,
+            "page_end": page_num
+        }
+        self._ancestors.append(self._current)
+
+    def _close(self):
+        if self._current is None:
+            return
+        clause = self._current
+        clause["text"] = re.sub(r"[ \t]*\n[ \t]*", "\n", " ".join(self._parts)).strip()
+        # A table of contents repeats every heading with no body; keep the fullest occurrence
+        existing = self.clauses.get(clause["clause"])
+        if existing is None or len(clause["text"]) > len(existing["text"]):
+            self.clauses[clause["clause"]] = clause
+        self._current = None
+        self._parts = []
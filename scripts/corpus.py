@@ -0,0 +1,184 @@
+import hashlib
+import json
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+import re
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from pdf_processor import PDFProcessor
+from text_chunker import TextChunker
+from chunk_file import ChunkFile
+from clause_index import ClauseCollector
+
+
+CORPUS_MANIFEST_FILENAME = "corpus_manifest.json"
+CLAUSE_INDEX_FILENAME = "clause_index.json"
+DOCUMENTS_DIRNAME = "documents"
+
+
+def document_id(pdf_path: str) -> str:
+    """Stable id from the file name, e.g. "HR_Manual.pdf" -> "hr-manual"."""
+    return re.sub(r"[^a-z0-9]+", "-", Path(pdf_path).stem.lower()).strip("-") or "document"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def process_document(pdf_path: str, doc_id: str, chunks_path: str, clauses_path: str,
+                     page_workers: int, ocr_options: Dict) -> Tuple[int, int]:
+    """
+    Extract and chunk one PDF straight into its chunk file, collecting its
+    numbered clauses on the way, and return (page_count, chunk_count).
+    Runs in a worker process for multi-document ingests.
+    """
+    processor = PDFProcessor(pdf_path, **ocr_options)
+    try:
+        chunker = TextChunker(doc_id=doc_id)
+        clauses = ClauseCollector(doc_id)
+        pages = clauses.observe(processor.iter_pages(workers=page_workers))
+        chunk_count = ChunkFile(chunks_path).write(chunker.iter_chunks(pages))
+        ChunkFile(clauses_path).write(clauses.records())
+        return len(processor.doc), chunk_count
+    finally:
+        processor.close()
+
+
+class Corpus:
+    """
+    Per-document chunks and embeddings kept under <index-dir>/documents/<doc_id>,
+    tracked by a manifest of doc_id -> file hash, page count and chunk range.
+    The combined indexes are assembled from these, so only added or changed
+    documents are extracted and embedded again.
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = Path(index_dir)
+        self.manifest_path = self.index_dir / CORPUS_MANIFEST_FILENAME
+        self.documents: Dict[str, Dict] = {}
+        self.embedding_model: Optional[str] = None
+        self.embedding_dimensions: Optional[int] = None
+        self._removed: List[str] = []
+
+        if self.manifest_path.exists():
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            self.documents = manifest.get("documents", {})
+            self.embedding_model = manifest.get("embedding_model")
+            self.embedding_dimensions = manifest.get("embedding_dimensions")
+
+    def document_dir(self, doc_id: str) -> Path:
+        return self.index_dir / DOCUMENTS_DIRNAME / doc_id
+
+    def chunks_path(self, doc_id: str) -> Path:
+        return self.document_dir(doc_id) / "chunks.jsonl"
+
+    def embeddings_path(self, doc_id: str) -> Path:
+        return self.document_dir(doc_id) / "embeddings.npy"
+
+    def clauses_path(self, doc_id: str) -> Path:
+        return self.document_dir(doc_id) / "clauses.jsonl"
+
+    def doc_ids(self) -> List[str]:
+        return sorted(self.documents)
+
+    def is_current(self, doc_id: str, sha256: str) -> bool:
+        entry = self.documents.get(doc_id)
+        return (entry is not None and entry["sha256"] == sha256
+                and self.chunks_path(doc_id).exists() and self.clauses_path(doc_id).exists())
+
+    def prepare(self, doc_id: str):
+        """Clear a document's stored artifacts before it is reprocessed."""
+        self.document_dir(doc_id).mkdir(parents=True, exist_ok=True)
+        self.embeddings_path(doc_id).unlink(missing_ok=True)
+
+    def record(self, doc_id: str, pdf_path: str, sha256: str, page_count: int, chunk_count: int):
+        self.documents[doc_id] = {
+            "path": str(pdf_path),
+            "sha256": sha256,
+            "page_count": page_count,
+            "chunk_count": chunk_count,
+            "ingested_at": datetime.now(timezone.utc).isoformat(timespec="seconds")
+        }
+
+    def remove(self, doc_id: str):
+        """Drop a document; its files are deleted once the new manifest is saved."""
+        if self.documents.pop(doc_id, None) is not None:
+            self._removed.append(doc_id)
+
+    def use_embeddings(self, model: str, dimensions: Optional[int]):
+        """Stored vectors from a different model or size can't be mixed in, so drop them."""
+        if (model, dimensions) != (self.embedding_model, self.embedding_dimensions):
+            for doc_id in self.documents:
+                self.embeddings_path(doc_id).unlink(missing_ok=True)
+        self.embedding_model = model
+        self.embedding_dimensions = dimensions
+
+    def assemble_chunks(self, chunks: ChunkFile) -> int:
+        """
+        Concatenate document chunks in doc_id order into the combined chunk file,
+        numbering chunk_index by position so it matches the index row, and
+        record each document's [chunk_start, chunk_end) range.
+        """
+        def renumbered():
+            position = 0
+            for doc_id in self.doc_ids():
+                entry = self.documents[doc_id]
+                entry["chunk_start"] = position
+                for chunk in ChunkFile(self.chunks_path(doc_id)):
+                    chunk["chunk_index"] = position
+                    chunk["chunk_id"] = f"chunk_{position:04d}"
+                    yield chunk
+                    position += 1
+                entry["chunk_end"] = position
+
+        return chunks.write(renumbered())
+
+    def assemble_clauses(self, path: str) -> int:
+        """
+        Write the combined clause index, pointing each clause at the chunks
+        (by global chunk_index) whose pages overlap it. Run after assemble_chunks.
+        """
+        clauses = []
+        for doc_id in self.doc_ids():
+            chunk_start = self.documents[doc_id].get("chunk_start", 0)
+            chunk_pages = [chunk["pages"] for chunk in ChunkFile(self.chunks_path(doc_id))]
+            # Chunks run in page order, so the ones overlapping a clause sit between two
+            # bisections: on first pages, and on the running maximum of last pages
+            firsts = [first for first, _ in chunk_pages]
+            reach = list(accumulate((last for _, last in chunk_pages), max))
+            for clause in ChunkFile(self.clauses_path(doc_id)):
+                lo = bisect_left(reach, clause["page_start"])
+                hi = bisect_right(firsts, clause["page_end"])
+                clause["chunk_indices"] = [
+                    chunk_start + position for position in range(lo, hi)
+                    if chunk_pages[position][1] >= clause["page_start"]
+                ]
+                clauses.append(clause)
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"num_clauses": len(clauses), "clauses": clauses}, f, indent=2, ensure_ascii=False)
+        return len(clauses)
+
+    def save(self):
+        manifest = {
+            "embedding_model": self.embedding_model,
+            "embedding_dimensions": self.embedding_dimensions,
+            "num_documents": len(self.documents),
+            "num_chunks": sum(entry["chunk_count"] for entry in self.documents.values()),
+            "documents": {doc_id: self.documents[doc_id] for doc_id in self.doc_ids()}
+        }
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        for doc_id in self._removed:
+            if doc_id not in self.documents:
+                shutil.rmtree(self.document_dir(doc_id), ignore_errors=True)
+        self._removed = []
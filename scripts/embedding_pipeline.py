@@ -0,0 +1,110 @@
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import tiktoken
+from openai import OpenAI, RateLimitError, APIConnectionError, InternalServerError
+
+# Scripts run from scripts/; the token buckets are the serving app's, so its package must resolve
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from app.rate_limit import RateLimiter
+
+
+# text-embedding-3 models share the cl100k_base vocabulary
+EMBEDDING_ENCODING = "cl100k_base"
+MAX_INPUTS_PER_REQUEST = 2048
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+
+class EmbeddingPipeline:
+    """Token-packed, concurrent, rate-limited embedding requests with jittered retries."""
+
+    def __init__(self, client: OpenAI, model: str, dimensions: Optional[int] = None,
+                 concurrency: int = 4, requests_per_minute: int = 3000,
+                 tokens_per_minute: int = 1_000_000, max_batch_tokens: int = 50_000,
+                 max_retries: int = 6, base_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions
+        self.concurrency = concurrency
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.tokenizer = tiktoken.get_encoding(EMBEDDING_ENCODING)
+
+    def pack_batches(self, keys: List[str], texts: List[str]) -> List[Tuple[List[str], List[str], int]]:
+        """Greedily group texts into requests bounded by token and input counts."""
+        token_counts = [len(tokens) for tokens in self.tokenizer.encode_ordinary_batch(texts)]
+        batches = []
+        batch_keys, batch_texts, batch_tokens = [], [], 0
+        for key, text, count in zip(keys, texts, token_counts):
+            if batch_keys and (batch_tokens + count > self.max_batch_tokens
+                               or len(batch_keys) >= MAX_INPUTS_PER_REQUEST):
+                batches.append((batch_keys, batch_texts, batch_tokens))
+                batch_keys, batch_texts, batch_tokens = [], [], 0
+            batch_keys.append(key)
+            batch_texts.append(text)
+            batch_tokens += count
+        if batch_keys:
+            batches.append((batch_keys, batch_texts, batch_tokens))
+        return batches
+
+    def _embed_batch(self, keys: List[str], texts: List[str], tokens: int) -> Dict[str, np.ndarray]:
+        request = {"model": self.model, "input": texts}
+        if self.dimensions:
+            request["dimensions"] = self.dimensions
+
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(tokens)
+            try:
+                response = self.client.embeddings.create(**request)
+                return {key: np.array(item.embedding, dtype=np.float32)
+                        for key, item in zip(keys, response.data)}
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(self.max_backoff, self.base_backoff * 2 ** attempt)
+                retry_after = getattr(getattr(e, "response", None), "headers", {}).get("retry-after")
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                delay = random.uniform(delay / 2, delay)
+                print(f"Embedding request failed ({type(e).__name__}), retry {attempt + 1}/{self.max_retries} "
+                      f"in {delay:.1f}s")
+                time.sleep(delay)
+
+    def embed(self, texts_by_key: Dict[str, str],
+              on_batch: Optional[Callable[[Dict[str, np.ndarray]], None]] = None) -> Dict[str, np.ndarray]:
+        """
+        Embed every text, keeping up to `concurrency` requests in flight.
+        on_batch runs in the calling thread as each batch finishes, so callers
+        can checkpoint progress before the whole run completes.
+        """
+        batches = self.pack_batches(list(texts_by_key), list(texts_by_key.values()))
+        total = len(texts_by_key)
+        vectors: Dict[str, np.ndarray] = {}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._embed_batch, *batch) for batch in batches]
+            try:
+                for future in as_completed(futures):
+                    batch_vectors = future.result()
+                    vectors.update(batch_vectors)
+                    if on_batch:
+                        on_batch(batch_vectors)
+                    print(f"Generated embeddings for {len(vectors)}/{total} texts")
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        return vectors
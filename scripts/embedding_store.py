@@ -0,0 +1,56 @@
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+
+class EmbeddingStore:
+    """Persistent content-addressed cache of embedding vectors, keyed by hash(model, dims, text)."""
+
+    # SQLite caps bound parameters per statement
+    LOOKUP_BATCH = 500
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def key(model: str, dimensions: Optional[int], text: str) -> str:
+        payload = json.dumps([model, dimensions, text], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        keys = list(keys)
+        found = {}
+        for i in range(0, len(keys), self.LOOKUP_BATCH):
+            batch = keys[i:i + self.LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            )
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, vectors: Dict[str, np.ndarray]):
+        rows = []
+        for key, vector in vectors.items():
+            vector = np.asarray(vector, dtype=np.float32)
+            rows.append((key, int(vector.shape[0]), vector.tobytes()))
+        self.conn.executemany("INSERT OR REPLACE INTO embeddings (key, dim, vector) VALUES (?, ?, ?)", rows)
+        self.conn.commit()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
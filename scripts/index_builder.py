@@ -1,20 +1,186 @@
 import json
+import os
 import pickle
 import re
+import sys
+from itertools import islice
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
 
 import numpy as np
 import faiss
+import tiktoken
 from openai import OpenAI
 from rank_bm25 import BM25Okapi
 
+from embedding_store import EmbeddingStore
+from embedding_pipeline import EmbeddingPipeline
+
+# Sentence spans are stored for the app's context compressor, so both split with its splitter
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from app.sentences import sentence_spans
+
+
+INDEX_TYPES = ("flat_ip", "hnsw", "ivf")
+QUANTIZATIONS = ("none", "sq8", "pq")
+MANIFEST_FILENAME = "index_manifest.json"
+SENTENCE_INDEX_FILENAME = "sentences.npz"
+
+
+def default_ivf_nlist(num_vectors: int) -> int:
+    return max(1, min(num_vectors, int(4 * np.sqrt(num_vectors))))
+
+
+def default_pq_m(dimension: int) -> int:
+    """Largest sub-quantizer count dividing the dimension at <= dimension/16 bytes per vector."""
+    for pq_m in range(max(1, dimension // 16), 0, -1):
+        if dimension % pq_m == 0:
+            return pq_m
+    return 1
+
+
+def create_faiss_index(embeddings: np.ndarray, index_type: str, hnsw_m: int = 32,
+                       ef_construction: int = 200, ivf_nlist: Optional[int] = None,
+                       quantization: str = "none", pq_m: Optional[int] = None) -> faiss.Index:
+    """Build an inner-product FAISS index over L2-normalized embeddings."""
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATIONS}")
+    if quantization == "pq" and len(embeddings) < 256:
+        raise ValueError("PQ needs at least 256 vectors to train its codebooks; use sq8 instead")
+    
+    dimension = embeddings.shape[1]
+    encoding = {"none": "Flat", "sq8": "SQ8", "pq": f"PQ{pq_m or default_pq_m(dimension)}"}[quantization]
+    
+    if index_type == "flat_ip":
+        if quantization == "none":
+            index = faiss.IndexFlatIP(dimension)
+        else:
+            index = faiss.index_factory(dimension, encoding, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "hnsw":
+        if quantization == "none":
+            index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.index_factory(dimension, f"HNSW{hnsw_m},{encoding}", faiss.METRIC_INNER_PRODUCT)
+        faiss.downcast_index(index).hnsw.efConstruction = ef_construction
+    elif index_type == "ivf":
+        # A list count kept from an earlier, larger corpus can't exceed the vectors to train on
+        nlist = min(ivf_nlist, len(embeddings)) if ivf_nlist else default_ivf_nlist(len(embeddings))
+        index = faiss.index_factory(dimension, f"IVF{nlist},{encoding}", faiss.METRIC_INNER_PRODUCT)
+    else:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+    
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+
+def apply_search_params(index: faiss.Index, ef_search: Optional[int] = None, nprobe: Optional[int] = None):
+    hnsw_index = faiss.downcast_index(index)
+    if ef_search is not None and hasattr(hnsw_index, "hnsw"):
+        hnsw_index.hnsw.efSearch = ef_search
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if nprobe is not None and ivf_index is not None:
+        ivf_index.nprobe = min(nprobe, ivf_index.nlist)
+
+
+def quantization_report(embeddings: np.ndarray, index: faiss.Index, k: int = 10,
+                        rescore_factor: int = 4, num_queries: int = 100) -> Dict:
+    """Memory per vector and recall@k of a compressed index, before and after exact rescoring."""
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(embeddings), size=min(num_queries, len(embeddings)), replace=False)
+    queries = embeddings[rows]
+    k = min(k, len(embeddings))
+    
+    exact = faiss.IndexFlatIP(embeddings.shape[1])
+    exact.add(embeddings)
+    _, truth = exact.search(queries, k)
+    
+    _, approx = index.search(queries, k)
+    _, candidates = index.search(queries, min(k * rescore_factor, len(embeddings)))
+    rescored = []
+    for query, ids in zip(queries, candidates):
+        ids = ids[ids >= 0]
+        sims = embeddings[ids] @ query
+        rescored.append(ids[np.argsort(-sims)[:k]])
+    
+    def recall(found) -> float:
+        return sum(len(set(f) & set(t)) for f, t in zip(found, truth)) / truth.size
+    
+    return {
+        "float_bytes_per_vector": int(embeddings.shape[1] * 4),
+        "index_bytes_per_vector": round(faiss.serialize_index(index).size / len(embeddings), 1),
+        "k": int(k),
+        "rescore_factor": rescore_factor,
+        "recall": round(recall(approx), 4),
+        "recall_rescored": round(recall(rescored), 4)
+    }
+
+
+def write_json_array(path: Path, items: Iterable[Dict]):
+    """Stream a list to disk in the same layout as json.dump(items, indent=2)."""
+    with open(path, "w", encoding="utf-8") as f:
+        first = True
+        for item in items:
+            f.write("[\n" if first else ",\n")
+            f.write("\n".join("  " + line for line in json.dumps(item, indent=2, ensure_ascii=False).split("\n")))
+            first = False
+        f.write("[]" if first else "\n]")
+
+
+def _batched(items: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
 
 class IndexBuilder:
-    def __init__(self, chunks: List[Dict], openai_api_key: str, embedding_model: str):
+    # Chunks embedded per round; bounds the texts and vectors held in memory at once
+    EMBED_WINDOW = 2048
+    
+    def __init__(self, chunks: Iterable[Dict], openai_api_key: str, embedding_model: str,
+                 index_type: str = "flat_ip", hnsw_m: int = 32, ef_construction: int = 200,
+                 ivf_nlist: Optional[int] = None, ef_search: int = 64, nprobe: int = 8,
+                 quantization: str = "none", pq_m: Optional[int] = None,
+                 dimensions: Optional[int] = None, embedding_store: Optional[EmbeddingStore] = None,
+                 embed_concurrency: int = 4, requests_per_minute: int = 3000,
+                 tokens_per_minute: int = 1_000_000, max_batch_tokens: int = 50_000,
+                 spool_dir: Optional[str] = None, dimension_reduction: Optional[Dict] = None,
+                 reduced_dimension: Optional[int] = None, projection: Optional[Dict] = None):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATIONS}")
+        
+        # Any re-iterable with a length: a list, or a ChunkFile streamed from disk
         self.chunks = chunks
-        self.client = OpenAI(api_key=openai_api_key)
+        # When set, embeddings are written to a memory-mapped file here instead of held in memory
+        self.spool_dir = spool_dir
+        # Retries are handled by the embedding pipeline with rate-limit-aware backoff
+        self.client = OpenAI(api_key=openai_api_key, max_retries=0)
         self.embedding_model = embedding_model
+        self.index_type = index_type
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ivf_nlist = ivf_nlist
+        self.ef_search = ef_search
+        self.nprobe = nprobe
+        self.quantization = quantization
+        self.pq_m = pq_m
+        self.quantization_stats = None
+        self.dimensions = dimensions
+        # An offline reduction from reduce_dims.py (truncate or pca) to reapply to the
+        # assembled embeddings, with the fitted PCA mean and components
+        self.dimension_reduction = dimension_reduction
+        self.reduced_dimension = reduced_dimension
+        self.projection = projection
+        self.full_embeddings = None
+        self.embedding_store = embedding_store
+        self.embedding_pipeline = EmbeddingPipeline(
+            self.client, embedding_model, dimensions=dimensions,
+            concurrency=embed_concurrency, requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute, max_batch_tokens=max_batch_tokens
+        )
         self.embeddings = None
         self.faiss_index = None
         self.bm25_index = None
@@ -22,44 +188,227 @@ class IndexBuilder:
     def build_bm25_index(self) -> BM25Okapi:
         print("Building BM25 index...")
         
-        tokenized_chunks = []
-        for chunk in self.chunks:
-            tokens = re.findall(r'\b\w+\b', chunk["text"].lower())
-            tokenized_chunks.append(tokens)
+        # BM25Okapi consumes the corpus in a single pass, so token lists are never all held at once
+        tokenized_chunks = (
+            re.findall(r'\b\w+\b', self._add_normalized_fields(chunk)["text_lower"])
+            for chunk in self.chunks
+        )
         
         self.bm25_index = BM25Okapi(tokenized_chunks)
         return self.bm25_index
     
-    def build_faiss_index(self) -> Tuple[faiss.IndexHNSWFlat, np.ndarray]:
-        print("Generating embeddings...")
+    @staticmethod
+    def _add_normalized_fields(chunk: Dict) -> Dict:
+        # Normalized fields let the retriever match keywords without
+        # lowercasing every candidate on every query
+        chunk["text_lower"] = chunk["text"].lower()
+        chunk["headings_lower"] = " ".join(chunk.get("headings_path", [])).lower()
+        return chunk
+    
+    def build_faiss_index(self) -> Tuple[faiss.Index, np.ndarray]:
+        if self.embeddings is None:
+            print("Generating embeddings...")
+            self.embeddings = self.embed_chunks(self.chunks, self._spool_path() if self.spool_dir else None)
+        
+        print(f"Building FAISS index ({self.index_type}, quantization={self.quantization})...")
+        
+        self.faiss_index = create_faiss_index(
+            self.embeddings, self.index_type, hnsw_m=self.hnsw_m,
+            ef_construction=self.ef_construction, ivf_nlist=self.ivf_nlist,
+            quantization=self.quantization, pq_m=self.pq_m
+        )
         
-        batch_size = 100
-        all_embeddings = []
+        if self.quantization != "none":
+            apply_search_params(self.faiss_index, self.ef_search, self.nprobe)
+            self.quantization_stats = quantization_report(self.embeddings, self.faiss_index)
+            stats = self.quantization_stats
+            print(f"Quantization: {stats['index_bytes_per_vector']} bytes/vector in index "
+                  f"vs {stats['float_bytes_per_vector']} float32; "
+                  f"recall@{stats['k']} {stats['recall']:.4f} raw, "
+                  f"{stats['recall_rescored']:.4f} after x{stats['rescore_factor']} exact rescoring")
         
-        for i in range(0, len(self.chunks), batch_size):
-            batch_chunks = self.chunks[i:i + batch_size]
-            batch_texts = [chunk["text"] for chunk in batch_chunks]
+        return self.faiss_index, self.embeddings
+    
+    def embed_chunks(self, chunks: Iterable[Dict], path: Optional[Path] = None) -> np.ndarray:
+        """
+        Embed only chunk texts the store hasn't seen, once per distinct text,
+        and assemble the normalized matrix in chunk order from stored and new
+        vectors. Chunks are processed EMBED_WINDOW at a time; with a path the
+        matrix itself is a memory-mapped .npy file. Each finished batch is
+        written to the store, so a failed run resumes from where it stopped.
+        """
+        embeddings = None
+        row = 0
+        
+        for window in _batched(chunks, self.EMBED_WINDOW):
+            keys = [EmbeddingStore.key(self.embedding_model, self.dimensions, chunk["text"]) for chunk in window]
+            texts_by_key = dict(zip(keys, (chunk["text"] for chunk in window)))
             
-            response = self.client.embeddings.create(
-                model=self.embedding_model,
-                input=batch_texts
-            )
+            vectors = self.embedding_store.get_many(texts_by_key) if self.embedding_store is not None else {}
+            missing = [key for key in texts_by_key if key not in vectors]
+            print(f"Embeddings: chunks {row}-{row + len(keys)}, {len(texts_by_key)} distinct texts, "
+                  f"{len(vectors)} reused, {len(missing)} to embed")
             
-            batch_embeddings = [item.embedding for item in response.data]
-            all_embeddings.extend(batch_embeddings)
+            if missing:
+                on_batch = self.embedding_store.put_many if self.embedding_store is not None else None
+                vectors.update(self.embedding_pipeline.embed({key: texts_by_key[key] for key in missing}, on_batch))
             
-            print(f"Generated embeddings for chunks {i+1}-{min(i+batch_size, len(self.chunks))}")
+            block = np.stack([vectors[key] for key in keys]).astype(np.float32)
+            # Unit vectors make inner product equal to cosine similarity
+            faiss.normalize_L2(block)
+            
+            if embeddings is None:
+                embeddings = self._allocate((len(chunks), block.shape[1]), path)
+            embeddings[row:row + len(block)] = block
+            row += len(block)
         
-        self.embeddings = np.array(all_embeddings, dtype=np.float32)
+        if isinstance(embeddings, np.memmap):
+            embeddings.flush()
+        return embeddings
+    
+    def assemble_embeddings(self, paths: List[Path]) -> np.ndarray:
+        """
+        Concatenate stored per-document embeddings into the index matrix, without
+        any API calls. With an offline dimension reduction, the full-size matrix is
+        kept as well and the index matrix is its reduction.
+        """
+        parts = [np.load(path, mmap_mode="r") for path in paths]
+        shape = (sum(len(part) for part in parts), parts[0].shape[1])
+        reduce = self.dimension_reduction is not None
+        if reduce and shape[1] != self.dimension_reduction.get("full_dimension", shape[1]):
+            raise ValueError(f"stored embeddings have {shape[1]} dimensions but the "
+                             f"{self.dimension_reduction['method']} reduction was fitted on "
+                             f"{self.dimension_reduction['full_dimension']}; re-run reduce_dims.py")
+        spool_path = self._full_spool_path() if reduce else self._spool_path()
+        embeddings = self._allocate(shape, spool_path if self.spool_dir else None)
         
-        print("Building FAISS index...")
+        row = 0
+        for part in parts:
+            embeddings[row:row + len(part)] = part
+            row += len(part)
         
-        dimension = self.embeddings.shape[1]
-        self.faiss_index = faiss.IndexHNSWFlat(dimension, 32)
-        self.faiss_index.hnsw.efConstruction = 200
-        self.faiss_index.add(self.embeddings)
+        if isinstance(embeddings, np.memmap):
+            embeddings.flush()
+        if not reduce:
+            self.embeddings = embeddings
+            return self.embeddings
         
-        return self.faiss_index, self.embeddings
+        self.full_embeddings = embeddings
+        self.embeddings = self._allocate((shape[0], self.reduced_dimension),
+                                         self._spool_path() if self.spool_dir else None)
+        for start in range(0, shape[0], self.EMBED_WINDOW):
+            self.embeddings[start:start + self.EMBED_WINDOW] = self.reduce(embeddings[start:start + self.EMBED_WINDOW])
+        if isinstance(self.embeddings, np.memmap):
+            self.embeddings.flush()
+        return self.embeddings
+    
+    def reduce(self, embeddings: np.ndarray) -> np.ndarray:
+        """Apply the offline reduction exactly as reduce_dims.py did, renormalized."""
+        if self.dimension_reduction["method"] == "pca":
+            reduced = (np.asarray(embeddings, dtype=np.float32) - self.projection["mean"]) @ self.projection["components"].T
+        else:
+            reduced = embeddings[:, :self.reduced_dimension]
+        reduced = np.ascontiguousarray(reduced, dtype=np.float32)
+        faiss.normalize_L2(reduced)
+        return reduced
+    
+    @staticmethod
+    def _allocate(shape: Tuple[int, int], path: Optional[Path]) -> np.ndarray:
+        if path is None:
+            return np.empty(shape, dtype=np.float32)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        return np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+    
+    def build_sentence_index(self, output_dir: str, embed: bool = False):
+        """
+        Write the sentence spans and token counts of every chunk, in chunk order,
+        for compressing /ask context, and with `embed` their unit embeddings as
+        float16. Sentences are embedded through the same store as chunks, so a
+        re-ingest only embeds sentences it hasn't seen.
+        """
+        encoding = tiktoken.get_encoding("cl100k_base")
+        offsets = [0]
+        spans = []
+        token_counts = []
+        blocks = []
+
+        for window in _batched(self.chunks, self.EMBED_WINDOW):
+            texts = []
+            for chunk in window:
+                chunk_spans = sentence_spans(chunk["text"])
+                spans.extend(chunk_spans)
+                offsets.append(offsets[-1] + len(chunk_spans))
+                texts.extend(chunk["text"][start:end] for start, end in chunk_spans)
+            token_counts.extend(len(tokens) for tokens in encoding.encode_batch(texts))
+            if not embed:
+                continue
+
+            keys = [EmbeddingStore.key(self.embedding_model, self.dimensions, text) for text in texts]
+            texts_by_key = dict(zip(keys, texts))
+            vectors = self.embedding_store.get_many(texts_by_key) if self.embedding_store is not None else {}
+            missing = [key for key in texts_by_key if key not in vectors]
+            print(f"Sentence embeddings: {len(texts)} sentences, {len(vectors)} reused, {len(missing)} to embed")
+            if missing:
+                on_batch = self.embedding_store.put_many if self.embedding_store is not None else None
+                vectors.update(self.embedding_pipeline.embed({key: texts_by_key[key] for key in missing}, on_batch))
+
+            block = np.stack([vectors[key] for key in keys]).astype(np.float32)
+            faiss.normalize_L2(block)
+            blocks.append(block.astype(np.float16))
+
+        arrays = {
+            "offsets": np.asarray(offsets, dtype=np.int64),
+            "spans": np.asarray(spans, dtype=np.int32).reshape(-1, 2),
+            "token_counts": np.asarray(token_counts, dtype=np.int32)
+        }
+        if blocks:
+            arrays["embeddings"] = np.concatenate(blocks)
+        np.savez(Path(output_dir) / SENTENCE_INDEX_FILENAME, **arrays)
+        print(f"Indexed {len(spans)} sentences" + (" with embeddings" if blocks else ""))
+
+    def _spool_path(self) -> Path:
+        return Path(self.spool_dir) / "embeddings.npy.partial"
+    
+    def _full_spool_path(self) -> Path:
+        return Path(self.spool_dir) / "embeddings_full.npy.partial"
+    
+    def build_manifest(self) -> Dict:
+        """Describe the FAISS index so the loader can configure search for it."""
+        build_params = {}
+        search_params = {}
+        if self.index_type == "hnsw":
+            build_params = {"hnsw_m": self.hnsw_m, "ef_construction": self.ef_construction}
+            search_params = {"ef_search": self.ef_search}
+        elif self.index_type == "ivf":
+            nlist = self.ivf_nlist or default_ivf_nlist(len(self.embeddings))
+            build_params = {"ivf_nlist": nlist}
+            search_params = {"nprobe": min(self.nprobe, nlist)}
+        
+        manifest = {
+            "index_type": self.index_type,
+            "metric": "inner_product",
+            "normalized": True,
+            "embedding_model": self.embedding_model,
+            "dimension": int(self.embeddings.shape[1]),
+            "embedding_dimensions": self.dimensions,
+            "dimension_reduction": {"method": "api", "source_dimensions": None} if self.dimensions else None,
+            "num_vectors": int(self.embeddings.shape[0]),
+            "build_params": build_params,
+            "search_params": search_params,
+            "quantization": self.quantization,
+            "pq_m": (self.pq_m or default_pq_m(int(self.embeddings.shape[1]))) if self.quantization == "pq" else None,
+            "rescore": self.quantization != "none",
+            "quantization_report": self.quantization_stats
+        }
+        if self.dimension_reduction is not None:
+            # Same fields reduce_dims.py writes; its recall was measured when the reduction was fitted
+            manifest.update({
+                "embedding_dimensions": self.reduced_dimension if self.dimension_reduction["method"] == "truncate"
+                                        else self.dimensions,
+                "source_embedding_dimensions": self.dimensions,
+                "dimension_reduction": self.dimension_reduction
+            })
+        return manifest
     
     def save_indexes(self, output_dir: str):
         output_path = Path(output_dir)
@@ -68,8 +417,7 @@ class IndexBuilder:
         print(f"Saving indexes to {output_path}...")
         
         # Save with brief-specified filenames
-        with open(output_path / "meta_full.json", "w", encoding="utf-8") as f:
-            json.dump(self.chunks, f, indent=2, ensure_ascii=False)
+        write_json_array(output_path / "meta_full.json", map(self._add_normalized_fields, self.chunks))
         
         # Save BM25 corpus as JSONL format
         with open(output_path / "bm25_corpus.jsonl", "w", encoding="utf-8") as f:
@@ -87,11 +435,29 @@ class IndexBuilder:
         
         # Brief specifies faiss.index filename
         faiss.write_index(self.faiss_index, str(output_path / "faiss.index"))
-        np.save(output_path / "embeddings.npy", self.embeddings)
+        if isinstance(self.embeddings, np.memmap):
+            # Replace rather than overwrite: a running API may have the old file mapped
+            self.embeddings.flush()
+            os.replace(self._spool_path(), output_path / "embeddings.npy")
+        else:
+            np.save(output_path / "embeddings.npy", self.embeddings)
+        
+        with open(output_path / MANIFEST_FILENAME, "w", encoding="utf-8") as f:
+            json.dump(self.build_manifest(), f, indent=2)
+        if self.dimension_reduction is not None:
+            # reduce_dims.py refits from the full-size vectors, so they stay beside the reduced ones
+            if isinstance(self.full_embeddings, np.memmap):
+                self.full_embeddings.flush()
+                os.replace(self._full_spool_path(), output_path / "embeddings_full.npy")
+            else:
+                np.save(output_path / "embeddings_full.npy", self.full_embeddings)
+        else:
+            # Fresh embeddings supersede any earlier offline dimension reduction
+            (output_path / "embeddings_full.npy").unlink(missing_ok=True)
+            (output_path / "pca.npz").unlink(missing_ok=True)
         
         # Keep legacy files for backward compatibility
-        with open(output_path / "metadata.json", "w", encoding="utf-8") as f:
-            json.dump(self.chunks, f, indent=2, ensure_ascii=False)
+        write_json_array(output_path / "metadata.json", map(self._add_normalized_fields, self.chunks))
         faiss.write_index(self.faiss_index, str(output_path / "faiss_index.index"))
         
         print("Indexes saved successfully!")
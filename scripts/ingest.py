@@ -1,41 +1,272 @@
 #!/usr/bin/env python3
 """
 Data ingestion script for ETI RAG system.
-Parses HR manual PDF, chunks it, and creates BM25 corpus and FAISS index.
+Parses HR PDFs, chunks them, and creates BM25 corpus and FAISS index.
+Pages, chunks and embeddings are streamed stage to stage rather than
+materialized, so peak memory does not grow with the page count.
+Documents are tracked in a corpus manifest: only added or changed PDFs are
+extracted and embedded, and removed ones are dropped without re-embedding
+the rest.
 """
 
 import os
+import json
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
 from dotenv import load_dotenv
 
-from pdf_processor import PDFProcessor
-from text_chunker import TextChunker
-from index_builder import IndexBuilder
+from index_builder import IndexBuilder, INDEX_TYPES, QUANTIZATIONS, MANIFEST_FILENAME
+from embedding_store import EmbeddingStore
+from chunk_file import ChunkFile
+from corpus import Corpus, CLAUSE_INDEX_FILENAME, document_id, file_sha256, process_document
 
 load_dotenv()
 
+# Index settings for a first build; later runs keep whatever the existing index uses
+INDEX_DEFAULTS = {
+    "index_type": "flat_ip",
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "ef_search": 64,
+    "nprobe": 8,
+    "quantization": "none"
+}
+
+
+def inherit_index_config(args: argparse.Namespace, output_dir: str,
+                         embedding_model: str) -> Tuple[Dict, Optional[Dict]]:
+    """
+    Fill the index flags that weren't given from the existing index manifest, so a
+    re-ingest keeps what tune_index.py, --quantization and reduce_dims.py chose.
+    Returns the manifest and the offline dimension reduction to reapply, if any.
+    """
+    manifest_path = Path(output_dir) / MANIFEST_FILENAME
+    manifest = {}
+    if manifest_path.exists():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    
+    # Embeddings are requested at the size the reduction started from
+    reduction = manifest.get("dimension_reduction") or {}
+    offline = reduction.get("method") in ("truncate", "pca")
+    source_dimensions = reduction.get("source_dimensions") if offline else manifest.get("embedding_dimensions")
+    if args.dimensions is None:
+        args.dimensions = source_dimensions
+    same_size = (args.dimensions == source_dimensions
+                 and manifest.get("embedding_model", embedding_model) == embedding_model)
+    if offline and not same_size:
+        print(f"WARNING: the embedding model or size changed, so the {reduction['method']} reduction "
+              f"to {manifest['dimension']} dimensions is dropped; re-run reduce_dims.py to restore it")
+        offline = False
+    if offline and reduction["method"] == "pca" and not (Path(output_dir) / "pca.npz").exists():
+        print(f"WARNING: pca.npz is missing from {output_dir}, so the pca reduction "
+              f"to {manifest['dimension']} dimensions is dropped; re-run reduce_dims.py to restore it")
+        offline = False
+        same_size = False
+    
+    # Build and search parameters only carry over to the same kind of index
+    if args.index_type in (None, manifest.get("index_type")):
+        params = {**manifest.get("build_params", {}), **manifest.get("search_params", {})}
+        for name in ("hnsw_m", "ef_construction", "ivf_nlist", "ef_search", "nprobe"):
+            if getattr(args, name) is None:
+                setattr(args, name, params.get(name))
+    if args.index_type is None:
+        args.index_type = manifest.get("index_type")
+    if args.quantization is None:
+        args.quantization = manifest.get("quantization")
+        # The PQ sub-quantizer count has to divide the index dimension
+        if args.pq_m is None and args.quantization == "pq" and same_size:
+            args.pq_m = manifest.get("pq_m")
+    for name, default in INDEX_DEFAULTS.items():
+        if getattr(args, name) is None:
+            setattr(args, name, default)
+    
+    if manifest:
+        print(f"Index: {args.index_type}, quantization={args.quantization}"
+              + (f", {reduction['method']} reduction to {manifest['dimension']} dims" if offline else ""))
+    return manifest, reduction if offline else None
+
 
 def main():
-    parser = argparse.ArgumentParser(description="Ingest PDF and build indexes")
-    parser.add_argument("--pdf", required=True, help="Path to PDF file")
+    parser = argparse.ArgumentParser(description="Ingest PDFs and build indexes")
+    parser.add_argument("--pdf", action="append", default=[],
+                       help="Add or update a PDF in the corpus (repeatable)")
+    parser.add_argument("--pdf-dir", default=None,
+                       help="Sync the corpus to the PDFs in this directory (adds, updates and removes)")
+    parser.add_argument("--remove", action="append", default=[], metavar="DOC_ID",
+                       help="Remove a document from the corpus (repeatable)")
     parser.add_argument("--output-dir", default=os.getenv("INDEX_DIR", "/var/data/index"), 
                        help="Output directory for indexes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                       help="Processes for PDF extraction: pages of one PDF, or whole PDFs in parallel (1 = serial)")
+    parser.add_argument("--ocr-workers", type=int, default=2, help="Concurrent OCR processes for image-only pages")
+    parser.add_argument("--ocr-dpi", type=int, default=144, help="Rasterization DPI for OCR")
+    parser.add_argument("--ocr-lang", default="eng", help="Tesseract language(s), e.g. eng+fra")
+    parser.add_argument("--ocr-cache-dir", default=None,
+                       help="OCR result cache (default: <output-dir>/ocr_cache)")
+    # Index flags left unset keep the existing index's settings, then INDEX_DEFAULTS
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=None,
+                       help="FAISS index type (all use inner product on normalized vectors; default: flat_ip)")
+    parser.add_argument("--hnsw-m", type=int, default=None, help="HNSW graph degree (default: 32)")
+    parser.add_argument("--ef-construction", type=int, default=None, help="HNSW efConstruction (default: 200)")
+    parser.add_argument("--ef-search", type=int, default=None,
+                       help="Default HNSW efSearch recorded in the manifest (default: 64)")
+    parser.add_argument("--ivf-nlist", type=int, default=None, help="IVF list count (default: 4*sqrt(chunks))")
+    parser.add_argument("--nprobe", type=int, default=None,
+                       help="Default IVF nprobe recorded in the manifest (default: 8)")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default=None,
+                       help="Compress index vectors (search results are rescored against float embeddings; default: none)")
+    parser.add_argument("--pq-m", type=int, default=None, help="PQ sub-quantizer count (default: dim/16 bytes)")
+    parser.add_argument("--dimensions", type=int,
+                       default=int(os.getenv("EMBEDDING_DIMENSIONS")) if os.getenv("EMBEDDING_DIMENSIONS") else None,
+                       help="Request reduced-dimension embeddings from the model (default: native size)")
+    parser.add_argument("--embedding-store", default=None,
+                       help="Persistent embedding cache (default: <output-dir>/embedding_store.sqlite)")
+    parser.add_argument("--no-embedding-store", action="store_true",
+                       help="Re-embed every chunk instead of reusing stored vectors")
+    parser.add_argument("--embed-concurrency", type=int, default=4, help="Embedding requests in flight")
+    parser.add_argument("--embed-rpm", type=int, default=int(os.getenv("EMBED_RPM", "3000")),
+                       help="Embedding requests-per-minute limit")
+    parser.add_argument("--embed-tpm", type=int, default=int(os.getenv("EMBED_TPM", "1000000")),
+                       help="Embedding tokens-per-minute limit")
+    parser.add_argument("--embed-batch-tokens", type=int, default=50000, help="Maximum tokens per embedding request")
+    parser.add_argument("--sentence-embeddings", action="store_true",
+                       help="Also embed every sentence, so /ask context compression can score them semantically")
     
     args = parser.parse_args()
     
-    if not os.path.exists(args.pdf):
-        print(f"Error: PDF file not found at {args.pdf}")
+    if not (args.pdf or args.pdf_dir or args.remove):
+        parser.error("nothing to do: pass --pdf, --pdf-dir or --remove")
+    
+    sources = {}
+    pdf_paths = list(args.pdf)
+    if args.pdf_dir:
+        if not os.path.isdir(args.pdf_dir):
+            print(f"Error: PDF directory not found at {args.pdf_dir}")
+            return 1
+        pdf_paths += sorted(str(path) for path in Path(args.pdf_dir).iterdir() if path.suffix.lower() == ".pdf")
+    for pdf_path in pdf_paths:
+        if not os.path.exists(pdf_path):
+            print(f"Error: PDF file not found at {pdf_path}")
+            return 1
+        doc_id = document_id(pdf_path)
+        if doc_id in sources and os.path.abspath(sources[doc_id]) != os.path.abspath(pdf_path):
+            print(f"Error: {sources[doc_id]} and {pdf_path} map to the same document id '{doc_id}'")
+            return 1
+        sources[doc_id] = pdf_path
+    
+    corpus = Corpus(args.output_dir)
+    
+    removed = set(args.remove)
+    if args.pdf_dir:
+        removed |= set(corpus.documents) - set(sources)
+    removed = sorted(doc_id for doc_id in removed - set(sources) if doc_id in corpus.documents)
+    for doc_id in removed:
+        print(f"Removing document: {doc_id}")
+        corpus.remove(doc_id)
+    
+    hashes = {doc_id: file_sha256(pdf_path) for doc_id, pdf_path in sources.items()}
+    changed = sorted(doc_id for doc_id in sources if not corpus.is_current(doc_id, hashes[doc_id]))
+    print(f"Corpus: {len(sources)} PDFs given, {len(changed)} new or changed, "
+          f"{len(sources) - len(changed)} unchanged, {len(removed)} removed")
+    
+    ocr_options = {
+        "ocr_dpi": args.ocr_dpi,
+        "ocr_lang": args.ocr_lang,
+        "ocr_workers": args.ocr_workers,
+        "ocr_cache_dir": args.ocr_cache_dir or os.path.join(args.output_dir, "ocr_cache")
+    }
+    
+    # Pages stream through the chunker and finished chunks go straight to disk,
+    # so memory stays bounded however long each document is. Several PDFs are
+    # processed side by side, one per worker; a single PDF splits its pages instead
+    for doc_id in changed:
+        corpus.prepare(doc_id)
+    results = {}
+    if len(changed) == 1:
+        doc_id = changed[0]
+        print(f"Processing PDF: {sources[doc_id]}")
+        results[doc_id] = process_document(sources[doc_id], doc_id, str(corpus.chunks_path(doc_id)),
+                                           str(corpus.clauses_path(doc_id)), args.workers, ocr_options)
+    elif changed:
+        with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(changed)))) as executor:
+            futures = {
+                executor.submit(process_document, sources[doc_id], doc_id, str(corpus.chunks_path(doc_id)),
+                                str(corpus.clauses_path(doc_id)), 1, ocr_options): doc_id
+                for doc_id in changed
+            }
+            for future in as_completed(futures):
+                doc_id = futures[future]
+                results[doc_id] = future.result()
+                print(f"Processed PDF: {sources[doc_id]}")
+    
+    for doc_id, (page_count, chunk_count) in results.items():
+        print(f"{doc_id}: extracted text from {page_count} pages, created {chunk_count} chunks")
+        corpus.record(doc_id, sources[doc_id], hashes[doc_id], page_count, chunk_count)
+    
+    indexed_doc_ids = [doc_id for doc_id in corpus.doc_ids() if corpus.documents[doc_id]["chunk_count"]]
+    if not indexed_doc_ids:
+        print("Error: the corpus has no document text left to index")
         return 1
     
-    print(f"Processing PDF: {args.pdf}")
+    # Without a persistent store, a throwaway one still checkpoints progress so a
+    # failed run can resume; it is removed once ingestion succeeds
+    checkpoint_path = None
+    if args.no_embedding_store:
+        checkpoint_path = os.path.join(args.output_dir, "embedding_checkpoint.sqlite")
+        embedding_store = EmbeddingStore(checkpoint_path)
+    else:
+        embedding_store = EmbeddingStore(
+            args.embedding_store or os.path.join(args.output_dir, "embedding_store.sqlite")
+        )
+    
+    chunks = ChunkFile(os.path.join(args.output_dir, "chunks.jsonl"))
+    embedding_model = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+    manifest, reduction = inherit_index_config(args, args.output_dir, embedding_model)
+    projection = None
+    if reduction is not None and reduction["method"] == "pca":
+        with np.load(os.path.join(args.output_dir, "pca.npz")) as pca:
+            projection = {"mean": pca["mean"], "components": pca["components"]}
+    builder = IndexBuilder(
+        chunks, 
+        os.getenv("OPENAI_API_KEY"),
+        embedding_model,
+        index_type=args.index_type,
+        hnsw_m=args.hnsw_m,
+        ef_construction=args.ef_construction,
+        ivf_nlist=args.ivf_nlist,
+        ef_search=args.ef_search,
+        nprobe=args.nprobe,
+        quantization=args.quantization,
+        pq_m=args.pq_m,
+        dimensions=args.dimensions,
+        embedding_store=embedding_store,
+        embed_concurrency=args.embed_concurrency,
+        requests_per_minute=args.embed_rpm,
+        tokens_per_minute=args.embed_tpm,
+        max_batch_tokens=args.embed_batch_tokens,
+        spool_dir=args.output_dir,
+        dimension_reduction=reduction,
+        reduced_dimension=manifest.get("dimension") if reduction is not None else None,
+        projection=projection
+    )
     
-    processor = PDFProcessor(args.pdf)
-    pages_data = processor.extract_text_with_structure()
-    print(f"Extracted text from {len(pages_data)} pages")
+    # Only documents without stored vectors are embedded; the rest are reused as-is
+    corpus.use_embeddings(embedding_model, args.dimensions)
+    for doc_id in indexed_doc_ids:
+        embeddings_path = corpus.embeddings_path(doc_id)
+        if not embeddings_path.exists():
+            print(f"Generating embeddings for {doc_id}...")
+            partial_path = embeddings_path.with_name(embeddings_path.name + ".partial")
+            builder.embed_chunks(ChunkFile(corpus.chunks_path(doc_id)), partial_path)
+            os.replace(partial_path, embeddings_path)
     
-    chunker = TextChunker()
-    chunks = chunker.chunk_pages(pages_data)
-    print(f"Created {len(chunks)} chunks")
+    print(f"Created {corpus.assemble_chunks(chunks)} chunks from {len(corpus.documents)} documents")
+    builder.assemble_embeddings([corpus.embeddings_path(doc_id) for doc_id in indexed_doc_ids])
     
     token_counts = [chunk["token_count"] for chunk in chunks]
     print(f"Chunk token statistics:")
@@ -43,15 +274,17 @@ def main():
     print(f"  Max: {max(token_counts)}")
     print(f"  Avg: {sum(token_counts) / len(token_counts):.1f}")
     
-    builder = IndexBuilder(
-        chunks, 
-        os.getenv("OPENAI_API_KEY"),
-        os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
-    )
-    
     builder.build_bm25_index()
     builder.build_faiss_index()
     builder.save_indexes(args.output_dir)
+    builder.build_sentence_index(args.output_dir, embed=args.sentence_embeddings)
+    clause_count = corpus.assemble_clauses(os.path.join(args.output_dir, CLAUSE_INDEX_FILENAME))
+    print(f"Indexed {clause_count} numbered clauses")
+    corpus.save()
+    
+    embedding_store.close()
+    if checkpoint_path:
+        os.remove(checkpoint_path)
     
     print("Ingestion completed successfully!")
     return 0
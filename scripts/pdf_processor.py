@@ -1,83 +1,211 @@
 import re
-from typing import List, Dict, Optional
+import hashlib
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Iterator, Optional
 import fitz
 import pytesseract
 from PIL import Image
 import io
 
 
+# Pages with less extracted text than this are treated as scanned images
+OCR_TEXT_THRESHOLD = 50
+TESSERACT_CONFIG = "--psm 6"
+
+
+def _ocr_cache_key(doc, page, dpi: int, lang: str) -> str:
+    """Hash of what OCR would see: the page's content streams and embedded images."""
+    digest = hashlib.sha256(f"{dpi}|{lang}|{TESSERACT_CONFIG}".encode())
+    try:
+        digest.update(page.read_contents())
+        for image in page.get_images(full=True):
+            digest.update(doc.xref_stream_raw(image[0]) or b"")
+    except Exception:
+        # Fall back to the rendered pixels if the streams can't be read
+        digest.update(page.get_pixmap(dpi=dpi).samples)
+    return digest.hexdigest()
+
+
+def _ocr_page(pdf_path: str, page_num: int, dpi: int, lang: str, cache_dir: Optional[str]) -> Optional[str]:
+    """Process-pool worker: OCR one page, reusing a cached result when the page is unchanged."""
+    try:
+        with fitz.open(pdf_path) as doc:
+            page = doc[page_num]
+            
+            cache_path = None
+            if cache_dir:
+                cache_path = Path(cache_dir) / f"{_ocr_cache_key(doc, page, dpi, lang)}.txt"
+                if cache_path.exists():
+                    text = cache_path.read_text(encoding="utf-8")
+                    return text or None
+            
+            # Get page as image
+            pix = page.get_pixmap(dpi=dpi)
+            img = Image.open(io.BytesIO(pix.tobytes("png")))
+            
+            # Apply OCR
+            text = pytesseract.image_to_string(img, lang=lang, config=TESSERACT_CONFIG).strip()
+            
+            if cache_path:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                cache_path.write_text(text, encoding="utf-8")
+            return text or None
+    except Exception as e:
+        print(f"OCR failed on page {page_num + 1}: {e}")
+        return None
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> List[Dict]:
+    """Process-pool worker: open a private document handle and extract pages [start, end)."""
+    processor = PDFProcessor(pdf_path)
+    try:
+        return [processor.extract_page(page_num) for page_num in range(start, end)]
+    finally:
+        processor.close()
+
+
 class PDFProcessor:
-    def __init__(self, pdf_path: str):
+    # Several ranges per worker so uneven pages (tables, OCR) balance out
+    RANGES_PER_WORKER = 4
+    # Caps the pages a finished range holds in memory before it is consumed
+    MAX_PAGES_PER_RANGE = 16
+    OCR_WINDOW_PER_WORKER = 4
+    
+    def __init__(self, pdf_path: str, ocr_dpi: int = 144, ocr_lang: str = "eng",
+                 ocr_workers: int = 2, ocr_cache_dir: Optional[str] = None):
         self.pdf_path = pdf_path
         self.doc = fitz.open(pdf_path)
+        self.ocr_dpi = ocr_dpi
+        self.ocr_lang = ocr_lang
+        self.ocr_workers = ocr_workers
+        self.ocr_cache_dir = ocr_cache_dir
     
-    def extract_text_with_structure(self) -> List[Dict]:
-        pages_data = []
+    def close(self):
+        self.doc.close()
+    
+    def extract_text_with_structure(self, workers: int = 1) -> List[Dict]:
+        return list(self.iter_pages(workers))
+    
+    def iter_pages(self, workers: int = 1) -> Iterator[Dict]:
+        """
+        Yield every page in document order. Image-only pages are OCR'd in a separate
+        bounded process pool while later pages are still being extracted; at most
+        OCR_WINDOW_PER_WORKER pages per OCR worker are held back waiting for text.
+        """
+        pending = deque()
+        window = max(1, self.ocr_workers) * self.OCR_WINDOW_PER_WORKER
         
-        for page_num in range(len(self.doc)):
-            page = self.doc[page_num]
-            blocks = page.get_text("dict")["blocks"]
+        with ProcessPoolExecutor(max_workers=max(1, self.ocr_workers)) as ocr_executor:
+            for page_content in self._iter_pages(workers):
+                ocr_future = None
+                if self._needs_ocr(page_content):
+                    print(f"Page {page_content['page_num']} has minimal text, applying OCR...")
+                    ocr_future = ocr_executor.submit(
+                        _ocr_page, self.pdf_path, page_content["page_num"] - 1,
+                        self.ocr_dpi, self.ocr_lang, self.ocr_cache_dir
+                    )
+                pending.append((page_content, ocr_future))
+                
+                while pending and (len(pending) > window or pending[0][1] is None or pending[0][1].done()):
+                    yield self._finish_page(*pending.popleft())
             
-            page_content = {
-                "page_num": page_num + 1,
-                "text_blocks": [],
-                "headings": [],
-                "tables": []
-            }
+            while pending:
+                yield self._finish_page(*pending.popleft())
+    
+    def _iter_pages(self, workers: int) -> Iterator[Dict]:
+        page_count = len(self.doc)
+        if workers <= 1 or page_count < 2:
+            for page_num in range(page_count):
+                yield self.extract_page(page_num)
+            return
+        
+        range_size = max(1, min(self.MAX_PAGES_PER_RANGE,
+                                -(-page_count // (workers * self.RANGES_PER_WORKER))))
+        in_flight = deque()
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Only a couple of ranges per worker are submitted ahead of the consumer,
+            # and they are drained in submission order, so pages stay in document order
+            for start in range(0, page_count, range_size):
+                in_flight.append(executor.submit(
+                    _extract_page_range, self.pdf_path, start, min(start + range_size, page_count)
+                ))
+                if len(in_flight) >= workers * 2:
+                    yield from in_flight.popleft().result()
             
-            # Extract text normally first
-            text_extracted = False
-            for block in blocks:
-                if "lines" in block:
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            text = span["text"].strip()
-                            if text:
-                                text_extracted = True
-                                font_size = span["size"]
-                                font_flags = span["flags"]
-                                
-                                is_heading = self._is_heading(font_size, font_flags, text)
-                                is_table = self._is_table_content(text, block)
-                                
-                                if is_heading:
-                                    heading_level = self._determine_heading_level(font_size, font_flags)
-                                    page_content["headings"].append({
-                                        "text": text,
-                                        "level": heading_level,
-                                        "font_size": font_size
-                                    })
-                                
-                                page_content["text_blocks"].append({
+            while in_flight:
+                yield from in_flight.popleft().result()
+    
+    @staticmethod
+    def _needs_ocr(page_content: Dict) -> bool:
+        total_text = " ".join([block["text"] for block in page_content["text_blocks"]])
+        return len(total_text.strip()) < OCR_TEXT_THRESHOLD
+    
+    @staticmethod
+    def _finish_page(page_content: Dict, ocr_future: Optional[Future]) -> Dict:
+        ocr_content = ocr_future.result() if ocr_future is not None else None
+        if ocr_content:
+            page_content["text_blocks"].append({
+                "text": ocr_content,
+                "font_size": 12.0,  # Default size for OCR text
+                "is_heading": False,
+                "is_table": False,
+                "font_flags": 0,
+                "source": "ocr"
+            })
+        return page_content
+    
+    def extract_page(self, page_num: int) -> Dict:
+        page = self.doc[page_num]
+        blocks = page.get_text("dict")["blocks"]
+        
+        page_content = {
+            "page_num": page_num + 1,
+            "text_blocks": [],
+            "headings": [],
+            "tables": []
+        }
+        
+        # Extract text normally first
+        text_extracted = False
+        for block in blocks:
+            if "lines" in block:
+                for line in block["lines"]:
+                    for span in line["spans"]:
+                        text = span["text"].strip()
+                        if text:
+                            text_extracted = True
+                            font_size = span["size"]
+                            font_flags = span["flags"]
+                            
+                            is_heading = self._is_heading(font_size, font_flags, text)
+                            is_table = self._is_table_content(text, block)
+                            
+                            if is_heading:
+                                heading_level = self._determine_heading_level(font_size, font_flags)
+                                page_content["headings"].append({
                                     "text": text,
-                                    "font_size": font_size,
-                                    "is_heading": is_heading,
-                                    "is_table": is_table,
-                                    "font_flags": font_flags
+                                    "level": heading_level,
+                                    "font_size": font_size
                                 })
-            
-            # Check if page has near-zero text, apply OCR if needed
-            total_text = " ".join([block["text"] for block in page_content["text_blocks"]])
-            if len(total_text.strip()) < 50:  # Near-zero text threshold
-                print(f"Page {page_num + 1} has minimal text, applying OCR...")
-                ocr_content = self._apply_ocr(page)
-                if ocr_content:
-                    page_content["text_blocks"].append({
-                        "text": ocr_content,
-                        "font_size": 12.0,  # Default size for OCR text
-                        "is_heading": False,
-                        "is_table": False,
-                        "font_flags": 0,
-                        "source": "ocr"
-                    })
-            
-            # Extract tables separately
-            tables = self._extract_tables(page)
-            page_content["tables"] = tables
-            
-            pages_data.append(page_content)
+                            
+                            page_content["text_blocks"].append({
+                                "text": text,
+                                "font_size": font_size,
+                                "is_heading": is_heading,
+                                "is_table": is_table,
+                                "font_flags": font_flags
+                            })
         
-        return pages_data
+        # Near-zero text pages are OCR'd separately, see extract_text_with_structure
+        
+        # Extract tables separately
+        tables = self._extract_tables(page)
+        page_content["tables"] = tables
+        
+        return page_content
     
     def _is_heading(self, font_size: float, font_flags: int, text: str) -> bool:
         is_bold = bool(font_flags & 16)
@@ -110,24 +238,6 @@ class PDFProcessor:
         else:
             return 3
     
-    def _apply_ocr(self, page) -> Optional[str]:
-        """Apply OCR to a page using pytesseract."""
-        try:
-            # Get page as image
-            mat = fitz.Matrix(2.0, 2.0)  # 2x zoom for better OCR
-            pix = page.get_pixmap(matrix=mat)
-            img_data = pix.tobytes("png")
-            
-            # Convert to PIL Image
-            img = Image.open(io.BytesIO(img_data))
-            
-            # Apply OCR
-            text = pytesseract.image_to_string(img, config='--psm 6')
-            return text.strip() if text.strip() else None
-        except Exception as e:
-            print(f"OCR failed: {e}")
-            return None
-    
     def _is_table_content(self, text: str, block: Dict) -> bool:
         """Detect if text block is part of a table."""
         # Look for table indicators
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Embedding dimension reduction script for ETI RAG system.
+Shrinks the stored embeddings with Matryoshka truncation or a fitted PCA,
+without re-embedding, rebuilds the FAISS index and records the reduction
+and its measured recall impact in the index manifest.
+"""
+
+import os
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+import faiss
+from dotenv import load_dotenv
+
+from index_builder import create_faiss_index, default_pq_m, MANIFEST_FILENAME
+from tune_index import sample_queries, recall_at_k
+
+load_dotenv()
+
+
+def fit_pca(embeddings: np.ndarray, dims: int):
+    mean = embeddings.mean(axis=0)
+    # Rows of vt are principal directions, strongest first
+    _, _, vt = np.linalg.svd(embeddings - mean, full_matrices=False)
+    return mean.astype(np.float32), np.ascontiguousarray(vt[:dims], dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reduce stored embedding dimensions and rebuild the index")
+    parser.add_argument("--index-dir", default=os.getenv("INDEX_DIR", "/var/data/index"),
+                       help="Directory holding embeddings.npy and the index manifest")
+    parser.add_argument("--dims", type=int, required=True, help="Target dimension")
+    parser.add_argument("--method", choices=("truncate", "pca"), default="truncate",
+                       help="truncate: Matryoshka prefix (text-embedding-3); pca: fitted projection")
+    parser.add_argument("--k", type=int, default=30, help="Neighbours per query for the recall check")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries")
+    parser.add_argument("--noise", type=float, default=0.05, help="Gaussian noise added to sampled queries")
+
+    args = parser.parse_args()
+    index_path = Path(args.index_dir)
+
+    manifest_path = index_path / MANIFEST_FILENAME
+    if not manifest_path.exists():
+        print(f"Error: index manifest not found in {index_path}; re-run ingestion first")
+        return 1
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    # Always reduce from the full-size vectors, so reductions can be redone
+    full_path = index_path / "embeddings_full.npy"
+    if not full_path.exists():
+        os.replace(index_path / "embeddings.npy", full_path)
+        previous = manifest.get("dimension_reduction") or {}
+        manifest["source_embedding_dimensions"] = manifest.get("embedding_dimensions") \
+            if previous.get("method") == "api" else None
+    full = np.array(np.load(full_path, mmap_mode="r"), dtype=np.float32)
+    faiss.normalize_L2(full)
+
+    if args.dims >= full.shape[1]:
+        print(f"Error: --dims must be below the stored dimension ({full.shape[1]})")
+        return 1
+
+    if args.method == "truncate":
+        reduced = np.ascontiguousarray(full[:, :args.dims])
+        (index_path / "pca.npz").unlink(missing_ok=True)
+    else:
+        mean, components = fit_pca(full, args.dims)
+        reduced = (full - mean) @ components.T
+        np.savez(index_path / "pca.npz", mean=mean, components=components)
+    reduced = np.ascontiguousarray(reduced, dtype=np.float32)
+    faiss.normalize_L2(reduced)
+
+    # Recall of exact search in the reduced space against exact search at full size
+    k = min(args.k, len(full))
+    queries = sample_queries(full, args.queries, args.noise, seed=0)
+    _, truth = create_faiss_index(full, "flat_ip").search(queries, k)
+    if args.method == "truncate":
+        reduced_queries = np.ascontiguousarray(queries[:, :args.dims])
+    else:
+        reduced_queries = np.ascontiguousarray((queries - mean) @ components.T, dtype=np.float32)
+    faiss.normalize_L2(reduced_queries)
+    _, found = create_faiss_index(reduced, "flat_ip").search(reduced_queries, k)
+    recall = recall_at_k(found, truth)
+
+    build_params = manifest.get("build_params", {})
+    if manifest.get("index_type") == "ivf":
+        # List count depends only on corpus size, but retrain at the new dimension
+        build_params = {"ivf_nlist": build_params.get("ivf_nlist")}
+    index = create_faiss_index(
+        reduced, manifest.get("index_type", "flat_ip"), **build_params,
+        quantization=manifest.get("quantization", "none"), pq_m=default_pq_m(args.dims)
+    )
+    faiss.write_index(index, str(index_path / "faiss.index"))
+    faiss.write_index(index, str(index_path / "faiss_index.index"))
+    np.save(index_path / "embeddings.npy", reduced)
+
+    source_dimensions = manifest.get("source_embedding_dimensions")
+    manifest.update({
+        "dimension": args.dims,
+        # Truncation is what the API's dimensions parameter does, so queries ask for it directly
+        "embedding_dimensions": args.dims if args.method == "truncate" else source_dimensions,
+        "dimension_reduction": {
+            "method": args.method,
+            "source_dimensions": source_dimensions,
+            "full_dimension": int(full.shape[1]),
+            "k": k,
+            "recall": round(recall, 4)
+        },
+        "pq_m": default_pq_m(args.dims) if manifest.get("quantization") == "pq" else None
+    })
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"Reduced {full.shape[1]} -> {args.dims} dims ({args.method}): "
+          f"{full.shape[1] / args.dims:.1f}x smaller vectors, exact recall@{k} = {recall:.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -1,17 +1,45 @@
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
 import tiktoken
+import regex
 import re
 
 
+# Last pre-token of a text ending in punctuation (cl100k: " ?[^\s\p{L}\p{N}]+[\r\n]*"),
+# the only kind that absorbs following newlines
+TRAILING_PUNCTUATION = regex.compile(r" ?[^\s\p{L}\p{N}]+\Z")
+# A leading letter or digit run ends on the same pre-token boundary whatever whitespace precedes it
+LEADING_WORD = regex.compile(r"\p{L}+|\p{N}+")
+
+
 class TextChunker:
-    def __init__(self, min_tokens: int = 400, max_tokens: int = 1200, overlap_tokens: int = 100):
+    # Orphan merging runs this many passes; a pass that merges nothing leaves later passes with nothing to do
+    MERGE_PASSES = 3
+    
+    def __init__(self, min_tokens: int = 400, max_tokens: int = 1200, overlap_tokens: int = 100,
+                 doc_id: str = "eti-hr-2023"):
+        self.doc_id = doc_id
         self.min_tokens = min_tokens
         self.max_tokens = max_tokens
         self.overlap_tokens = overlap_tokens
         self.tokenizer = tiktoken.get_encoding("cl100k_base")
     
     def chunk_pages(self, pages_data: List[Dict]) -> List[Dict]:
-        chunks = []
+        return list(self.iter_chunks(pages_data))
+    
+    def iter_chunks(self, pages: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        Chunk a stream of pages. Only the chunk being built and a one-chunk
+        lookahead per merge pass are held in memory.
+        """
+        chunks = self._iter_raw_chunks(pages)
+        
+        # Merge short orphan chunks into neighbors
+        for _ in range(self.MERGE_PASSES):
+            chunks = self._merge_pass(chunks)
+        
+        return chunks
+    
+    def _iter_raw_chunks(self, pages: Iterable[Dict]) -> Iterator[Dict]:
         current_chunk_text = ""
         current_chunk_tokens = 0
         current_headings = []
@@ -20,24 +48,25 @@ class TextChunker:
         current_page = 1
         chunk_id = 0
         
-        for page_data in pages_data:
+        for page_data in pages:
             page_num = page_data["page_num"]
             current_page = page_num
             
+            # Each table is tokenized once and its count reused below
+            tables = page_data.get("tables", [])
+            table_token_counts = [len(self.tokenizer.encode(table["markdown"])) for table in tables]
+            
             # Process tables - only create separate chunks for LARGE tables (>= min_tokens)
-            for table in page_data.get("tables", []):
-                table_tokens = len(self.tokenizer.encode(table["markdown"]))
-                
+            for table, table_tokens in zip(tables, table_token_counts):
                 # Only create separate chunk for large tables that meet minimum token requirement
                 if table["row_count"] > 5 and table_tokens >= self.min_tokens:
                     if current_chunk_text.strip():
                         # Finalize current text chunk before table
                         final_headings = chunk_headings if chunk_headings else current_headings
-                        chunk = self._create_chunk(
+                        yield self._create_chunk(
                             chunk_id, current_chunk_text.strip(), 
                             final_headings, start_page, page_num
                         )
-                        chunks.append(chunk)
                         chunk_id += 1
                         current_chunk_text = ""
                         current_chunk_tokens = 0
@@ -45,10 +74,10 @@ class TextChunker:
                     # Create table chunk
                     table_chunk = self._create_chunk(
                         chunk_id, table["markdown"],
-                        current_headings, page_num, page_num
+                        current_headings, page_num, page_num, token_count=table_tokens
                     )
                     table_chunk["is_table"] = True
-                    chunks.append(table_chunk)
+                    yield table_chunk
                     chunk_id += 1
                     start_page = page_num
             
@@ -63,8 +92,7 @@ class TextChunker:
             page_text = ""
             
             # Add small tables that weren't processed as separate chunks
-            for table in page_data.get("tables", []):
-                table_tokens = len(self.tokenizer.encode(table["markdown"]))
+            for table, table_tokens in zip(tables, table_token_counts):
                 if not (table["row_count"] > 5 and table_tokens >= self.min_tokens):
                     page_text += table["markdown"] + "\n\n"
             
@@ -79,16 +107,24 @@ class TextChunker:
             if (current_chunk_tokens + page_tokens > self.max_tokens or hard_break_needed) and current_chunk_text:
                 # Use the most relevant headings for this chunk
                 final_headings = chunk_headings if chunk_headings else old_headings
-                chunk = self._create_chunk(
+                
+                # The finished chunk is tokenized once, for both its count and the overlap
+                chunk_tokens, token_count = None, None
+                if not hard_break_needed:
+                    chunk_tokens, token_count = self._encode_chunk_text(current_chunk_text)
+                yield self._create_chunk(
                     chunk_id, current_chunk_text.strip(), 
-                    final_headings, start_page, current_page - 1
+                    final_headings, start_page, current_page - 1, token_count=token_count
                 )
-                chunks.append(chunk)
                 chunk_id += 1
                 
-                overlap_text = self._get_overlap_text(current_chunk_text) if not hard_break_needed else ""
+                overlap_text = self._get_overlap_text(current_chunk_text, chunk_tokens) if not hard_break_needed else ""
+                seam_tokens = self._seam_token_count(overlap_text, page_text)
                 current_chunk_text = overlap_text + page_text
-                current_chunk_tokens = len(self.tokenizer.encode(current_chunk_text))
+                if seam_tokens is not None:
+                    current_chunk_tokens = seam_tokens + page_tokens
+                else:
+                    current_chunk_tokens = len(self.tokenizer.encode(current_chunk_text))
                 start_page = page_num
                 chunk_headings = current_headings.copy()  # New chunk gets current headings
             else:
@@ -103,16 +139,10 @@ class TextChunker:
         
         if current_chunk_text.strip():
             final_headings = chunk_headings if chunk_headings else current_headings
-            chunk = self._create_chunk(
+            yield self._create_chunk(
                 chunk_id, current_chunk_text.strip(), 
                 final_headings, start_page, current_page
             )
-            chunks.append(chunk)
-        
-        # Merge short orphan chunks into neighbors
-        chunks = self._merge_orphan_chunks(chunks)
-        
-        return chunks
     
     def _update_headings(self, page_headings: List[Dict], current_headings: List[str]):
         for heading in page_headings:
@@ -151,8 +181,50 @@ class TextChunker:
             while current_headings and not current_headings[-1]:
                 current_headings.pop()
     
-    def _get_overlap_text(self, text: str) -> str:
+    def _encode_chunk_text(self, text: str) -> Tuple[List[int], int]:
+        """
+        Tokens of a chunk's raw text, and the token count of its stripped form.
+        Page text ends in a single space, which cl100k always encodes as its own
+        trailing token, and leading overlap whitespace only changes the first
+        word's tokens, so the stripped count usually follows without re-encoding.
+        """
         tokens = self.tokenizer.encode(text)
+        stripped = text.strip()
+        if not stripped:
+            return tokens, 0
+        
+        token_count = len(tokens)
+        lead_end = text.index(stripped)
+        trailing = text[lead_end + len(stripped):]
+        if trailing == " ":
+            token_count -= 1
+        elif trailing:
+            return tokens, len(self.tokenizer.encode(stripped))
+        
+        if lead_end:
+            seam_tokens = self._seam_token_count(text[:lead_end], stripped)
+            if seam_tokens is None:
+                return tokens, len(self.tokenizer.encode(stripped))
+            token_count -= seam_tokens
+        
+        return tokens, token_count
+    
+    def _seam_token_count(self, left: str, right: str) -> Optional[int]:
+        """
+        Tokens that left adds in front of right: count(left + right) - count(right).
+        When left ends in whitespace and right starts with a word, pre-tokens only
+        differ up to the end of that word, so just left + word is encoded. Returns
+        None when the shortcut does not apply.
+        """
+        word = LEADING_WORD.match(right)
+        if not word or (left and not left[-1].isspace()):
+            return None
+        word = word.group()
+        return len(self.tokenizer.encode(left + word)) - len(self.tokenizer.encode(word))
+    
+    def _get_overlap_text(self, text: str, tokens: Optional[List[int]] = None) -> str:
+        if tokens is None:
+            tokens = self.tokenizer.encode(text)
         if len(tokens) <= self.overlap_tokens:
             return text + " "
         
@@ -190,111 +262,82 @@ class TextChunker:
         
         return False
     
-    def _merge_orphan_chunks(self, chunks: List[Dict]) -> List[Dict]:
-        """Aggressively merge short orphan chunks to ensure 400+ token minimum."""
-        if len(chunks) <= 1:
-            return chunks
+    def _merge_pass(self, chunks: Iterator[Dict]) -> Iterator[Dict]:
+        """
+        Perform a single pass of merging small chunks. The last emitted chunk is
+        held back, since the chunk after it may still merge backwards into it.
+        """
+        previous = None
+        current = next(chunks, None)
         
-        # Multiple passes to ensure thorough merging
-        merged_chunks = chunks[:]
-        max_passes = 3
-        
-        for pass_num in range(max_passes):
-            previous_count = len(merged_chunks)
-            merged_chunks = self._single_merge_pass(merged_chunks)
-            
-            # If no changes in this pass, we're done
-            if len(merged_chunks) == previous_count:
-                break
-        
-        return merged_chunks
-    
-    def _single_merge_pass(self, chunks: List[Dict]) -> List[Dict]:
-        """Perform a single pass of merging small chunks."""
-        if len(chunks) <= 1:
-            return chunks
-            
-        merged_chunks = []
-        i = 0
-        
-        while i < len(chunks):
-            current_chunk = chunks[i]
-            current_tokens = current_chunk["token_count"]
+        while current is not None:
+            following = next(chunks, None)
+            current_tokens = current["token_count"]
+            output = current
             
             # If chunk is below minimum threshold
             if current_tokens < self.min_tokens:
-                merged = False
-                
                 # Try to merge with next chunk first
-                if (i + 1 < len(chunks) and 
-                    current_tokens + chunks[i + 1]["token_count"] <= self.max_tokens):
-                    
-                    next_chunk = chunks[i + 1]
-                    merged_text = current_chunk["text"] + "\n\n" + next_chunk["text"]
-                    merged_headings = current_chunk["headings_path"] if current_chunk["headings_path"] else next_chunk["headings_path"]
-                    
-                    merged_chunk = self._create_merged_chunk(
-                        current_chunk, next_chunk, merged_text, merged_headings
-                    )
-                    
-                    merged_chunks.append(merged_chunk)
-                    i += 2  # Skip next chunk as it's been merged
-                    merged = True
+                if following is not None and current_tokens + following["token_count"] <= self.max_tokens:
+                    output = self._merge_pair(current, following)
+                    following = next(chunks, None)  # Next chunk has been merged
                 
                 # Try to merge with previous chunk if forward merge didn't work
-                elif (merged_chunks and 
-                      current_tokens + merged_chunks[-1]["token_count"] <= self.max_tokens):
-                    
-                    prev_chunk = merged_chunks.pop()
-                    merged_text = prev_chunk["text"] + "\n\n" + current_chunk["text"]
-                    merged_headings = prev_chunk["headings_path"] if prev_chunk["headings_path"] else current_chunk["headings_path"]
-                    
-                    merged_chunk = self._create_merged_chunk(
-                        prev_chunk, current_chunk, merged_text, merged_headings
-                    )
-                    
-                    merged_chunks.append(merged_chunk)
-                    i += 1
-                    merged = True
+                elif previous is not None and current_tokens + previous["token_count"] <= self.max_tokens:
+                    previous = self._merge_pair(previous, current)
+                    current = following
+                    continue
                 
-                # If still couldn't merge and chunk is very small, try with larger neighbor
-                elif current_tokens < 200:  # Very small chunks
-                    # Try merging with next chunk even if it goes slightly over max
-                    if (i + 1 < len(chunks) and 
-                        current_tokens + chunks[i + 1]["token_count"] <= self.max_tokens * 1.1):
-                        
-                        next_chunk = chunks[i + 1]
-                        merged_text = current_chunk["text"] + "\n\n" + next_chunk["text"]
-                        merged_headings = current_chunk["headings_path"] if current_chunk["headings_path"] else next_chunk["headings_path"]
-                        
-                        merged_chunk = self._create_merged_chunk(
-                            current_chunk, next_chunk, merged_text, merged_headings
-                        )
-                        
-                        merged_chunks.append(merged_chunk)
-                        i += 2
-                        merged = True
+                # If still couldn't merge and chunk is very small, try merging with
+                # next chunk even if it goes slightly over max
+                elif (current_tokens < 200 and following is not None and
+                      current_tokens + following["token_count"] <= self.max_tokens * 1.1):
+                    output = self._merge_pair(current, following)
+                    following = next(chunks, None)
                 
-                if not merged:
-                    # Keep the chunk even if it's small (last resort)
-                    merged_chunks.append(current_chunk)
-                    i += 1
-            else:
-                # Chunk meets minimum, keep it
-                merged_chunks.append(current_chunk)
-                i += 1
+                # Otherwise keep the chunk even if it's small (last resort)
+            
+            if previous is not None:
+                yield previous
+            previous = output
+            current = following
+        
+        if previous is not None:
+            yield previous
+    
+    def _merge_pair(self, chunk1: Dict, chunk2: Dict) -> Dict:
+        merged_text = chunk1["text"] + "\n\n" + chunk2["text"]
+        merged_headings = chunk1["headings_path"] if chunk1["headings_path"] else chunk2["headings_path"]
+        return self._create_merged_chunk(
+            chunk1, chunk2, merged_text, merged_headings,
+            token_count=self._merged_token_count(chunk1, chunk2, merged_text)
+        )
+    
+    def _merged_token_count(self, chunk1: Dict, chunk2: Dict, merged_text: str) -> int:
+        """
+        Token count of chunk1 + "\n\n" + chunk2 from the parts' counts. Pre-tokens
+        never span the join except a trailing punctuation run, which takes the
+        newlines with it, so only that short tail is re-encoded.
+        """
+        text1, text2 = chunk1["text"], chunk2["text"]
+        if not text1 or not text2 or text1[-1].isspace() or text2[0].isspace():
+            return len(self.tokenizer.encode(merged_text))
         
-        return merged_chunks
+        tail_match = TRAILING_PUNCTUATION.search(text1)
+        tail = tail_match.group() if tail_match else ""
+        join_tokens = len(self.tokenizer.encode(tail + "\n\n")) - len(self.tokenizer.encode(tail))
+        return chunk1["token_count"] + join_tokens + chunk2["token_count"]
     
-    def _create_merged_chunk(self, chunk1: Dict, chunk2: Dict, merged_text: str, merged_headings: List[str]) -> Dict:
+    def _create_merged_chunk(self, chunk1: Dict, chunk2: Dict, merged_text: str, merged_headings: List[str],
+                             token_count: Optional[int] = None) -> Dict:
         """Helper to create a merged chunk with proper metadata."""
         return {
-            "doc_id": "eti-hr-2023",
+            "doc_id": chunk1["doc_id"],
             "chunk_index": chunk1["chunk_index"],
             "pages": [chunk1["pages"][0], chunk2["pages"][1]],
             "headings_path": merged_headings,
             "text": merged_text,
-            "token_count": len(self.tokenizer.encode(merged_text)),
+            "token_count": token_count if token_count is not None else len(self.tokenizer.encode(merged_text)),
             # Legacy fields
             "chunk_id": chunk1["chunk_id"],
             "heading_path": " → ".join(merged_headings) if merged_headings else "General",
@@ -305,17 +348,17 @@ class TextChunker:
         }
     
     def _create_chunk(self, chunk_id: int, text: str, headings: List[str], 
-                     start_page: int, end_page: int) -> Dict:
+                     start_page: int, end_page: int, token_count: Optional[int] = None) -> Dict:
         clean_headings = [h for h in headings[:3] if h.strip()]
         
         # Brief specifies this exact metadata structure
         return {
-            "doc_id": "eti-hr-2023",
+            "doc_id": self.doc_id,
             "chunk_index": chunk_id,
             "pages": [start_page, end_page],
             "headings_path": clean_headings,
             "text": text,
-            "token_count": len(self.tokenizer.encode(text)),
+            "token_count": token_count if token_count is not None else len(self.tokenizer.encode(text)),
             # Legacy fields for backward compatibility
             "chunk_id": f"chunk_{chunk_id:04d}",
             "heading_path": " → ".join(clean_headings) if clean_headings else "General",
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+FAISS parameter tuning script for ETI RAG system.
+Sweeps index types and parameters over the stored embeddings, measures
+recall@k against exact search and per-query latency, and writes the
+fastest configuration that meets the target recall into the index manifest.
+"""
+
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+from typing import List, Dict
+
+import numpy as np
+import faiss
+from dotenv import load_dotenv
+
+from index_builder import create_faiss_index, apply_search_params, default_ivf_nlist, MANIFEST_FILENAME
+
+load_dotenv()
+
+
+def sample_queries(embeddings: np.ndarray, num_queries: int, noise: float, seed: int) -> np.ndarray:
+    """Perturbed copies of stored vectors stand in for real query embeddings."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(embeddings), size=min(num_queries, len(embeddings)), replace=False)
+    queries = np.array(embeddings[rows], dtype=np.float32)
+    queries += rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def measure(index: faiss.Index, queries: np.ndarray, truth: np.ndarray, k: int,
+            embeddings: np.ndarray, rescore_factor: int = 0) -> Dict:
+    """
+    Search one query at a time, as the API does, and report recall and latency.
+    With a rescore factor the timing includes the exact float rescoring pass.
+    """
+    found = np.full((len(queries), k), -1, dtype=np.int64)
+    latencies = []
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        if rescore_factor:
+            _, indices = index.search(queries[i:i + 1], k * rescore_factor)
+            candidates = indices[0][indices[0] >= 0]
+            sims = embeddings[candidates] @ queries[i]
+            ids = candidates[np.argsort(-sims)[:k]]
+        else:
+            _, indices = index.search(queries[i:i + 1], k)
+            ids = indices[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        found[i, :len(ids)] = ids
+
+    return {
+        "recall": recall_at_k(found, truth),
+        "latency_ms": float(np.median(latencies)),
+        "p95_latency_ms": float(np.percentile(latencies, 95))
+    }
+
+
+def sweep(embeddings: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int,
+          index_types: List[str], quantization: Dict) -> List[Dict]:
+    results = []
+    num_vectors = len(embeddings)
+    rescore_factor = quantization.pop("rescore_factor", 0)
+
+    def run(index):
+        return measure(index, queries, truth, k, embeddings, rescore_factor)
+
+    if "flat_ip" in index_types:
+        index = create_faiss_index(embeddings, "flat_ip", **quantization)
+        results.append({"index_type": "flat_ip", "build_params": {}, "search_params": {}, **run(index)})
+
+    if "hnsw" in index_types:
+        for hnsw_m in (16, 32, 48):
+            for ef_construction in (100, 200):
+                index = create_faiss_index(embeddings, "hnsw", hnsw_m=hnsw_m,
+                                           ef_construction=ef_construction, **quantization)
+                for ef_search in (16, 32, 64, 128, 256):
+                    apply_search_params(index, ef_search=max(ef_search, k))
+                    results.append({
+                        "index_type": "hnsw",
+                        "build_params": {"hnsw_m": hnsw_m, "ef_construction": ef_construction},
+                        "search_params": {"ef_search": max(ef_search, k)},
+                        **run(index)
+                    })
+
+    if "ivf" in index_types:
+        base_nlist = default_ivf_nlist(num_vectors)
+        for nlist in sorted({max(1, base_nlist // 4), max(1, base_nlist // 2), base_nlist}):
+            index = create_faiss_index(embeddings, "ivf", ivf_nlist=nlist, **quantization)
+            for nprobe in (1, 2, 4, 8, 16, 32, 64):
+                if nprobe > nlist:
+                    break
+                apply_search_params(index, nprobe=nprobe)
+                results.append({
+                    "index_type": "ivf",
+                    "build_params": {"ivf_nlist": nlist},
+                    "search_params": {"nprobe": nprobe},
+                    **run(index)
+                })
+
+    return results
+
+
+def pareto_front(results: List[Dict]) -> List[Dict]:
+    """Configurations not beaten on both recall and latency, fastest first."""
+    front = []
+    best_recall = -1.0
+    for result in sorted(results, key=lambda r: (r["latency_ms"], -r["recall"])):
+        if result["recall"] > best_recall:
+            front.append(result)
+            best_recall = result["recall"]
+    return front
+
+
+def choose(front: List[Dict], target_recall: float) -> Dict:
+    """Fastest configuration meeting the target, else the most accurate one."""
+    for result in front:
+        if result["recall"] >= target_recall:
+            return result
+    return front[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune FAISS index parameters against a recall target")
+    parser.add_argument("--index-dir", default=os.getenv("INDEX_DIR", "/var/data/index"),
+                       help="Directory holding embeddings.npy and the index manifest")
+    parser.add_argument("--target-recall", type=float, default=0.98, help="Minimum recall@k")
+    parser.add_argument("--k", type=int, default=30, help="Neighbours per query (FAISS leg depth)")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries")
+    parser.add_argument("--noise", type=float, default=0.05, help="Gaussian noise added to sampled queries")
+    parser.add_argument("--types", default="flat_ip,hnsw,ivf", help="Comma-separated index types to sweep")
+    parser.add_argument("--rescore-factor", type=int, default=int(os.getenv("FAISS_RESCORE_FACTOR", "4")),
+                       help="Candidate over-fetch for quantized indexes, matching the API setting")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dry-run", action="store_true", help="Report only; leave the index untouched")
+
+    args = parser.parse_args()
+    index_path = Path(args.index_dir)
+
+    if not (index_path / "embeddings.npy").exists():
+        print(f"Error: embeddings not found in {index_path}")
+        return 1
+
+    manifest_path = index_path / MANIFEST_FILENAME
+    manifest = {}
+    if manifest_path.exists():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    embeddings = np.array(np.load(index_path / "embeddings.npy", mmap_mode="r"), dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+    k = min(args.k, len(embeddings))
+
+    # Keep the index's compression mode; tune the graph/list parameters around it
+    quantization = {"quantization": manifest.get("quantization", "none"), "pq_m": manifest.get("pq_m")}
+    if quantization["quantization"] != "none":
+        quantization["rescore_factor"] = args.rescore_factor
+
+    queries = sample_queries(embeddings, args.queries, args.noise, args.seed)
+    _, truth = create_faiss_index(embeddings, "flat_ip").search(queries, k)
+
+    print(f"Sweeping {args.types} (quantization={quantization['quantization']}) over {len(embeddings)} vectors, "
+          f"{len(queries)} queries, recall@{k}...")
+    results = sweep(embeddings, queries, truth, k, args.types.split(","), dict(quantization))
+    front = pareto_front(results)
+
+    print("Pareto front:")
+    for result in front:
+        print(f"  {result['index_type']:8s} build={result['build_params']} search={result['search_params']} "
+              f"recall={result['recall']:.4f} latency={result['latency_ms']:.3f}ms")
+
+    best = choose(front, args.target_recall)
+    print(f"Selected {best['index_type']} (recall={best['recall']:.4f}, latency={best['latency_ms']:.3f}ms)")
+
+    if args.dry_run:
+        return 0
+
+    # The manifest has to describe the index on disk, so rebuild with the chosen config
+    quantization.pop("rescore_factor", None)
+    index = create_faiss_index(embeddings, best["index_type"], **best["build_params"], **quantization)
+    faiss.write_index(index, str(index_path / "faiss.index"))
+    faiss.write_index(index, str(index_path / "faiss_index.index"))
+    np.save(index_path / "embeddings.npy", embeddings)
+
+    manifest.update({
+        "index_type": best["index_type"],
+        "metric": "inner_product",
+        "normalized": True,
+        "dimension": int(embeddings.shape[1]),
+        "num_vectors": int(embeddings.shape[0]),
+        "build_params": best["build_params"],
+        "search_params": best["search_params"],
+        "tuning": {
+            "target_recall": args.target_recall,
+            "k": k,
+            "recall": best["recall"],
+            "latency_ms": best["latency_ms"],
+            "pareto_front": front
+        }
+    })
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"Wrote tuned index and manifest to {index_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -4,8 +4,12 @@ Simple test script for the ETI RAG system.
 Tests the ingestion and API functionality.
 """
 
+import json
 import os
+import random
 import sys
+import tempfile
+import threading
 import time
 import requests
 import subprocess
@@ -119,6 +123,336 @@ def test_queries():
             print(f"❌ Query failed: {e}")
 
 
+# Unit tests run without the API or an OpenAI key: python -m pytest test_system.py -k "not ingestion and not queries and not full_system"
+
+def _plain_filter(metadata, doc_ids=None, sections=None, page_from=None, page_to=None, sources=None):
+    """Rows FilterIndex.select should keep, by a straight scan of the metadata."""
+    rows = []
+    for row, chunk in enumerate(metadata):
+        if doc_ids and chunk["doc_id"] not in doc_ids:
+            continue
+        if sections and not any(heading.strip().lower().startswith(section.strip().lower())
+                                for heading in chunk["headings_path"] for section in sections):
+            continue
+        if page_from is not None and chunk["pages"][1] < page_from:
+            continue
+        if page_to is not None and chunk["pages"][0] > page_to:
+            continue
+        if sources and chunk.get("source", "pdf") not in sources:
+            continue
+        rows.append(row)
+    return rows
+
+
+def _random_metadata(rng, size):
+    metadata = []
+    for _ in range(size):
+        page_start = rng.randint(1, 20)
+        headings = [f"SECTION {rng.randint(1, 4)} – Part", f"{rng.randint(1, 4)}.{rng.randint(1, 3)} Detail"]
+        metadata.append({
+            "doc_id": rng.choice(["handbook", "policies", "benefits"]),
+            "headings_path": headings[:rng.randint(0, 2)],
+            "pages": [page_start, page_start + rng.randint(0, 2)],
+            "source": rng.choice(["pdf", "pdf", "notion"])
+        })
+    return metadata
+
+
+def test_filter_index_matches_plain_filter():
+    """Bitset selection equals a scan, at sizes around the packed byte boundaries."""
+    from app.filters import FilterIndex
+    
+    rng = random.Random(0)
+    for size in (1, 7, 8, 9, 15, 16, 17, 200):
+        metadata = _random_metadata(rng, size)
+        index = FilterIndex(metadata)
+        assert index.select() is None
+        for _ in range(100):
+            filters = {}
+            if rng.random() < 0.4:
+                filters["doc_ids"] = rng.sample(["handbook", "policies", "benefits", "missing"], rng.randint(1, 2))
+            if rng.random() < 0.4:
+                filters["sections"] = [rng.choice(["section 1", "SECTION 2 ", "3.", "2.1", "section"])]
+            if rng.random() < 0.4:
+                filters["page_from"] = rng.randint(0, 22)
+            if rng.random() < 0.4:
+                filters["page_to"] = rng.randint(0, 22)
+            if rng.random() < 0.3:
+                filters["sources"] = [rng.choice(["pdf", "notion"])]
+            
+            expected = _plain_filter(metadata, **filters)
+            selection = index.select(**filters)
+            if selection is None:
+                # Only a selection that keeps every chunk is skipped
+                assert expected == list(range(size)), filters
+                continue
+            assert len(selection) == (size + 7) // 8
+            assert index.rows(selection).tolist() == expected, filters
+            assert len(expected) < size, filters
+            # Padding bits past the last row stay clear
+            assert not (int(selection[-1]) >> (size % 8 or 8))
+
+
+def test_filter_index_neighbourhood():
+    """`near` keeps the given rows and their document's top-level section."""
+    from app.filters import FilterIndex
+    
+    rng = random.Random(1)
+    metadata = _random_metadata(rng, 120)
+    index = FilterIndex(metadata)
+    for _ in range(50):
+        near = rng.sample(range(len(metadata)), rng.randint(1, 3))
+        sections = {(metadata[row]["doc_id"], metadata[row]["headings_path"][0].lower())
+                    for row in near if metadata[row]["headings_path"]}
+        expected = [
+            row for row, chunk in enumerate(metadata)
+            if row in near or (chunk["headings_path"] and (chunk["doc_id"], chunk["headings_path"][0].lower()) in sections)
+        ]
+        assert index.rows(index.neighbourhood(near)).tolist() == expected
+        selection = index.select(near=near, doc_ids=["handbook"])
+        kept = [row for row in expected if metadata[row]["doc_id"] == "handbook"]
+        assert (index.rows(selection).tolist() if selection is not None else list(range(len(metadata)))) == kept
+
+
+def _wait_for_job(queue, job_id, statuses=("succeeded", "failed"), timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} still {queue.get(job_id)['status']} after {timeout}s")
+
+
+def test_job_queue_claims_once():
+    """Two workers on one job table: a job runs once, and a renewed lease is never requeued."""
+    from app.jobs import JobQueue
+    
+    runs = []
+    release = threading.Event()
+    
+    async def handler(payload):
+        runs.append(payload["n"])
+        release.wait(5)
+        return {"n": payload["n"]}
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "jobs.sqlite")
+        first = JobQueue(path, lease_seconds=0.3)
+        second = JobQueue(path, lease_seconds=0.3)
+        for queue in (first, second):
+            queue.register("work", handler)
+        
+        job = first.submit("work", "ann", {"n": 1})
+        _wait_for_job(first, job["job_id"], ("running",))
+        # Past the original lease, kept alive by the heartbeat
+        time.sleep(0.9)
+        second.start()
+        second._run(job["job_id"])
+        release.set()
+        assert _wait_for_job(second, job["job_id"])["result"] == {"n": 1}
+        assert runs == [1]
+        first.shutdown()
+        second.shutdown()
+
+
+def test_job_queue_requeues_expired_leases():
+    """start() re-runs running jobs whose lease lapsed or predates leases, and leaves live ones alone."""
+    from app.jobs import JobQueue
+    
+    runs = []
+    
+    async def handler(payload):
+        runs.append(payload["n"])
+        return {}
+    
+    with tempfile.TemporaryDirectory() as directory:
+        queue = JobQueue(os.path.join(directory, "jobs.sqlite"))
+        queue.register("work", handler)
+        now = time.time()
+        # Rows left behind by other processes: alive, dead, and from before leases
+        for job_id, lease_expires in (("alive", now + 60), ("dead", now - 1), ("legacy", None)):
+            queue.conn.execute(
+                "INSERT INTO jobs (id, kind, owner, status, payload, created_at, updated_at, lease_expires) "
+                "VALUES (?, 'work', 'ann', 'running', ?, ?, ?, ?)",
+                (job_id, f'{{"n": "{job_id}"}}', now, now, lease_expires)
+            )
+        queue.conn.commit()
+        
+        queue.start()
+        _wait_for_job(queue, "dead")
+        _wait_for_job(queue, "legacy")
+        assert sorted(runs) == ["dead", "legacy"]
+        assert queue.get("alive")["status"] == "running"
+        queue.shutdown()
+
+
+def test_job_queue_idempotency_keys():
+    """Unfinished duplicates are reused; succeeded ones only with reuse_finished; failed ones retried."""
+    from app.jobs import JobQueue
+    
+    runs = []
+    release = threading.Event()
+    
+    async def handler(payload):
+        runs.append(payload["n"])
+        release.wait(5)
+        if payload.get("fail"):
+            raise RuntimeError("generation failed")
+        return {"n": payload["n"]}
+    
+    with tempfile.TemporaryDirectory() as directory:
+        queue = JobQueue(os.path.join(directory, "jobs.sqlite"))
+        queue.register("work", handler)
+        
+        job = queue.submit("work", "ann", {"n": 1}, idempotency_key="k")
+        assert queue.submit("work", "ann", {"n": 2}, idempotency_key="k")["job_id"] == job["job_id"]
+        # Another owner with the same key is a different job
+        other = queue.submit("work", "bob", {"n": 3}, idempotency_key="k")
+        assert other["job_id"] != job["job_id"]
+        release.set()
+        assert _wait_for_job(queue, job["job_id"])["result"] == {"n": 1}
+        _wait_for_job(queue, other["job_id"])
+        
+        reused = queue.submit("work", "ann", {"n": 4}, idempotency_key="k")
+        assert (reused["job_id"], reused["status"]) == (job["job_id"], "succeeded")
+        rerun = queue.submit("work", "ann", {"n": 5}, idempotency_key="k", reuse_finished=False)
+        assert rerun["job_id"] == job["job_id"]
+        assert _wait_for_job(queue, job["job_id"])["result"] == {"n": 5}
+        
+        failed = queue.submit("work", "ann", {"n": 6, "fail": True}, idempotency_key="f")
+        assert _wait_for_job(queue, failed["job_id"])["error"] == "generation failed"
+        retried = queue.submit("work", "ann", {"n": 7}, idempotency_key="f")
+        assert retried["job_id"] == failed["job_id"]
+        assert _wait_for_job(queue, failed["job_id"])["result"] == {"n": 7}
+        assert sorted(runs) == [1, 3, 5, 6, 7]
+        queue.shutdown()
+
+
+def test_checklist_stream_split_anywhere():
+    """Categories come out whole however the streamed JSON is split, strings with quotes and braces included."""
+    from app.response_generator import ChecklistStream
+    
+    document = json.dumps({
+        "checklist": [
+            {"category": "Before day one", "items": ["Sign the \"offer\" letter", "Read {policy} [v2]"]},
+            {"category": "Week \\ one }", "items": [{"task": "Meet your buddy", "due": "day 2"}, "Badge: {\"id\"}"]},
+            {"category": "Later", "items": ["Share to C:\\", []]}
+        ],
+        "notes": "trailing {object} \"text\" ]"
+    }, indent=1)
+    expected = json.loads(document)["checklist"]
+    
+    rng = random.Random(2)
+    splits = [[1] * len(document), [len(document)]] + [
+        [rng.randint(1, 12) for _ in range(len(document))] for _ in range(50)
+    ]
+    for sizes in splits:
+        parser = ChecklistStream()
+        categories = []
+        position = 0
+        for size in sizes:
+            if position >= len(document):
+                break
+            categories.extend(parser.feed(document[position:position + size]))
+            position += size
+        assert categories == expected
+
+
+def test_is_follow_up():
+    """Short questions leaning on the last one are follow-ups, unless they name an HR topic of their own."""
+    from app.router import HR_KEYWORDS
+    from app.sessions import is_follow_up, topic_phrases
+    
+    phrases = topic_phrases(["SECTION 4 – Annual Leave", "4.2.1 Notice Period", "Pay"], HR_KEYWORDS)
+    assert "annual leave" in phrases and "notice period" in phrases
+    follow_ups = ["and for part-time staff?", "Does that apply to interns?", "What about contractors?",
+                  "But is it paid?", "how about in Germany?"]
+    standalone = ["For new hires, what is the probation period?", "What about the notice period?",
+                  "And how much annual leave do I get?", "so what?", "Then who approves expenses?",
+                  "Or can I work remotely?", "What happens if this expense claim is submitted after the deadline?"]
+    for query in follow_ups:
+        assert is_follow_up(query, phrases), query
+    for query in standalone:
+        assert not is_follow_up(query, phrases), query
+
+
+def test_session_store_turns_and_expiry():
+    """Sessions are shared through SQLite, keep the last turns, expire when idle and evict least recently used."""
+    from app.sessions import SessionStore
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sessions.sqlite")
+        store = SessionStore(path, max_sessions=2, ttl_seconds=0.5, max_turns=2)
+        other_worker = SessionStore(path, max_sessions=2, ttl_seconds=0.5, max_turns=2)
+        
+        session_id, turns = store.open()
+        assert turns == []
+        for n in range(3):
+            store.add_turn(session_id, f"q{n}", f"topic {n}", [n])
+        same_id, turns = other_worker.open(session_id)
+        assert same_id == session_id
+        assert [turn["query"] for turn in turns] == ["q1", "q2"]
+        assert turns[-1] == {"query": "q2", "topic": "topic 2", "chunk_ids": [2]}
+        
+        # Unknown ids start a new session
+        assert store.open("no-such-session")[0] != "no-such-session"
+        assert len(store) == 2
+        # The oldest of three sessions is evicted
+        time.sleep(0.01)
+        store.open(session_id)
+        store.open()
+        assert len(store) == 2
+        assert store.open(session_id)[0] == session_id
+        
+        time.sleep(0.6)
+        expired_id, turns = store.open(session_id)
+        assert expired_id != session_id and turns == []
+        store.close()
+        other_worker.close()
+
+
+def test_chunk_rows_with_index_gaps():
+    """Follow-up scoping maps stored chunk_index values to rows, also for indexes with gaps."""
+    from app.index_manager import IndexManager
+    
+    with tempfile.TemporaryDirectory() as directory:
+        # Baseline chunking keeps the first chunk's index when it merges two
+        metadata = [{"chunk_index": index, "text": "t"} for index in (0, 2, 3, 5)]
+        with open(os.path.join(directory, "metadata.json"), "w", encoding="utf-8") as f:
+            json.dump(metadata, f)
+        manager = IndexManager()
+        manager._load_metadata(Path(directory))
+        assert manager.rows_for_chunks([5, 2, 4]) == [3, 1]
+
+
+UNIT_TESTS = (
+    test_filter_index_matches_plain_filter,
+    test_filter_index_neighbourhood,
+    test_job_queue_claims_once,
+    test_job_queue_requeues_expired_leases,
+    test_job_queue_idempotency_keys,
+    test_checklist_stream_split_anywhere,
+    test_is_follow_up,
+    test_session_store_turns_and_expiry,
+    test_chunk_rows_with_index_gaps,
+)
+
+
+def run_unit_tests():
+    """Run the tests that need neither the API nor an OpenAI key."""
+    print("🧪 Running unit tests...")
+    failed = 0
+    for test in UNIT_TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    return failed == 0
+
+
 def test_full_system():
     """Run complete system test."""
     print("🚀 ETI RAG System Test")
@@ -156,6 +490,8 @@ def main():
             if wait_for_api():
                 test_queries()
                 return True
+        elif sys.argv[1] == "--unit":
+            return run_unit_tests()
     
     return test_full_system()
 